@@ -1,12 +1,17 @@
 import streamlit as st
-import torch
-from PIL import Image
-from transformers import BlipProcessor, BlipForQuestionAnswering
-import requests
 from datetime import datetime
 import warnings
+import json
+import os
+import tempfile
+import time
+import uuid
+import scanx
+from scanx import answer_question, answer_questions_batched, encode_image
 warnings.filterwarnings("ignore")
 
+rerun_started = time.perf_counter()
+
 
 st.set_page_config(
     page_title="Medical Image Analyzer",
@@ -28,172 +33,269 @@ with st.sidebar:
     
     hf_token = HuggingFace Token  
     
+    st.header("Inference Settings")
+    inference_service_url = os.environ.get("SCANX_INFERENCE_URL")
+    if inference_service_url:
+        inference_precision = "service"
+        st.markdown(f"**Backend:** inference service (`{inference_service_url}`)")
+    elif os.environ.get("SCANX_GRAPH_DIR"):
+        inference_precision = "torchscript"
+        st.markdown(f"**Backend:** TorchScript graph (`{os.environ['SCANX_GRAPH_DIR']}`)")
+    else:
+        inference_precision = st.selectbox("Inference precision", scanx.available_precisions(), help="bf16 is offered only on CPUs with native support; int8 quantizes the vision encoder and answer decoder.")
+    batched_decoding = st.checkbox("Batched question decoding", value=False, help="Answer all selected questions in a single generate call.")
+    max_batch_size = st.number_input("Max questions per batch", min_value=1, max_value=64, value=8, step=1)
+    if inference_precision in ("service", "torchscript"):
+        closed_set_scoring = False
+    else:
+        closed_set_scoring = st.checkbox("Closed-set answers", value=False, help="Rank a fixed set of candidate answers for the yes/no and diagnosis questions instead of generating free text, with a confidence for each.")
+    stream_explanation = st.checkbox("Stream explanation", value=True, help="Show the explanation as it is generated.")
+    explanation_deadline = st.number_input("Explanation deadline (s)", min_value=1, max_value=300, value=45, step=1, help="Fall back to the rule-based analysis if the LLM has not answered in time.")
+    show_stage_timings = st.checkbox("Show stage timings", value=False, help="Per-stage timings for this session's recent studies.")
+    
     st.warning("Note: This is a prototype tool.")
 
 if 'image' not in st.session_state:
     st.session_state.image = None
+if 'image_id' not in st.session_state:
+    st.session_state.image_id = None
+if 'image_preview' not in st.session_state:
+    st.session_state.image_preview = None
+if 'image_size' not in st.session_state:
+    st.session_state.image_size = None
+if 'upload_id' not in st.session_state:
+    st.session_state.upload_id = None
+if 'upload_fingerprint' not in st.session_state:
+    st.session_state.upload_fingerprint = None
+if 'upload_is_dicom' not in st.session_state:
+    st.session_state.upload_is_dicom = False
+if 'upload_key' not in st.session_state:
+    st.session_state.upload_key = None
+if 'image_hash' not in st.session_state:
+    st.session_state.image_hash = None
+if 'image_embeds' not in st.session_state:
+    st.session_state.image_embeds = None
 if 'processor' not in st.session_state:
     st.session_state.processor = None
 if 'blip_model' not in st.session_state:
     st.session_state.blip_model = None
 if 'vqa_result' not in st.session_state:
     st.session_state.vqa_result = None
+if 'vqa_scores' not in st.session_state:
+    st.session_state.vqa_scores = {}
 if 'llm_explanation' not in st.session_state:
     st.session_state.llm_explanation = None
+if 'explanation_pending' not in st.session_state:
+    st.session_state.explanation_pending = False
+if 'explanation_ttft' not in st.session_state:
+    st.session_state.explanation_ttft = None
 if 'custom_question' not in st.session_state:
     st.session_state.custom_question = ""
 if 'patient_info' not in st.session_state:
     st.session_state.patient_info = {}
 if 'standard_questions' not in st.session_state:
-    st.session_state.standard_questions = [
-        "What abnormalities can be seen in this image?",
-        "Is there any pathology visible?",
-        "What might be the diagnosis based on this image?",
-        "Are there any concerning features in this image?",
-        "What is the main finding in this image?"
-    ]
+    st.session_state.standard_questions = list(scanx.STANDARD_QUESTIONS)
+if 'dicom_id' not in st.session_state:
+    st.session_state.dicom_id = None
+if 'analysis_inputs' not in st.session_state:
+    st.session_state.analysis_inputs = None
+if 'analysis_context' not in st.session_state:
+    st.session_state.analysis_context = None
+if 'report' not in st.session_state:
+    st.session_state.report = None
+if 'last_rerun_ms' not in st.session_state:
+    st.session_state.last_rerun_ms = None
+if 'dicom_metadata' not in st.session_state:
+    st.session_state.dicom_metadata = None
+if 'study_date' not in st.session_state:
+    st.session_state.study_date = datetime.now().date()
+if 'study_trace' not in st.session_state:
+    st.session_state.study_trace = None
+if 'study_trace_ids' not in st.session_state:
+    st.session_state.study_trace_ids = []
+
+# Every rerun picks the session's study trace back up, so spans recorded while answering questions,
+# explaining or building the report are attributed to the study being viewed.
+scanx.set_current_trace(st.session_state.study_trace)
+
+# Header values from a newly uploaded DICOM file. Widget state can only be set before the widgets
+# are created, so the upload handler stores them and reruns, and they are applied here.
+if st.session_state.get('dicom_autofill'):
+    dicom_autofill = st.session_state.pop('dicom_autofill')
+    for key in ["patient_id", "patient_name", "patient_age", "patient_dob", "patient_gender", "patient_weight",
+                "patient_height", "study_date", "referring_physician", "image_type", "anatomical_region", "modality_details"]:
+        if dicom_autofill.get(key) is not None:
+            st.session_state[key] = dicom_autofill[key]
 
 @st.cache_resource
-def load_blip_model(token):
-    processor = BlipProcessor.from_pretrained("Salesforce/blip-vqa-base", use_auth_token=token)
-    model = BlipForQuestionAnswering.from_pretrained("Salesforce/blip-vqa-base", use_auth_token=token)
-    return processor, model
-
-def perform_vqa(image, question, processor, model):
-    inputs = processor(image, question, return_tensors="pt")
-    out = model.generate(**inputs)
-    answer = processor.decode(out[0], skip_special_tokens=True)
-    return answer
-
-def get_hf_explanation(vqa_result, image_type, patient_info, token):
-    import requests
-    
-    API_URL = "https://api-inference.huggingface.co/models/google/flan-t5-xl"
-    headers = {"Authorization": f"Bearer {token}"}
-    
-    patient_context = ""
-    if patient_info:
-        patient_context = f"""
-        Patient Information:
-        - Age: {patient_info.get('age', 'Not provided')}
-        - Gender: {patient_info.get('gender', 'Not provided')}
-        - Clinical History: {patient_info.get('clinical_history', 'Not provided')}
-        - Chief Complaint: {patient_info.get('chief_complaint', 'Not provided')}
-        - Current Medications: {patient_info.get('medications', 'Not provided')}
-        """
-    
-    prompt = f"""
-    Based on AI analysis of a {image_type} medical image, the following observations were made:
-    
-    {vqa_result}
-    
-    {patient_context}
-    
-    As a medical expert, provide a detailed explanation of these findings, potential diagnoses, 
-    recommended follow-up tests, and educational information about the identified conditions.
-    """
-    
-    try:
-        response = requests.post(API_URL, headers=headers, json={"inputs": prompt})
-        
-        if response.status_code == 200:
-            result = response.json()
-            if isinstance(result, list) and len(result) > 0:
-                return result[0]["generated_text"]
-            else:
-                return str(result)
-        else:
-            return f"Error from Hugging Face API: {response.status_code}\n\nUsing rule-based analysis instead."
-    except Exception as e:
-        return f"Error generating explanation: {str(e)}\n\nUsing rule-based analysis instead."
-
-def get_rule_based_analysis(vqa_results, patient_info):
-  
-    findings = []
-    diagnosis = "Unknown"
-    
-    for question, answer in vqa_results.items():
-        if "diagnosis" in question.lower():
-            diagnosis = answer
-        if "abnormalities" in question.lower() or "finding" in question.lower():
-            findings.append(answer)
-    
-   
-    patient_age = patient_info.get('age', 'Not provided')
-    patient_gender = patient_info.get('gender', 'Not provided')
-    clinical_history = patient_info.get('clinical_history', 'Not provided')
-    
-    age_related_factors = ""
-    if patient_age != 'Not provided':
+def load_blip_model(token, precision):
+    # SCANX_GRAPH_DIR points at a checkpoint exported with `python -m scanx.export_graph`.
+    if precision == "torchscript":
+        processor, model = scanx.load_graph_backend(os.environ["SCANX_GRAPH_DIR"])
+    else:
+        # Prefers $SCANX_MODEL_DIR or the bundled checkpoint and only falls back to the Hub.
+        processor, model = scanx.load_blip_model(token, precision=precision, warmup=True)
+    # Vectorized preprocessing with preprocessed-image and tokenized-question caches, shared by all sessions.
+    return scanx.FastBlipProcessor(processor), model
+
+@st.cache_resource
+def start_metrics_endpoint(port):
+    # One Prometheus endpoint per process, shared by every session.
+    return scanx.start_metrics_server(host="0.0.0.0", port=port)
+
+if os.environ.get("SCANX_METRICS_PORT"):
+    start_metrics_endpoint(int(os.environ["SCANX_METRICS_PORT"]))
+
+@st.cache_data
+def get_answer_vocabulary(path):
+    return scanx.load_answer_vocabulary(path) if path else scanx.CLOSED_SET_ANSWERS
+
+answer_vocabulary = get_answer_vocabulary(os.environ.get("SCANX_ANSWER_VOCABULARY"))
+
+@st.cache_data
+def get_answer_calibration(path):
+    return scanx.load_calibration(path)
+
+# Written by `python -m scanx.calibrate_answers`; SCANX_ANSWER_TEMPERATURE overrides its temperature.
+answer_calibration = get_answer_calibration(os.environ.get("SCANX_ANSWER_CALIBRATION", scanx.DEFAULT_CALIBRATION_PATH))
+answer_temperature = float(os.environ.get("SCANX_ANSWER_TEMPERATURE", answer_calibration["temperature"]))
+answer_length_normalize = answer_calibration["length_normalize"]
+answer_scores_calibrated = answer_calibration["fitted"] or "SCANX_ANSWER_TEMPERATURE" in os.environ
+
+@st.cache_resource
+def get_inference_client(url):
+    return scanx.InferenceClient(url)
+
+@st.cache_resource
+def get_analysis_cache():
+    return scanx.AnalysisCache(os.environ.get("SCANX_CACHE_PATH", scanx.cache.DEFAULT_CACHE_PATH))
+
+@st.cache_resource
+def get_study_store():
+    # Every analysed study is kept here, so a patient's earlier studies can be found without re-running inference.
+    return scanx.StudyStore(os.environ.get("SCANX_STORE_PATH", scanx.store.DEFAULT_STORE_PATH))
+
+@st.cache_resource
+def get_explanation_client(token):
+    # One client (event loop, request pool) per token; the deadline is passed with each request.
+    return scanx.ExplanationClient(token)
+
+# The model is loaded (and warmed up) when the app starts rather than on the first upload; the
+# cached resource is shared by every session in this process. With SCANX_INFERENCE_URL set, the
+# app is a thin client of `python -m scanx.inference_service` and loads no model at all.
+if inference_service_url is None and (st.session_state.processor is None or st.session_state.blip_model is None or getattr(st.session_state.blip_model, "inference_precision", None) != inference_precision):
+    st.session_state.image_embeds = None
+    with st.spinner("Loading BLIP model..."):
         try:
-            age = int(patient_age)
-            if age > 65:
-                age_related_factors = "Given the patient's advanced age, conditions such as degenerative changes and age-related cardiovascular diseases should be considered."
-            elif age < 18:
-                age_related_factors = "Given the patient's young age, congenital or developmental conditions should be considered."
-        except:
-            pass
-    
-    analysis = f"""
-    ## Medical Image Analysis
-    
-    ### Patient Information
-    - **Patient ID:** {patient_info.get('id', 'Not provided')}
-    - **Age:** {patient_age}
-    - **Gender:** {patient_gender}
-    - **Clinical History:** {clinical_history}
-    - **Chief Complaint:** {patient_info.get('chief_complaint', 'Not provided')}
-    - **Current Medications:** {patient_info.get('medications', 'Not provided')}
-    
-    ### AI-Detected Findings:
-    - Primary observation: {", ".join(findings) if findings else "No specific findings detected"}
-    - Suggested diagnosis: {diagnosis}
-    
-    ### Potential Clinical Significance:
-    
-    {age_related_factors}
-    
-    Based on the AI analysis, the following conditions might be considered:
-    
-    1. **{diagnosis.title() if diagnosis != "Unknown" else "Cardiac Abnormality"}**
-       - Common symptoms include chest pain, shortness of breath, and fatigue
-       - May be associated with structural or functional changes in the heart
-       
-    2. **Differential Diagnoses to Consider:**
-       - Coronary artery disease
-       - Cardiomyopathy
-       - Valvular heart disease
-       - Congestive heart failure
-       - Arrhythmias
-    
-    ### Recommended Follow-up:
-    
-    1. **Additional Imaging:**
-       - Echocardiogram for detailed cardiac structure and function
-       - ECG/EKG for electrical activity
-       - Cardiac stress test to evaluate exercise capacity
-       
-    2. **Laboratory Tests:**
-       - Complete blood count
-       - Cardiac enzymes (troponin, CK-MB)
-       - BNP (B-type natriuretic peptide)
-       - Lipid profile
-       
-    3. **Specialist Consultation:**
-       - Cardiology referral for comprehensive evaluation
-    
-    ### Important Limitations:
-    
-    This analysis is generated by an AI system with limited information. A proper diagnosis requires:
-    - Complete patient history
-    - Physical examination
-    - Multiple diagnostic tests
-    - Clinical expertise
+            st.session_state.processor, st.session_state.blip_model = load_blip_model(hf_token, inference_precision)
+        except Exception as e:
+            st.error(f"Error loading BLIP model: {str(e)}")
+            st.info("Attempting to load model without token...")
+            st.session_state.processor, st.session_state.blip_model = load_blip_model(None, inference_precision)
 
-    """
-    
-    return analysis
+def model_input_size():
+    # (size, resample) the model's processor uses, so uploads can be resized for it once.
+    if inference_service_url:
+        info = get_inference_client(inference_service_url).info()
+        return info["image_size"], info["resample"]
+    image_processor = st.session_state.processor.image_processor
+    return (image_processor.size["width"], image_processor.size["height"]), image_processor.resample
+
+def clear_results():
+    # Answers, scores, explanation and report all belong to the image they were produced from.
+    st.session_state.vqa_result = None
+    st.session_state.vqa_scores = {}
+    st.session_state.llm_explanation = None
+    st.session_state.explanation_pending = False
+    st.session_state.explanation_ttft = None
+    st.session_state.analysis_inputs = None
+    st.session_state.analysis_context = None
+    st.session_state.report = None
+
+def current_study_id():
+    # A DICOM upload is filed under its StudyInstanceUID; any other upload gets a key of its own, so the
+    # same picture uploaded again for another patient or date is saved as a separate study.
+    metadata = st.session_state.dicom_metadata or {}
+    study_key = metadata.get("study_uid") or st.session_state.upload_key
+    image_hash, _, frame = st.session_state.image_hash.partition(":")
+    return f"{study_key}-{image_hash[:16]}" + (f"-{frame}" if frame else "")
 
+def score_study_questions(questions):
+    # Closed-set questions: the candidate->probability dicts are cached as JSON, under a key that
+    # also covers the vocabulary and calibration.
+    cache = get_analysis_cache()
+    model_key = scanx.model_cache_key(st.session_state.blip_model, answer_mode="closed_set", vocabulary=answer_vocabulary, temperature=answer_temperature, length_normalize=answer_length_normalize)
+    cached, missing = cache.get_answers(st.session_state.image_hash, questions, model_key)
+    scores = {question: json.loads(question_scores) for question, question_scores in cached.items()}
+    
+    if missing:
+        if st.session_state.image_embeds is None:
+            st.session_state.image_embeds = encode_image(st.session_state.image, st.session_state.processor, st.session_state.blip_model, image_hash=st.session_state.image_hash)
+        _, new_scores = scanx.score_answers(
+            st.session_state.image_embeds,
+            missing,
+            st.session_state.processor,
+            st.session_state.blip_model,
+            vocabulary=answer_vocabulary,
+            temperature=answer_temperature,
+            length_normalize=answer_length_normalize
+        )
+        cache.put_answers(st.session_state.image_hash, {q: json.dumps(s) for q, s in zip(missing, new_scores)}, model_key)
+        scores.update(zip(missing, new_scores))
+    
+    return {question: scores[question] for question in questions}
+
+def ask_study_questions(questions):
+    # Answers questions against the current study, returning (answers, scores); scores holds a
+    # candidate->probability dict for each question answered by closed-set scoring. Cached answers
+    # are reused and the image is only encoded, once, if some question still needs the model.
+    scores = {}
+    if closed_set_scoring:
+        scored = [question for question in questions if scanx.candidates_for(question, answer_vocabulary)]
+        if scored:
+            scores = score_study_questions(scored)
+    
+    generated = [question for question in questions if question not in scores]
+    answers = generate_study_answers(generated) if generated else {}
+    answers.update({question: next(iter(question_scores)) for question, question_scores in scores.items()})
+    return {question: answers[question] for question in questions}, scores
+
+def generate_study_answers(questions):
+    cache = get_analysis_cache()
+    if inference_service_url:
+        model_key = get_inference_client(inference_service_url).info()["model_key"]
+    else:
+        model_key = scanx.model_cache_key(st.session_state.blip_model)
+    results, missing = cache.get_answers(st.session_state.image_hash, questions, model_key)
+    
+    if missing and inference_service_url:
+        # The service batches these with other sessions' questions.
+        answers = get_inference_client(inference_service_url).answer(st.session_state.image, st.session_state.image_hash, missing)
+        new_results = dict(zip(missing, answers))
+        cache.put_answers(st.session_state.image_hash, new_results, model_key)
+        results.update(new_results)
+    elif missing:
+        if st.session_state.image_embeds is None:
+            st.session_state.image_embeds = encode_image(st.session_state.image, st.session_state.processor, st.session_state.blip_model, image_hash=st.session_state.image_hash)
+        
+        if batched_decoding:
+            answers = answer_questions_batched(
+                st.session_state.image_embeds,
+                missing,
+                st.session_state.processor,
+                st.session_state.blip_model,
+                max_batch_size=max_batch_size
+            )
+            new_results = dict(zip(missing, answers))
+        else:
+            new_results = {}
+            for question in missing:
+                new_results[question] = answer_question(st.session_state.image_embeds, question, st.session_state.processor, st.session_state.blip_model)
+        
+        cache.put_answers(st.session_state.image_hash, new_results, model_key)
+        results.update(new_results)
+    
+    return {question: results[question] for question in questions}
 
 st.header("Patient Information")
 with st.expander("Enter Patient Details", expanded=True):
@@ -211,7 +313,7 @@ with st.expander("Enter Patient Details", expanded=True):
     
     with col3:
         patient_dob = st.date_input("Date of Birth", key="patient_dob")
-        study_date = st.date_input("Study Date", datetime.now(), key="study_date")
+        study_date = st.date_input("Study Date", key="study_date")
         referring_physician = st.text_input("Referring Physician", key="referring_physician")
 
     col1, col2 = st.columns(2)
@@ -249,37 +351,71 @@ with upload_col:
     uploaded_file = st.file_uploader("Choose a medical image...", type=["jpg", "jpeg", "png", "dcm"])
     image_type = st.selectbox(
         "Image type",
-        ["X-ray", "MRI", "CT scan", "Ultrasound", "Microscopy", "Other medical image"]
+        ["X-ray", "MRI", "CT scan", "Ultrasound", "Microscopy", "Other medical image"],
+        key="image_type"
     )
     
     modality_details = st.text_input("Modality Details (e.g., PA view, T2-weighted)", 
-                                     placeholder="Enter specific details about the imaging modality")
+                                     placeholder="Enter specific details about the imaging modality",
+                                     key="modality_details")
     
     anatomical_region = st.selectbox(
         "Anatomical Region",
-        ["Brain", "Chest", "Abdomen", "Pelvis", "Spine", "Extremity", "Cardiac", "Other"]
+        ["Brain", "Chest", "Abdomen", "Pelvis", "Spine", "Extremity", "Cardiac", "Other"],
+        key="anatomical_region"
     )
     
     if uploaded_file is not None:
         try:
-         
-            image = Image.open(uploaded_file)
-            st.session_state.image = image
+            # Streamlit gives every upload its own file_id, so ordinary reruns skip straight past the
+            # fingerprint; a new upload is hashed once and only decoded if its content is new.
+            upload_id = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+            if st.session_state.upload_id != upload_id:
+                st.session_state.upload_id = upload_id
+                st.session_state.upload_fingerprint = scanx.hash_image_bytes(uploaded_file.getvalue())
+                st.session_state.upload_is_dicom = scanx.is_dicom(uploaded_file)
+                st.session_state.upload_key = uuid.uuid4().hex[:12]
+                clear_results()
             
-            if st.session_state.processor is None or st.session_state.blip_model is None:
-                with st.spinner("Loading BLIP model..."):
-                    try:
-                        st.session_state.processor, st.session_state.blip_model = load_blip_model(hf_token)
-                    except Exception as e:
-                        st.error(f"Error loading BLIP model: {str(e)}")
-                        st.info("Attempting to load model without token...")
-                        st.session_state.processor, st.session_state.blip_model = load_blip_model(None)
+            frame = None
+            if st.session_state.upload_is_dicom:
+                if st.session_state.dicom_id != st.session_state.upload_fingerprint:
+                    # Only the header is read here; it fills in the form and gives the frame count.
+                    st.session_state.dicom_id = st.session_state.upload_fingerprint
+                    st.session_state.dicom_metadata = scanx.dicom_metadata(scanx.read_dicom_header(uploaded_file))
+                    st.session_state.dicom_autofill = st.session_state.dicom_metadata
+                    st.rerun()
+                
+                frames = st.session_state.dicom_metadata["number_of_frames"]
+                frame = st.slider("Frame", 0, frames - 1, frames // 2, key="dicom_frame") if frames > 1 else 0
+            else:
+                st.session_state.dicom_id = None
+                st.session_state.dicom_metadata = None
+            
+            # Decoded once per content (and frame); a DICOM frame is windowed and downsampled as it is read.
+            # Only a model-resolution copy and a preview thumbnail are kept.
+            image_id = (st.session_state.upload_fingerprint, frame)
+            if st.session_state.image_id != image_id:
+                st.session_state.image_id = image_id
+                image_hash = st.session_state.upload_fingerprint
+                st.session_state.image_hash = image_hash if frame is None else f"{image_hash}:{frame}"
+                st.session_state.study_trace = scanx.start_study(study_id=st.session_state.image_hash[:12])
+                st.session_state.study_trace_ids = (st.session_state.study_trace_ids + [st.session_state.study_trace.trace_id])[-50:]
+                decoded = scanx.open_medical_image(uploaded_file, frame=frame)
+                size, resample = model_input_size()
+                st.session_state.image_size = decoded.size
+                st.session_state.image_preview = scanx.preview_thumbnail(decoded)
+                st.session_state.image = scanx.resize_for_model(decoded, size, resample)
+                st.session_state.image_embeds = None
+                clear_results()
+
         except Exception as e:
             st.error(f"Error processing image: {str(e)}")
 
 with preview_col:
     if st.session_state.image is not None:
-        st.image(st.session_state.image, caption="Uploaded Medical Image", use_container_width=True)
+        st.image(st.session_state.image_preview, caption="Uploaded Medical Image", use_container_width=True)
+        st.caption(f"Original size: {st.session_state.image_size[0]}x{st.session_state.image_size[1]}")
         
         st.markdown("#### Image Metadata")
         metadata_cols = st.columns(2)
@@ -289,6 +425,13 @@ with preview_col:
         with metadata_cols[1]:
             st.markdown(f"**Details:** {modality_details}")
             st.markdown(f"**Study Date:** {st.session_state.patient_info.get('study_date', 'Not provided')}")
+        
+        if st.session_state.dicom_metadata is not None:
+            dicom_metadata = st.session_state.dicom_metadata
+            st.caption(
+                f"DICOM {dicom_metadata['modality'] or 'unknown modality'}, {dicom_metadata['columns']}x{dicom_metadata['rows']}, "
+                f"{dicom_metadata['number_of_frames']} frame(s); form fields were filled from the header."
+            )
 
 
 if st.session_state.image is not None:
@@ -326,34 +469,59 @@ if st.session_state.image is not None:
             else:
                 all_questions = selected_questions + ([st.session_state.custom_question] if st.session_state.custom_question else [])
                 
-                with st.spinner("Analyzing image..."):
+                # Everything the answers and explanation depend on; re-analysing unchanged inputs is skipped.
+                analysis_inputs = json.dumps({
+                    "image": st.session_state.image_hash,
+                    "questions": all_questions,
+                    "precision": inference_precision,
+                    "closed_set": [answer_vocabulary, answer_temperature, answer_length_normalize] if closed_set_scoring else None,
+                    "image_type": image_type,
+                    "patient_info": st.session_state.patient_info,
+                    "explanation_deadline": explanation_deadline,
+                    "stream_explanation": stream_explanation
+                }, sort_keys=True, default=str)
+                
+                if analysis_inputs == st.session_state.analysis_inputs and st.session_state.vqa_result:
+                    st.info("Nothing has changed since the last analysis; showing its results.")
+                else:
+                    with st.spinner("Analyzing image..."):
                    
-                    combined_results = {}
-                    for question in all_questions:
-                        answer = perform_vqa(st.session_state.image, question, st.session_state.processor, st.session_state.blip_model)
-                        combined_results[question] = answer
+                        try:
+                            combined_results, st.session_state.vqa_scores = ask_study_questions(all_questions)
+                        except scanx.InferenceError as e:
+                            st.error(f"Inference service: {str(e)}. Please try again.")
+                            st.stop()
                     
-                    st.session_state.vqa_result = combined_results
+                        st.session_state.vqa_result = combined_results
                     
                    
-                    combined_vqa_str = "\n".join([f"Question: {q}\nAnswer: {a}" for q, a in combined_results.items()])
-                    
-                    hf_explanation = get_hf_explanation(
-                        combined_vqa_str, 
-                        image_type, 
-                        st.session_state.patient_info,
-                        hf_token
-                    )
-                    
-                    if "Error" in hf_explanation or len(hf_explanation.strip()) < 50:
-                        st.session_state.llm_explanation = get_rule_based_analysis(
-                            combined_results,
-                            st.session_state.patient_info
-                        )
-                    else:
-                        st.session_state.llm_explanation = hf_explanation
+                        st.session_state.explanation_ttft = None
+                        if stream_explanation:
+                            # The explanation is streamed into the results tab below.
+                            st.session_state.llm_explanation = None
+                            st.session_state.explanation_pending = True
+                        else:
+                            explanation_future = get_explanation_client(hf_token).submit(
+                                combined_results,
+                                image_type,
+                                st.session_state.patient_info,
+                                cache=get_analysis_cache(),
+                                deadline=explanation_deadline
+                            )
+                            st.session_state.llm_explanation, _ = explanation_future.result()
                 
-                st.success("Analysis complete! Check the Results tab.")
+                    st.session_state.analysis_inputs = analysis_inputs
+                    # What the study is saved with: the image and form values these results came from.
+                    st.session_state.analysis_context = {
+                        "study_id": current_study_id(),
+                        "image_hash": st.session_state.image_hash,
+                        "patient_info": dict(st.session_state.patient_info),
+                        "image_type": image_type,
+                        "anatomical_region": anatomical_region,
+                        "modality_details": modality_details,
+                        "trace_id": st.session_state.study_trace.trace_id if st.session_state.study_trace else None
+                    }
+                    st.success("Analysis complete! Check the Results tab.")
     
     with result_tab:
         if st.session_state.vqa_result:
@@ -371,70 +539,76 @@ if st.session_state.image is not None:
             st.subheader("Visual Question Answering Results")
             for question, answer in st.session_state.vqa_result.items():
                 st.markdown(f"**Q: {question}**")
-                st.markdown(f"A: {answer}")
+                question_scores = st.session_state.vqa_scores.get(question)
+                if question_scores and question_scores.get(answer) is not None:
+                    st.markdown(f"A: {answer} ({question_scores[answer]:.0%} confidence)")
+                    st.caption(" | ".join(f"{candidate}: {score:.0%}" for candidate, score in list(question_scores.items())[:3]))
+                else:
+                    st.markdown(f"A: {answer}")
+            if st.session_state.vqa_scores and not answer_scores_calibrated:
+                st.caption("Closed-set scores are not calibrated; fit them on labelled images with `python -m scanx.calibrate_answers`.")
+            
+            follow_up_question = st.text_input("Ask a follow-up question about this image:", key="follow_up_question_input")
+            if st.button("Ask Follow-up") and follow_up_question:
+                with st.spinner("Answering follow-up question..."):
+                    try:
+                        follow_up_answers, follow_up_scores = ask_study_questions([follow_up_question])
+                        st.session_state.vqa_result.update(follow_up_answers)
+                        # A re-asked question may now be generated rather than scored, so its old scores go.
+                        for question in follow_up_answers:
+                            st.session_state.vqa_scores.pop(question, None)
+                        st.session_state.vqa_scores.update(follow_up_scores)
+                    except scanx.InferenceError as e:
+                        st.error(f"Inference service: {str(e)}. Please try again.")
+                        st.stop()
+                st.rerun()
             
             st.markdown("---")
             
             st.subheader("AI Medical Explanation")
-            if st.session_state.llm_explanation:
-                st.markdown(st.session_state.llm_explanation)
+            if st.session_state.explanation_pending:
+                explanation_placeholder = st.empty()
+                explanation_stream = get_explanation_client(hf_token).stream(
+                    st.session_state.vqa_result,
+                    image_type,
+                    st.session_state.patient_info,
+                    cache=get_analysis_cache(),
+                    deadline=explanation_deadline
+                )
+                for _ in explanation_stream:
+                    explanation_placeholder.markdown(explanation_stream.text)
                 
-              
-                current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-           
-                patient_info_section = ""
-                if st.session_state.patient_info:
-                    patient_info_section = f"""
-                    # Medical Image Analysis Report
-                    
-                    ## Patient Information
-                    
-                    - **Patient Name:** {st.session_state.patient_info.get('name', 'Not provided')}
-                    - **Patient ID:** {st.session_state.patient_info.get('id', 'Not provided')}
-                    - **Date of Birth:** {st.session_state.patient_info.get('dob', 'Not provided')}
-                    - **Age:** {st.session_state.patient_info.get('age', 'Not provided')}
-                    - **Gender:** {st.session_state.patient_info.get('gender', 'Not provided')}
-                    - **Weight:** {st.session_state.patient_info.get('weight', 'Not provided')} kg
-                    - **Height:** {st.session_state.patient_info.get('height', 'Not provided')} cm
-                    - **Referring Physician:** {st.session_state.patient_info.get('referring_physician', 'Not provided')}
-                    
-                    ### Clinical Information
-                    
-                    - **Chief Complaint:** {st.session_state.patient_info.get('chief_complaint', 'Not provided')}
-                    - **Clinical History:** {st.session_state.patient_info.get('clinical_history', 'Not provided')}
-                    - **Current Medications:** {st.session_state.patient_info.get('medications', 'Not provided')}
-                    - **Allergies:** {st.session_state.patient_info.get('allergies', 'Not provided')}
-                    
-                    ## Study Details
-                    
-                    - **Study Date:** {st.session_state.patient_info.get('study_date', 'Not provided')}
-                    - **Modality:** {image_type}
-                    - **Anatomical Region:** {anatomical_region}
-                    - **Modality Details:** {modality_details}
-                    """
-                else:
-                    patient_info_section = "# Medical Image Analysis Report\n\n*No patient information provided*"
-                
-                report_content = f"""
-                {patient_info_section}
-                
-                ## AI Analysis Results
-                
-                ### Visual Question Answering Results
-                
-                {chr(10).join([f"**Q: {q}**\nA: {a}\n" for q, a in st.session_state.vqa_result.items()])}
-                
-                ### AI Medical Explanation
-                
-                {st.session_state.llm_explanation}
-                
-                ## Report Information
-                
-                - **Generated on:** {current_date}
-                - **Analysis Method:** AI-assisted image analysis (BLIP + LLM)
-                
-                """
+                st.session_state.llm_explanation = explanation_stream.text
+                st.session_state.explanation_ttft = explanation_stream.time_to_first_token
+                st.session_state.explanation_pending = False
+            elif st.session_state.llm_explanation:
+                st.markdown(st.session_state.llm_explanation)
+            
+            if st.session_state.explanation_ttft is not None:
+                st.caption(f"Time to first token: {st.session_state.explanation_ttft:.2f}s")
+            
+            analysis_context = st.session_state.analysis_context
+            if st.session_state.llm_explanation and analysis_context and analysis_context["image_hash"] == st.session_state.image_hash:
+                # Saved to the study store only when the results changed (a follow-up question), not on
+                # every rerun, and always with the form values the analysis ran with; the report itself
+                # is rendered from the store.
+                report_inputs = json.dumps([
+                    analysis_context,
+                    st.session_state.vqa_result,
+                    st.session_state.vqa_scores,
+                    st.session_state.llm_explanation
+                ], sort_keys=True, default=str)
+                if st.session_state.report is None or st.session_state.report[0] != report_inputs:
+                    study_store = get_study_store()
+                    study_store.save({
+                        **analysis_context,
+                        "answers": st.session_state.vqa_result,
+                        "answer_scores": st.session_state.vqa_scores,
+                        "explanation": st.session_state.llm_explanation
+                    })
+                    report_content = study_store.report(analysis_context["study_id"])
+                    st.session_state.report = (report_inputs, report_content, scanx.report_to_text(report_content))
+                _, report_content, pdf_content = st.session_state.report
                 
                 col1, col2 = st.columns(2)
                 with col1:
@@ -446,8 +620,6 @@ if st.session_state.image is not None:
                     )
                 
                 with col2:
-                    
-                    pdf_content = report_content.replace("###", "**").replace("##", "**")
                     st.download_button(
                         "Download Report (TXT)",
                         pdf_content,
@@ -457,10 +629,104 @@ if st.session_state.image is not None:
 else:
     st.info("Please upload a medical image to begin analysis.")
 
+with st.sidebar:
+    if inference_service_url:
+        with st.expander("Inference Service"):
+            try:
+                service_metrics = get_inference_client(inference_service_url).metrics()
+                st.markdown(f"**Queue:** {service_metrics['queue_depth']}/{service_metrics['max_queue']} (max {service_metrics['max_queue_depth']})")
+                st.markdown(f"**Requests:** {service_metrics['requests']} | **Rejected:** {service_metrics['rejected']} | **Expired:** {service_metrics['expired']}")
+                st.markdown(f"**Mean batch:** {service_metrics['mean_batch_questions']:.1f} questions | **Mean queue wait:** {service_metrics['mean_queue_seconds'] * 1000:.0f} ms")
+            except Exception as e:
+                st.error(f"Inference service unavailable: {str(e)}")
+    
+    load_timings = getattr(st.session_state.blip_model, "load_timings", None)
+    if load_timings:
+        with st.expander("Model Load"):
+            st.markdown(f"**Source:** `{load_timings['source']}`")
+            st.markdown(f"**Weights:** {load_timings['weights']} in {load_timings['weights_seconds']:.1f}s")
+            st.markdown(f"**Warmup:** {load_timings.get('warmup_seconds', 0):.1f}s | **Total:** {load_timings['total_seconds']:.1f}s")
+    
+    with st.expander("Analysis Cache"):
+        cache_stats = get_analysis_cache().stats()
+        st.markdown(f"**Hits:** {cache_stats['hits']} | **Misses:** {cache_stats['misses']}")
+        st.markdown(f"**Answers:** {cache_stats['answers_entries']} | **Explanations:** {cache_stats['explanations_entries']}")
+    
+    if show_stage_timings:
+        with st.expander("Stage Timings", expanded=True):
+            if st.session_state.last_rerun_ms is not None:
+                st.caption(f"Previous rerun: {st.session_state.last_rerun_ms:.0f} ms")
+            recent_count = st.number_input("Studies shown", min_value=1, max_value=50, value=5, step=1)
+            studies = scanx.telemetry.recent_studies(set(st.session_state.study_trace_ids))[-recent_count:]
+            if studies:
+                st.dataframe(
+                    [{"study": study["study_id"], "trace": study["trace_id"], **{stage: round(ms, 1) for stage, ms in study["stages_ms"].items()}} for study in reversed(studies)],
+                    use_container_width=True
+                )
+                st.caption("Milliseconds per stage, most recent study first.")
+            else:
+                st.caption("No studies analysed yet.")
+
+with st.expander("Study History"):
+    # Indexed lookups in the study store; a report is only rendered when its study is picked.
+    study_store = get_study_store()
+    history_cols = st.columns(3)
+    with history_cols[0]:
+        history_patient_id = st.text_input("Patient ID", value=st.session_state.patient_info.get('id') or "", key="history_patient_id")
+    with history_cols[1]:
+        history_modality = st.selectbox("Modality", ["Any", "X-ray", "MRI", "CT scan", "Ultrasound", "Microscopy", "Other medical image"], key="history_modality")
+    with history_cols[2]:
+        history_region = st.selectbox("Region", ["Any", "Brain", "Chest", "Abdomen", "Pelvis", "Spine", "Extremity", "Cardiac", "Other"], key="history_region")
+    
+    history = study_store.find(
+        patient_id=history_patient_id or None,
+        modality=None if history_modality == "Any" else history_modality,
+        region=None if history_region == "Any" else history_region,
+        limit=500
+    )
+    if history:
+        st.dataframe(
+            [{"date": study["study_date"], "patient": study["patient_id"], "name": study["patient_name"], "modality": study["modality"], "region": study["region"]} for study in history],
+            use_container_width=True
+        )
+        history_labels = {study["study_id"]: f"{study['study_date'] or 'undated'} | {study['modality']} {study['region']} | {study['patient_id'] or 'no ID'}" for study in history}
+        history_study = st.selectbox("Study", list(history_labels), format_func=history_labels.get, key="history_study")
+        history_col1, history_col2 = st.columns(2)
+        with history_col1:
+            st.download_button(
+                "Download Report (Markdown)",
+                study_store.report(history_study),
+                file_name=f"medical_report_{history_study[:12]}.md",
+                mime="text/markdown",
+                key="history_report"
+            )
+        with history_col2:
+            # The archive is only built when asked for, streamed one report at a time into the session's
+            # temporary directory, overwriting the previous one; session state keeps just its path. The
+            # directory is removed when the session ends (or the process exits).
+            history_ids = [study["study_id"] for study in history]
+            if st.button(f"Prepare ZIP of {len(history)} reports"):
+                if st.session_state.get('history_zip_dir') is None:
+                    st.session_state.history_zip_dir = tempfile.TemporaryDirectory(prefix="scanx-reports-")
+                zip_path = os.path.join(st.session_state.history_zip_dir.name, "medical_reports.zip")
+                study_store.export_zip(history, zip_path)
+                st.session_state.history_zip = (history_ids, zip_path)
+            if st.session_state.get('history_zip') and st.session_state.history_zip[0] == history_ids and os.path.exists(st.session_state.history_zip[1]):
+                with open(st.session_state.history_zip[1], "rb") as zip_file:
+                    st.download_button("Download ZIP", zip_file, file_name="medical_reports.zip", mime="application/zip", key="history_zip_download")
+    else:
+        st.caption("No saved studies match.")
+
 st.markdown("---")
 st.markdown("""
             
 <div style='text-align: center; color: gray; font-size: small;'>
 <p>         DISCLAIMER: This application is for  research purposes only. It is not intended to provide medical advice, diagnosis, or treatment. Always consult with qualified healthcare providers regarding any medical conditions or concerns.</p>
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+# Script time for this rerun, exported as the "rerun" stage in the metrics. It is recorded outside the
+# study's trace, so a study's stage timings only cover work done for it.
+rerun_seconds = time.perf_counter() - rerun_started
+st.session_state.last_rerun_ms = rerun_seconds * 1000
+scanx.telemetry.record_span("rerun", rerun_seconds)
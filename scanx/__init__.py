@@ -0,0 +1,25 @@
+from .cache import AnalysisCache, hash_image_bytes, model_cache_key
+from .dicom import dicom_metadata, is_dicom, iter_dicom_frames, iter_series_frames, load_dicom_image, open_medical_image, read_dicom_header
+from .explain import format_vqa_results, get_rule_based_analysis
+from .findings import DEFAULT_TERMINOLOGY, FindingsEngine, extract_findings, extract_findings_batch, load_terminology
+from .graph_backend import GraphBackendModel, export_graph_backend, load_graph_backend
+from .inference_client import InferenceBusy, InferenceClient, InferenceDeadlineExceeded, InferenceError
+from .llm_client import ExplanationClient, ExplanationDeadlineExceeded, ExplanationError, ExplanationStream
+from .model_loading import BUNDLED_MODEL_DIR, load_blip_model, resolve_model_source, warmup_model
+from .precision import PRECISIONS, apply_precision, available_precisions
+from .preprocess import FastBlipProcessor, ImagePreprocessor, QuestionTokenizer, preview_thumbnail, resize_for_model
+from .reports import build_report, report_to_text
+from .scoring import CLOSED_SET_ANSWERS, DEFAULT_CALIBRATION_PATH, candidates_for, fit_temperature, load_answer_vocabulary, load_calibration, score_answers
+from .store import StudyStore
+from .telemetry import current_trace, increment, record_span, set_current_trace, span, start_metrics_server, start_study, telemetry
+from .vqa import (
+    DEFAULT_MODEL,
+    STANDARD_QUESTIONS,
+    answer_image_questions,
+    answer_question,
+    answer_questions_batched,
+    encode_image,
+    encode_pixel_values,
+    perform_vqa,
+    perform_vqa_batch,
+)
@@ -0,0 +1,287 @@
+# End-to-end benchmark of the analysis path, CPU only and without network access:
+#
+#     python -m scanx.benchmark --output benchmark.json
+#     python -m scanx.benchmark --baseline benchmark.json --output current.json
+#
+# Stages: image decode, preprocessing, the per-rerun cost of an unchanged upload, perform_vqa for one and for all standard questions, the closed-set
+# questions answered by generation and by candidate scoring, the rule-based analysis, report rendering, and
+# the explanation client against the local stub server. Each stage reports p50/p95 latency, throughput and
+# peak RSS. With --baseline, any stage whose p50 is more than --tolerance slower than the baseline is flagged
+# and the exit status is 1.
+#
+# The bundled checkpoint is used when its weights are present; otherwise the model is built with random
+# weights from the bundled config, which has the same architecture and therefore the same cost per token.
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import time
+from datetime import datetime
+
+import numpy as np
+import torch
+import transformers
+from PIL import Image
+from transformers import BlipConfig, BlipForQuestionAnswering, BlipProcessor
+
+from .cache import hash_image_bytes
+from .dicom import open_medical_image, pydicom
+from .evaluate_precision import percentile
+from .explain import get_rule_based_analysis
+from .llm_client import ExplanationClient
+from .model_loading import BUNDLED_MODEL_DIR, load_blip_model, resolve_model_source
+from .preprocess import FastBlipProcessor, preview_thumbnail
+from .reports import build_report, report_to_text
+from .scoring import CLOSED_SET_ANSWERS, score_answers
+from .stub_server import start_stub_server
+from .vqa import STANDARD_QUESTIONS, answer_questions_batched, encode_image, perform_vqa, perform_vqa_batch
+
+SAMPLE_PATIENT = {
+    "id": "BENCH-001",
+    "name": "Benchmark Patient",
+    "age": 54,
+    "gender": "Female",
+    "study_date": "2024-01-01",
+    "chief_complaint": "Shortness of breath",
+    "clinical_history": "Hypertension"
+}
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its own high-water mark; elsewhere the peak is process-lifetime.
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is kilobytes on Linux and bytes on macOS.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if platform.system() == "Darwin" else 1024)
+
+def measure(function, iterations, warmup, items=1):
+    # Returns latency percentiles (ms), throughput (items/sec) and the stage's peak RSS.
+    for _ in range(warmup):
+        function()
+
+    reset_peak_rss()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        "iterations": iterations,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "throughput_per_sec": items * iterations / sum(latencies),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def synthetic_images(seed=0):
+    # Deterministic noise with a smooth gradient, so JPEG/PNG sizes resemble real radiographs more than pure noise.
+    rng = np.random.default_rng(seed)
+    images = {}
+    for size in (512, 2048):
+        gradient = np.linspace(0, 200, size, dtype=np.float32)[None, :]
+        pixels = np.clip(gradient + rng.normal(0, 25, (size, size)), 0, 255).astype(np.uint8)
+        images[f"synthetic_{size}"] = Image.fromarray(pixels, "L").convert("RGB")
+    return images
+
+def encode_image_bytes(image, format):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+def synthetic_dicom_bytes(size=2048, seed=0):
+    # A 12-bit MONOCHROME2 radiograph written in memory; None when pydicom is not installed.
+    if pydicom is None:
+        return None
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.1.1"
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    dataset = Dataset()
+    dataset.file_meta = meta
+    dataset.Modality = "DX"
+    dataset.BodyPartExamined = "CHEST"
+    dataset.Rows = dataset.Columns = size
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = "MONOCHROME2"
+    dataset.BitsAllocated = 16
+    dataset.BitsStored = 12
+    dataset.HighBit = 11
+    dataset.PixelRepresentation = 0
+    dataset.WindowCenter = 2048
+    dataset.WindowWidth = 4096
+    dataset.PixelData = np.random.default_rng(seed).integers(0, 4096, (size, size), dtype=np.uint16).tobytes()
+
+    buffer = io.BytesIO()
+    dataset.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+def load_benchmark_model(model_name, token):
+    # Returns (processor, model, weights) without touching the network unless model_name is a Hub id.
+    source, is_local = resolve_model_source(model_name)
+    if is_local or model_name:
+        processor, model = load_blip_model(token, model_name=source)
+        return processor, model, source
+
+    torch.manual_seed(0)
+    config = BlipConfig.from_pretrained(BUNDLED_MODEL_DIR)
+    model = BlipForQuestionAnswering(config).eval()
+    return BlipProcessor.from_pretrained(BUNDLED_MODEL_DIR), model, "random (bundled config)"
+
+def run_benchmarks(images, processor, model, iterations=10, vqa_iterations=5, warmup=1, stub_delay=0.0):
+    results = {}
+
+    # Decode
+    for name, image in images.items():
+        data = encode_image_bytes(image, "JPEG" if name == "sample" else "PNG")
+        results[f"decode_{name}"] = measure(lambda: open_medical_image(data), iterations, warmup)
+    dicom_data = synthetic_dicom_bytes()
+    if dicom_data is not None:
+        results["decode_synthetic_dicom_2048"] = measure(lambda: open_medical_image(dicom_data), iterations, warmup)
+
+    # Preprocess
+    batch = list(images.values())
+    fast_processor = FastBlipProcessor(processor, image_cache_size=0)
+    results["preprocess_blip_processor"] = measure(lambda: processor(images=batch, return_tensors="pt"), iterations, warmup, items=len(batch))
+    results["preprocess_vectorized"] = measure(lambda: fast_processor(images=batch), iterations, warmup, items=len(batch))
+
+    # Rerun with an unchanged 2048px upload: hashing, decoding and sending the full image to the browser
+    # on every rerun, against sending the thumbnail decoded once on upload.
+    upload = encode_image_bytes(images["synthetic_2048"], "PNG")
+    thumbnail = preview_thumbnail(images["synthetic_2048"])
+    results["rerun_upload_redecode"] = measure(
+        lambda: (hash_image_bytes(upload), encode_image_bytes(open_medical_image(upload), "PNG")),
+        iterations,
+        warmup
+    )
+    results["rerun_upload_cached"] = measure(lambda: encode_image_bytes(thumbnail, "PNG"), iterations * 10, warmup)
+
+    # VQA
+    image = images.get("sample", batch[0])
+    question = STANDARD_QUESTIONS[0]
+    results["perform_vqa_single"] = measure(lambda: perform_vqa(image, question, processor, model), vqa_iterations, warmup)
+    results["perform_vqa_multi"] = measure(
+        lambda: perform_vqa_batch([image], STANDARD_QUESTIONS, processor, model),
+        vqa_iterations,
+        warmup,
+        items=len(STANDARD_QUESTIONS)
+    )
+    closed_set = list(CLOSED_SET_ANSWERS)
+    image_embeds = encode_image(image, processor, model)
+    results["closed_set_generate"] = measure(
+        lambda: answer_questions_batched(image_embeds, closed_set, processor, model),
+        vqa_iterations,
+        warmup,
+        items=len(closed_set)
+    )
+    results["closed_set_score"] = measure(lambda: score_answers(image_embeds, closed_set, processor, model), vqa_iterations, warmup, items=len(closed_set))
+    vqa_results = perform_vqa_batch([image], STANDARD_QUESTIONS, processor, model)[0]
+
+    # Rule-based analysis and report rendering
+    results["rule_based_analysis"] = measure(lambda: get_rule_based_analysis(vqa_results, SAMPLE_PATIENT), iterations * 10, warmup)
+    explanation = get_rule_based_analysis(vqa_results, SAMPLE_PATIENT)
+    render = lambda: report_to_text(build_report(SAMPLE_PATIENT, vqa_results, explanation, "X-ray", "Chest", "PA view"))
+    results["report_rendering"] = measure(render, iterations * 10, warmup)
+
+    # Explanation against the local stub
+    server, url = start_stub_server(delay=stub_delay)
+    client = ExplanationClient(None, api_url=url)
+    try:
+        results["explanation_stub"] = measure(lambda: client.submit(vqa_results, "X-ray", SAMPLE_PATIENT).result(), iterations, warmup)
+    finally:
+        client.close()
+        server.shutdown()
+    return results
+
+def find_regressions(results, baseline, tolerance, min_delta_ms=1.0):
+    # A stage regresses when its p50 is both more than `tolerance` slower and more than min_delta_ms
+    # slower than the baseline; the absolute floor keeps microsecond stages from flagging on noise.
+    regressions = []
+    for stage, result in results.items():
+        previous = baseline.get("stages", {}).get(stage)
+        if (
+            previous
+            and result["p50_ms"] > previous["p50_ms"] * (1 + tolerance)
+            and result["p50_ms"] - previous["p50_ms"] > min_delta_ms
+        ):
+            regressions.append({
+                "stage": stage,
+                "baseline_p50_ms": previous["p50_ms"],
+                "p50_ms": result["p50_ms"],
+                "slowdown": result["p50_ms"] / previous["p50_ms"]
+            })
+    return regressions
+
+def environment(weights):
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "transformers": transformers.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "weights": weights
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scanx.benchmark", description="Benchmark the ScanX analysis path on CPU.")
+    parser.add_argument("--model", help="BLIP VQA checkpoint (defaults to the bundled checkpoint, or random weights from its config)")
+    parser.add_argument("--token", default=os.environ.get("HF_TOKEN"), help="Hugging Face token (defaults to $HF_TOKEN)")
+    parser.add_argument("--image", default="test.jpg", help="Sample image benchmarked alongside the synthetic ones")
+    parser.add_argument("--iterations", type=int, default=10, help="Timed runs per stage (x10 for the sub-millisecond stages)")
+    parser.add_argument("--vqa-iterations", type=int, default=5, help="Timed runs for the perform_vqa stages")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs before each stage")
+    parser.add_argument("--threads", type=int, help="Torch intra-op threads")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50 slowdown against the baseline before flagging")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="Ignore p50 slowdowns smaller than this many milliseconds")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    processor, model, weights = load_benchmark_model(args.model, args.token)
+    images = {"sample": Image.open(args.image).convert("RGB"), **synthetic_images()}
+    stages = run_benchmarks(images, processor, model, iterations=args.iterations, vqa_iterations=args.vqa_iterations, warmup=args.warmup)
+    report = {"environment": environment(weights), "stages": stages, "regressions": []}
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report["regressions"] = find_regressions(stages, json.load(baseline_file), args.tolerance, args.min_delta_ms)
+
+    print(f"{'stage':<30} {'p50 ms':>10} {'p95 ms':>10} {'per sec':>10} {'peak RSS MB':>12}")
+    for stage, result in stages.items():
+        print(f"{stage:<30} {result['p50_ms']:>10.2f} {result['p95_ms']:>10.2f} {result['throughput_per_sec']:>10.1f} {result['peak_rss_mb']:>12.0f}")
+    for regression in report["regressions"]:
+        print(f"REGRESSION {regression['stage']}: p50 {regression['p50_ms']:.2f} ms vs {regression['baseline_p50_ms']:.2f} ms ({regression['slowdown']:.2f}x)")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    return 1 if report["regressions"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,113 @@
+# Throughput of the compiled findings engine on a synthetic ontology and synthetic studies:
+#
+#     python -m scanx.benchmark_findings --concepts 5000 --studies 10000
+#
+# Reports the compile time, single-study latency (p50/p95, checked against --budget-ms), batch throughput,
+# and the per-term substring scan the engine replaced, timed on a sample of the studies.
+import argparse
+import random
+import statistics
+import time
+
+from .evaluate_precision import percentile
+from .findings import DEFAULT_TERMINOLOGY, FindingsEngine
+from .vqa import STANDARD_QUESTIONS
+
+SYLLABLES = ["ab", "cor", "den", "ex", "fil", "gra", "hy", "lo", "ma", "neu", "os", "pul", "ri", "sta", "tho", "ul", "va"]
+FILLER = ["there", "is", "a", "small", "left", "right", "lower", "zone", "with", "mild", "and", "in", "the", "lung"]
+
+
+def synthetic_terminology(concepts, terms_per_concept=4, seed=0):
+    # The built-in concepts plus `concepts` made-up ones, each with several one- to three-word terms.
+    rng = random.Random(seed)
+    terminology = dict(DEFAULT_TERMINOLOGY)
+    for i in range(concepts):
+        terms = []
+        for _ in range(terms_per_concept):
+            words = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 3))]
+            terms.append(" ".join(words))
+        terminology[f"Concept {i}"] = {"terms": terms, "region": rng.choice(["Lungs", "Heart", "Pleura", "Bones"]), "differentials": [], "follow_up": []}
+    return terminology
+
+def synthetic_studies(terminology, studies, seed=0):
+    # Answers to the standard questions mixing filler words, ontology terms and the odd negation.
+    rng = random.Random(seed)
+    terms = [term for concept in terminology.values() for term in concept["terms"]]
+    results = []
+    for _ in range(studies):
+        vqa_results = {}
+        for question in STANDARD_QUESTIONS:
+            words = [rng.choice(FILLER) for _ in range(rng.randint(3, 12))]
+            for _ in range(rng.randint(0, 2)):
+                words.insert(rng.randrange(len(words) + 1), ("no " if rng.random() < 0.2 else "") + rng.choice(terms))
+            vqa_results[question] = " ".join(words)
+        results.append(vqa_results)
+    return results
+
+def substring_scan(terminology, vqa_results):
+    # What matching looked like before: every term checked against every answer.
+    found = set()
+    for answer in vqa_results.values():
+        answer = answer.lower()
+        for label, concept in terminology.items():
+            if any(term in answer for term in concept["terms"]):
+                found.add(label)
+    return found
+
+def benchmark(concepts=5000, studies=10000, batch_size=1000, sample=200, seed=0):
+    terminology = synthetic_terminology(concepts, seed=seed)
+    study_results = synthetic_studies(terminology, studies, seed=seed)
+
+    start = time.perf_counter()
+    engine = FindingsEngine(terminology)
+    compile_seconds = time.perf_counter() - start
+
+    latencies = []
+    for vqa_results in study_results[:sample]:
+        start = time.perf_counter()
+        engine.extract(vqa_results)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(0, len(study_results), batch_size):
+        engine.extract_batch(study_results[i:i + batch_size])
+    batch_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for vqa_results in study_results[:sample]:
+        substring_scan(terminology, vqa_results)
+    substring_seconds = (time.perf_counter() - start) / sample
+
+    return {
+        "terms": len(engine.concepts),
+        "compile_seconds": compile_seconds,
+        "single_p50_ms": percentile(latencies, 0.5) * 1000,
+        "single_p95_ms": percentile(latencies, 0.95) * 1000,
+        "single_mean_ms": statistics.mean(latencies) * 1000,
+        "batch_studies_per_sec": len(study_results) / batch_seconds,
+        "substring_ms_per_study": substring_seconds * 1000
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scanx.benchmark_findings", description="Benchmark the compiled findings engine.")
+    parser.add_argument("--concepts", type=int, default=5000, help="Synthetic concepts added to the built-in terminology")
+    parser.add_argument("--studies", type=int, default=10000, help="Synthetic studies to extract findings from")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Studies per extract_batch call")
+    parser.add_argument("--sample", type=int, default=200, help="Studies timed one at a time, and with the substring scan")
+    parser.add_argument("--budget-ms", type=float, default=10.0, help="Single-study p95 latency budget")
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.concepts, args.studies, args.batch_size, args.sample)
+    print(f"Terms:                 {results['terms']}")
+    print(f"Compile:               {results['compile_seconds']:.2f}s")
+    print(f"Single study:          p50 {results['single_p50_ms']:.2f} ms, p95 {results['single_p95_ms']:.2f} ms")
+    print(f"Batch:                 {results['batch_studies_per_sec']:.0f} studies/sec")
+    print(f"Substring scan:        {results['substring_ms_per_study']:.2f} ms/study ({results['substring_ms_per_study'] / results['single_mean_ms']:.0f}x slower)")
+    if results["single_p95_ms"] > args.budget_ms:
+        print(f"OVER BUDGET: single-study p95 {results['single_p95_ms']:.2f} ms > {args.budget_ms:.2f} ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
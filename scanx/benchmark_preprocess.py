@@ -0,0 +1,70 @@
+# Compare BlipProcessor image preprocessing with scanx.preprocess.ImagePreprocessor:
+#
+#     python -m scanx.benchmark_preprocess --model blip_chest_vqa_finetuned --image test.jpg --batch-size 8
+#
+# Reports images/sec for BlipProcessor, the vectorized stage without its cache, and with every image already
+# cached, plus the largest absolute difference from BlipProcessor's pixel values.
+import argparse
+import os
+import time
+
+from PIL import Image
+
+from .model_loading import load_processor, resolve_model_source
+from .preprocess import ImagePreprocessor, QuestionTokenizer
+from .vqa import STANDARD_QUESTIONS
+
+
+def images_per_second(function, images, repeat):
+    function(images)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(images)
+    return repeat * len(images) / (time.perf_counter() - start)
+
+def max_difference(processor, preprocessor, images):
+    expected = processor(images=images, return_tensors="pt").pixel_values
+    return (preprocessor.preprocess(images) - expected).abs().max().item()
+
+def benchmark(processor, images, repeat=10):
+    preprocessor = ImagePreprocessor(processor.image_processor, cache_size=len(images))
+    hashes = [str(i) for i in range(len(images))]
+    preprocessor.preprocess(images, hashes)
+
+    tokenizer = QuestionTokenizer(processor.tokenizer)
+    questions = list(STANDARD_QUESTIONS)
+    return {
+        "max_abs_difference": max_difference(processor, preprocessor, images),
+        "blip_processor": images_per_second(lambda batch: processor(images=batch, return_tensors="pt"), images, repeat),
+        "vectorized": images_per_second(preprocessor.preprocess, images, repeat),
+        "vectorized_cached": images_per_second(lambda batch: preprocessor.preprocess(batch, hashes), images, repeat),
+        "tokenizer_questions_per_sec": images_per_second(lambda batch: processor(text=batch, padding=True, return_tensors="pt"), questions, repeat * 10),
+        "cached_tokenizer_questions_per_sec": images_per_second(tokenizer.encode, questions, repeat * 10)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scanx.benchmark_preprocess", description="Benchmark the vectorized image preprocessing stage against BlipProcessor.")
+    parser.add_argument("--model", help="BLIP VQA model name or local checkpoint path (defaults to the bundled checkpoint, then the Hub model)")
+    parser.add_argument("--token", default=os.environ.get("HF_TOKEN"), help="Hugging Face token (defaults to $HF_TOKEN)")
+    parser.add_argument("--image", action="append", default=[], help="Image to preprocess (repeatable; defaults to test.jpg)")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images per preprocessing call")
+    parser.add_argument("--repeat", type=int, default=10, help="Timed calls per variant")
+    args = parser.parse_args(argv)
+
+    source, is_local = resolve_model_source(args.model)
+    processor = load_processor(source, is_local, args.token)
+    images = [Image.open(path).convert("RGB") for path in args.image or ["test.jpg"]]
+    images = [images[i % len(images)] for i in range(args.batch_size)]
+
+    results = benchmark(processor, images, repeat=args.repeat)
+    print(f"Max |difference| from BlipProcessor: {results['max_abs_difference']:.2e}")
+    print(f"BlipProcessor:         {results['blip_processor']:>8.1f} images/sec")
+    print(f"Vectorized:            {results['vectorized']:>8.1f} images/sec ({results['vectorized'] / results['blip_processor']:.1f}x)")
+    print(f"Vectorized, cached:    {results['vectorized_cached']:>8.1f} images/sec")
+    print(f"Tokenizer:             {results['tokenizer_questions_per_sec']:>8.1f} questions/sec")
+    print(f"Cached tokenization:   {results['cached_tokenizer_questions_per_sec']:>8.1f} questions/sec")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
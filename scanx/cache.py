@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .database import SQLiteDatabase
+from .telemetry import increment
+
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "scanx", "cache.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    answer TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_accessed_at ON answers (accessed_at);
+CREATE TABLE IF NOT EXISTS explanations (
+    key TEXT PRIMARY KEY,
+    explanation TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS explanations_accessed_at ON explanations (accessed_at);
+"""
+
+TABLES = {"answers": "answer", "explanations": "explanation"}
+
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".pth")
+
+
+def sha256(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def hash_image_bytes(data):
+    return sha256(data)
+
+def normalize_question(question):
+    return " ".join(question.lower().split())
+
+def weights_fingerprint(path):
+    # Name, size, mtime and last 64 KiB of every weight file in a local checkpoint (or TorchScript export)
+    # directory, so retrained weights saved over the old ones change it without reading the whole file.
+    # None for Hub models, whose revision already identifies the weights.
+    if not path or not os.path.isdir(path):
+        return None
+    entries = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith(WEIGHT_SUFFIXES):
+            weights_path = os.path.join(path, name)
+            stat = os.stat(weights_path)
+            with open(weights_path, "rb") as weights_file:
+                weights_file.seek(max(stat.st_size - 65536, 0))
+                tail = sha256(weights_file.read())
+            entries.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}:{tail}")
+    return sha256("\n".join(entries)) if entries else None
+
+def model_cache_key(model, **generate_kwargs):
+    # Any change to the checkpoint, its weights, revision, precision or generation settings yields a new
+    # key, so stale answers are never served after a model change; they simply age out. Answers are
+    # decoded by model.text_decoder.generate, which reads the decoder's own generation config, and a
+    # graph export decodes with the settings in its metadata.
+    config = model.config
+    text_decoder = getattr(model, "text_decoder", None)
+    decoder_generation = getattr(text_decoder, "generation_config", None)
+    identity = {
+        "name": getattr(config, "_name_or_path", None),
+        "revision": getattr(config, "_commit_hash", None),
+        "weights": weights_fingerprint(getattr(config, "_name_or_path", None)),
+        "config": sha256(config.to_json_string()),
+        "dtype": str(model.dtype),
+        "precision": getattr(model, "inference_precision", "fp32"),
+        "generation": model.generation_config.to_json_string() if model.generation_config is not None else None,
+        "decoder_generation": decoder_generation.to_json_string() if decoder_generation is not None else None,
+        "graph": getattr(model, "metadata", None),
+        "generate_kwargs": generate_kwargs
+    }
+    return sha256(json.dumps(identity, sort_keys=True, default=str))
+
+def answer_key(image_hash, question, model_key):
+    return sha256(f"{image_hash}\0{normalize_question(question)}\0{model_key}")
+
+def explanation_key(prompt, model_id):
+    return sha256(f"{sha256(prompt)}\0{model_id}")
+
+
+class AnalysisCache(SQLiteDatabase):
+    # Answers and explanations, evicted by age and by total size.
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=256 * 1024 * 1024, max_age_seconds=30 * 24 * 3600, evict_every=100):
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        super().__init__(path, SCHEMA)
+
+    def _get(self, table, key):
+        column = TABLES[table]
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            f"SELECT {column}, created_at FROM {table} WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is not None and now - row[1] > self.max_age_seconds:
+            connection.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        increment("cache_misses" if row is None else "cache_hits", table=table)
+        if row is None:
+            return None
+
+        connection.execute(f"UPDATE {table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def _put_many(self, table, items):
+        column = TABLES[table]
+        now = time.time()
+        rows = [(key, value, len(value.encode("utf-8")), now, now) for key, value in items]
+        if not rows:
+            return
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO {table} (key, {column}, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        with self._lock:
+            self._writes += len(rows)
+            due = self._writes >= self.evict_every
+            if due:
+                self._writes = 0
+        if due:
+            self.evict()
+
+    def get_answer(self, image_hash, question, model_key):
+        return self._get("answers", answer_key(image_hash, question, model_key))
+
+    def get_answers(self, image_hash, questions, model_key):
+        # Returns (cached question->answer dict, questions that still need inference).
+        cached = {}
+        missing = []
+        for question in questions:
+            answer = self.get_answer(image_hash, question, model_key)
+            if answer is None:
+                missing.append(question)
+            else:
+                cached[question] = answer
+        return cached, missing
+
+    def put_answers(self, image_hash, answers, model_key):
+        self._put_many("answers", [(answer_key(image_hash, q, model_key), a) for q, a in answers.items()])
+
+    def get_explanation(self, prompt, model_id):
+        return self._get("explanations", explanation_key(prompt, model_id))
+
+    def put_explanation(self, prompt, model_id, explanation):
+        self._put_many("explanations", [(explanation_key(prompt, model_id), explanation)])
+
+    def evict(self):
+        # Drops expired rows, then least recently used rows until the cache fits in max_bytes.
+        connection = self._connection()
+        cutoff = time.time() - self.max_age_seconds
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for table in TABLES:
+                connection.execute(f"DELETE FROM {table} WHERE created_at < ?", (cutoff,))
+
+            total = sum(connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0] for table in TABLES)
+            if total > self.max_bytes:
+                rows = connection.execute(
+                    " UNION ALL ".join(f"SELECT '{table}', key, size, accessed_at FROM {table}" for table in TABLES)
+                    + " ORDER BY accessed_at"
+                )
+                stale = []
+                for table, key, size, _ in rows:
+                    if total <= self.max_bytes:
+                        break
+                    stale.append((table, key))
+                    total -= size
+                for table, key in stale:
+                    connection.execute(f"DELETE FROM {table} WHERE key = ?", (key,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def clear(self):
+        connection = self._connection()
+        for table in TABLES:
+            connection.execute(f"DELETE FROM {table}")
+
+    def stats(self):
+        connection = self._connection()
+        stats = {"hits": self.hits, "misses": self.misses}
+        for table in TABLES:
+            entries, size = connection.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {table}").fetchone()
+            stats[f"{table}_entries"] = entries
+            stats[f"{table}_bytes"] = size
+        return stats
@@ -0,0 +1,87 @@
+# Fit the closed-set answer calibration on labelled images and save it where the app reads it:
+#
+#     python -m scanx.calibrate_answers labels.jsonl
+#
+# Each line of the label file is {"image": path, "question": ..., "answer": ...}, as for
+# scanx.evaluate_precision. Items whose question has no closed-set candidates, or whose answer is not one
+# of them, are skipped. A temperature is fitted both for summed and for per-token log-likelihoods, and
+# whichever gives the correct answers the lower negative log-likelihood is written out.
+import argparse
+import json
+import os
+from collections import defaultdict
+
+from .cache import normalize_question
+from .dicom import open_medical_image
+from .evaluate_precision import read_labels
+from .model_loading import load_blip_model
+from .scoring import CLOSED_SET_ANSWERS, DEFAULT_CALIBRATION_PATH, answer_nll, candidate_log_likelihoods, candidates_for, fit_temperature, load_answer_vocabulary
+from .vqa import encode_image
+
+
+def labelled_candidates(items, vocabulary=CLOSED_SET_ANSWERS):
+    # Groups the usable items by image: {image: [(question, candidates, index of the labelled answer)]}.
+    questions_per_image = defaultdict(list)
+    for item in items:
+        candidates = candidates_for(item["question"], vocabulary)
+        answers = [normalize_question(candidate) for candidate in candidates or []]
+        label = normalize_question(item.get("answer") or "")
+        if label in answers:
+            questions_per_image[item["image"]].append((item["question"], candidates, answers.index(label)))
+    return questions_per_image
+
+def fit_calibration(items, processor, model, vocabulary=CLOSED_SET_ANSWERS):
+    questions_per_image = labelled_candidates(items, vocabulary)
+    if not questions_per_image:
+        raise ValueError("No labelled answers among the closed-set candidates")
+
+    log_likelihoods = {False: [], True: []}
+    labels = []
+    for image_path, labelled in questions_per_image.items():
+        image_embeds = encode_image(open_medical_image(image_path), processor, model)
+        questions, candidates_per_question, image_labels = zip(*labelled)
+        for length_normalize, scores in log_likelihoods.items():
+            scores.extend(candidate_log_likelihoods(image_embeds, list(questions), list(candidates_per_question), processor, model, length_normalize))
+        labels.extend(image_labels)
+
+    fits = []
+    for length_normalize, scores in log_likelihoods.items():
+        temperature = fit_temperature(scores, labels)
+        fits.append({
+            "temperature": temperature,
+            "length_normalize": length_normalize,
+            "nll": answer_nll(scores, labels, temperature),
+            "accuracy": sum(int(score.argmax()) == label for score, label in zip(scores, labels)) / len(labels)
+        })
+    # Uncalibrated is what score_answers gives by default: summed log-likelihoods at temperature 1.
+    return dict(min(fits, key=lambda fit: fit["nll"]), uncalibrated_nll=answer_nll(log_likelihoods[False], labels), items=len(labels))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scanx.calibrate_answers", description="Fit the closed-set answer calibration on a labelled question set.")
+    parser.add_argument("labels", help="JSONL file of {image, question, answer} items")
+    parser.add_argument("--model", help="BLIP VQA model name or local checkpoint path (defaults to the bundled checkpoint, then the Hub model)")
+    parser.add_argument("--token", default=os.environ.get("HF_TOKEN"), help="Hugging Face token (defaults to $HF_TOKEN)")
+    parser.add_argument("--vocabulary", default=os.environ.get("SCANX_ANSWER_VOCABULARY"), help="Candidate answers JSON (defaults to $SCANX_ANSWER_VOCABULARY, then the built-in set)")
+    parser.add_argument("--output", default=os.environ.get("SCANX_ANSWER_CALIBRATION", DEFAULT_CALIBRATION_PATH), help="Where to write the calibration (defaults to $SCANX_ANSWER_CALIBRATION, which the app reads)")
+    args = parser.parse_args(argv)
+
+    processor, model = load_blip_model(args.token, model_name=args.model)
+    vocabulary = load_answer_vocabulary(args.vocabulary) if args.vocabulary else CLOSED_SET_ANSWERS
+    calibration = fit_calibration(read_labels(args.labels), processor, model, vocabulary)
+
+    print(
+        f"{calibration['items']} labelled answers: temperature {calibration['temperature']:.3f}, "
+        f"{'per-token' if calibration['length_normalize'] else 'summed'} log-likelihoods, "
+        f"NLL {calibration['uncalibrated_nll']:.3f} -> {calibration['nll']:.3f}, accuracy {calibration['accuracy']:.3f}"
+    )
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w") as output_file:
+        json.dump(calibration, output_file, indent=2)
+    print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,96 @@
+import argparse
+import logging
+import os
+
+import torch
+
+from .cache import DEFAULT_CACHE_PATH, AnalysisCache
+from .graph_backend import load_graph_backend
+from .llm_client import ExplanationClient
+from .model_loading import load_blip_model, resolve_model_source
+from .pipeline import run_pipeline
+from .precision import PRECISIONS
+from .preprocess import FastBlipProcessor
+from .store import DEFAULT_STORE_PATH, StudyStore
+from .vqa import STANDARD_QUESTIONS
+
+
+def read_questions(path):
+    with open(path) as questions_file:
+        return [line.strip() for line in questions_file if line.strip()]
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m scanx",
+        description="Run ScanX VQA analysis over a directory of images or a JSONL manifest of studies."
+    )
+    parser.add_argument("source", help="Directory of images, or a JSONL manifest with one study per line")
+    parser.add_argument("-o", "--output-dir", required=True, help="Where results.jsonl and reports/ are written")
+    parser.add_argument("--model", help="BLIP VQA model name or local checkpoint path (defaults to the bundled checkpoint, then the Hub model)")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32", help="Inference precision (see python -m scanx.evaluate_precision)")
+    parser.add_argument("--graph-backend", metavar="DIR", help="Use a TorchScript export from python -m scanx.export_graph instead of --model")
+    parser.add_argument("--token", default=os.environ.get("HF_TOKEN"), help="Hugging Face token (defaults to $HF_TOKEN)")
+    parser.add_argument("--questions-file", help="Text file with one question per line (defaults to the standard questions)")
+    parser.add_argument("--explanation", choices=["rule", "llm"], default="rule", help="Rule-based analysis or Hugging Face LLM explanation")
+    parser.add_argument("--explanation-deadline", type=float, default=45, help="Seconds before an LLM explanation falls back to the rule-based analysis")
+    parser.add_argument("--explanation-concurrency", type=int, default=4, help="Maximum concurrent LLM explanation requests")
+    parser.add_argument("--image-type", default="X-ray", help="Modality for studies that do not specify one")
+    parser.add_argument("--region", default="Chest", help="Anatomical region for studies that do not specify one")
+    parser.add_argument("--batch-size", type=int, default=8, help="Images encoded per vision batch")
+    parser.add_argument("--max-question-batch", type=int, default=32, help="Maximum (image, question) pairs per generate call")
+    parser.add_argument("--workers", type=int, default=max((os.cpu_count() or 2) // 2, 1), help="Decode/preprocess worker processes (0 runs inline)")
+    parser.add_argument("--threads", type=int, help="Torch intra-op threads for inference")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="SQLite cache for answers and explanations")
+    parser.add_argument("--no-cache", action="store_true", help="Always run inference instead of reusing cached answers")
+    parser.add_argument("--store", nargs="?", const=DEFAULT_STORE_PATH, help=f"Also save studies to a SQLite study store (defaults to {DEFAULT_STORE_PATH} when given without a path)")
+    parser.add_argument("--no-resume", action="store_true", help="Start over instead of skipping studies already in results.jsonl")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    questions = read_questions(args.questions_file) if args.questions_file else STANDARD_QUESTIONS
+    if args.graph_backend:
+        processor, model = load_graph_backend(args.graph_backend)
+    else:
+        processor, model = load_blip_model(args.token, model_name=args.model, precision=args.precision)
+        logging.info("Loaded %(source)s in %(total_seconds).1fs (weights via %(weights)s)", model.load_timings)
+    # Pixel values come from the preprocessing workers; the wrapper caches the tokenized questions.
+    processor = FastBlipProcessor(processor, image_cache_size=0)
+    cache = None if args.no_cache else AnalysisCache(args.cache)
+    client = None
+    if args.explanation == "llm":
+        client = ExplanationClient(args.token, deadline=args.explanation_deadline, max_concurrency=args.explanation_concurrency)
+
+    stats = run_pipeline(
+        args.source,
+        args.output_dir,
+        processor,
+        model,
+        questions=questions,
+        token=args.token,
+        explanation_mode=args.explanation,
+        batch_size=args.batch_size,
+        max_question_batch=args.max_question_batch,
+        workers=args.workers,
+        resume=not args.no_resume,
+        model_name=args.graph_backend or resolve_model_source(args.model)[0],
+        study_defaults={"image_type": args.image_type, "anatomical_region": args.region},
+        cache=cache,
+        client=client,
+        store=StudyStore(args.store) if args.store else None
+    )
+    if client is not None:
+        client.close()
+
+    logging.info(
+        "Done: %d processed, %d failed, %d skipped in %.1fs (%.2f images/sec)",
+        stats["processed"], stats["failed"], stats["skipped"], stats["elapsed"], stats["images_per_sec"]
+    )
+    if cache is not None:
+        logging.info("Cache: %s", cache.stats())
+    return 0 if stats["failed"] == 0 else 1
@@ -0,0 +1,26 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteDatabase:
+    # Base for the analysis cache and the study store. SQLite in WAL mode lets several Streamlit worker
+    # processes and the bulk pipeline read and write the same file; each thread gets its own connection.
+
+    def __init__(self, path, schema):
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(schema)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
@@ -0,0 +1,221 @@
+import io
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from .telemetry import span
+
+try:
+    import pydicom
+    from pydicom.pixels import iter_pixels
+except ImportError:
+    pydicom = None
+
+
+# Sized for BlipProcessor, which resizes to 384x384; frames are block-averaged down to no less than this
+# before any float work, so a 3000x2500 radiograph is windowed at roughly 1/50th of its pixel count.
+DEFAULT_TARGET_SIZE = 384
+
+MODALITY_IMAGE_TYPES = {
+    "CR": "X-ray",
+    "DX": "X-ray",
+    "RG": "X-ray",
+    "MG": "X-ray",
+    "XA": "X-ray",
+    "RF": "X-ray",
+    "MR": "MRI",
+    "CT": "CT scan",
+    "US": "Ultrasound",
+    "SM": "Microscopy",
+    "GM": "Microscopy"
+}
+
+BODY_PART_REGIONS = {
+    "CHEST": "Chest",
+    "LUNG": "Chest",
+    "THORAX": "Chest",
+    "BREAST": "Chest",
+    "HEAD": "Brain",
+    "BRAIN": "Brain",
+    "SKULL": "Brain",
+    "ABDOMEN": "Abdomen",
+    "PELVIS": "Pelvis",
+    "HIP": "Pelvis",
+    "SPINE": "Spine",
+    "CSPINE": "Spine",
+    "TSPINE": "Spine",
+    "LSPINE": "Spine",
+    "HEART": "Cardiac",
+    "EXTREMITY": "Extremity",
+    "ARM": "Extremity",
+    "LEG": "Extremity",
+    "HAND": "Extremity",
+    "FOOT": "Extremity",
+    "KNEE": "Extremity",
+    "SHOULDER": "Extremity",
+    "ELBOW": "Extremity",
+    "WRIST": "Extremity",
+    "ANKLE": "Extremity"
+}
+
+SEX_CODES = {"M": "Male", "F": "Female", "O": "Other"}
+
+HEADER_TAGS = [
+    "StudyInstanceUID", "Modality", "BodyPartExamined", "StudyDate", "StudyDescription", "SeriesDescription", "ViewPosition",
+    "PatientID", "PatientName", "PatientBirthDate", "PatientSex", "PatientAge", "PatientWeight", "PatientSize",
+    "ReferringPhysicianName", "InstanceNumber", "NumberOfFrames", "Rows", "Columns", "SamplesPerPixel",
+    "PhotometricInterpretation", "RescaleSlope", "RescaleIntercept", "WindowCenter", "WindowWidth"
+]
+
+
+def require_pydicom():
+    if pydicom is None:
+        raise ImportError("Reading DICOM files needs pydicom 3 or later: pip install 'pydicom>=3'")
+
+def is_dicom(source):
+    # Part 10 files carry "DICM" after a 128-byte preamble; accepts a path, bytes or a seekable file.
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source[128:132]) == b"DICM"
+    if isinstance(source, (str, Path)):
+        with open(source, "rb") as dicom_file:
+            return dicom_file.read(132)[128:] == b"DICM"
+    position = source.tell()
+    header = source.read(132)
+    source.seek(position)
+    return header[128:] == b"DICM"
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+def read_dicom_header(source):
+    # Reads only the tags ScanX uses and stops before the pixel data, so this is cheap even for large volumes.
+    require_pydicom()
+    return pydicom.dcmread(_rewind(source), stop_before_pixels=True, specific_tags=HEADER_TAGS)
+
+def _first(value):
+    # Window center/width may be multi-valued; the first pair is the default presentation.
+    if isinstance(value, pydicom.multival.MultiValue):
+        return value[0] if len(value) else None
+    return value
+
+def _parse_date(value):
+    if not value or len(str(value)) != 8:
+        return None
+    value = str(value)
+    try:
+        return date(int(value[:4]), int(value[4:6]), int(value[6:]))
+    except ValueError:
+        return None
+
+def _parse_age(value):
+    # DICOM ages look like "045Y"; months, weeks and days round down to 0 years.
+    if not value:
+        return None
+    value = str(value).strip()
+    if value[:-1].isdigit():
+        return int(value[:-1]) if value[-1].upper() == "Y" else 0
+    return None
+
+def dicom_metadata(header):
+    # Maps header fields onto the app's form values; anything missing is None.
+    modality = header.get("Modality")
+    body_part = str(header.get("BodyPartExamined") or "").upper().replace(" ", "")
+    name = header.get("PatientName")
+    referring = header.get("ReferringPhysicianName")
+    details = [str(value) for value in (header.get("ViewPosition"), header.get("SeriesDescription") or header.get("StudyDescription")) if value]
+
+    return {
+        "study_uid": str(header.get("StudyInstanceUID") or "") or None,
+        "modality": modality,
+        "image_type": MODALITY_IMAGE_TYPES.get(modality, "Other medical image") if modality else None,
+        "anatomical_region": BODY_PART_REGIONS.get(body_part, "Other") if body_part else None,
+        "modality_details": ", ".join(details) or None,
+        "study_date": _parse_date(header.get("StudyDate")),
+        "patient_id": str(header.get("PatientID") or "") or None,
+        "patient_name": str(name).replace("^", " ").strip() if name else None,
+        "patient_dob": _parse_date(header.get("PatientBirthDate")),
+        "patient_gender": SEX_CODES.get(header.get("PatientSex")),
+        "patient_age": _parse_age(header.get("PatientAge")),
+        "patient_weight": float(header.PatientWeight) if header.get("PatientWeight") else None,
+        "patient_height": float(header.PatientSize) * 100 if header.get("PatientSize") else None,
+        "referring_physician": str(referring).replace("^", " ").strip() if referring else None,
+        "number_of_frames": int(header.get("NumberOfFrames") or 1),
+        "rows": header.get("Rows"),
+        "columns": header.get("Columns")
+    }
+
+def downsample(frame, target_size=DEFAULT_TARGET_SIZE):
+    # Integer block-mean over the first two axes, keeping the short side >= target_size. Done on the
+    # raw integer frame before windowing, so the float work touches only the reduced array.
+    factor = min(frame.shape[0], frame.shape[1]) // target_size
+    if factor < 2:
+        return frame.astype(np.float32)
+    rows = frame.shape[0] // factor * factor
+    columns = frame.shape[1] // factor * factor
+    blocks = frame[:rows, :columns].reshape(rows // factor, factor, columns // factor, factor, *frame.shape[2:])
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+def apply_window(frame, header):
+    # Modality rescale, then the header's window/level (or the frame's 0.5-99.5 percentile range when
+    # there is none) mapped to 0-255. MONOCHROME1 stores inverted grey levels.
+    slope = float(header.get("RescaleSlope") or 1)
+    intercept = float(header.get("RescaleIntercept") or 0)
+    frame = frame * slope + intercept
+
+    center = _first(header.get("WindowCenter"))
+    width = _first(header.get("WindowWidth"))
+    if center is not None and width is not None and float(width) > 1:
+        low = float(center) - float(width) / 2
+        high = float(center) + float(width) / 2
+    else:
+        low, high = np.percentile(frame, (0.5, 99.5))
+    if high <= low:
+        high = low + 1
+
+    frame = np.clip((frame - low) * (255.0 / (high - low)), 0, 255)
+    if header.get("PhotometricInterpretation") == "MONOCHROME1":
+        frame = 255 - frame
+    return frame.astype(np.uint8)
+
+def frame_to_image(frame, header, target_size=DEFAULT_TARGET_SIZE):
+    frame = downsample(frame, target_size)
+    if frame.ndim == 3:
+        # Colour (ultrasound, microscopy) frames are already display values; pydicom converts YBR to RGB.
+        return Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8), "RGB")
+    return Image.fromarray(apply_window(frame, header), "L").convert("RGB")
+
+def iter_dicom_frames(source, indices=None, target_size=DEFAULT_TARGET_SIZE):
+    # Yields one RGB PIL image per frame. Frames are decoded one at a time, so a multi-frame volume is
+    # never fully resident; indices restricts decoding to the requested frames.
+    require_pydicom()
+    header = read_dicom_header(source)
+    for frame in iter_pixels(_rewind(source), indices=indices):
+        yield frame_to_image(frame, header, target_size)
+
+def load_dicom_image(source, frame=None, target_size=DEFAULT_TARGET_SIZE):
+    # A single frame; the middle one of a multi-frame file unless frame is given.
+    if frame is None:
+        frames = int(read_dicom_header(source).get("NumberOfFrames") or 1)
+        frame = frames // 2
+    return next(iter_dicom_frames(source, indices=[frame], target_size=target_size))
+
+def iter_series_frames(paths, target_size=DEFAULT_TARGET_SIZE):
+    # Yields (path, image) for every frame of a series spread over many files, ordered by InstanceNumber
+    # from the headers alone. Only one file's frame is decoded at a time.
+    ordered = sorted(paths, key=lambda path: int(read_dicom_header(path).get("InstanceNumber") or 0))
+    for path in ordered:
+        for image in iter_dicom_frames(path, target_size=target_size):
+            yield path, image
+
+def open_medical_image(source, frame=None):
+    # Image.open for ordinary formats, the DICOM path above for DICOM; always returns RGB.
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with span("image_decode"):
+        if is_dicom(source):
+            return load_dicom_image(source, frame=frame)
+        return Image.open(source).convert("RGB")
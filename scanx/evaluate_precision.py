@@ -0,0 +1,132 @@
+# Compare BLIP inference precisions on a labelled question set:
+#
+#     python -m scanx.evaluate_precision labels.jsonl --modes fp32 bf16 int8 --output precision.json
+#
+# Each line of the label file is {"image": path, "question": ..., "answer": ...}; "answer" is optional.
+# Every mode runs in its own process so peak RSS is measured per mode.
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from .cache import normalize_question
+from .model_loading import load_blip_model
+from .precision import available_precisions
+from .vqa import perform_vqa
+
+
+def read_labels(path):
+    path = Path(path)
+    items = []
+    with open(path) as labels_file:
+        for line in labels_file:
+            if line.strip():
+                item = json.loads(line)
+                image_path = Path(item["image"])
+                if not image_path.is_absolute():
+                    item["image"] = str(path.parent / image_path)
+                items.append(item)
+    return items
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(round(q * (len(ordered) - 1))), len(ordered) - 1)]
+
+def run_mode(model_name, token, precision, items, warmup):
+    start = time.perf_counter()
+    processor, model = load_blip_model(token, model_name=model_name, precision=precision)
+    load_seconds = time.perf_counter() - start
+
+    images = {path: Image.open(path).convert("RGB") for path in {item["image"] for item in items}}
+    for item in items[:warmup]:
+        perform_vqa(images[item["image"]], item["question"], processor, model)
+
+    answers = []
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        answers.append(perform_vqa(images[item["image"]], item["question"], processor, model))
+        latencies.append(time.perf_counter() - start)
+
+    # ru_maxrss is reported in kilobytes on Linux.
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {"answers": answers, "latencies": latencies, "load_seconds": load_seconds, "peak_rss_mb": peak_rss_mb}
+
+def agreement(answers, reference):
+    matches = sum(normalize_question(a) == normalize_question(b) for a, b in zip(answers, reference))
+    return matches / len(reference) if reference else 0.0
+
+def evaluate(items, modes, model_name=None, token=None, warmup=2):
+    context = multiprocessing.get_context("spawn")
+    runs = {}
+    for mode in modes:
+        with context.Pool(1) as pool:
+            runs[mode] = pool.apply(run_mode, (model_name, token, mode, items, warmup))
+
+    reference = runs["fp32"]["answers"] if "fp32" in runs else None
+    labels = [item.get("answer") for item in items]
+    labelled = [i for i, label in enumerate(labels) if label is not None]
+
+    results = {}
+    for mode, run in runs.items():
+        latencies = run["latencies"]
+        result = {
+            "latency_mean_ms": statistics.mean(latencies) * 1000,
+            "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+            "latency_p95_ms": percentile(latencies, 0.95) * 1000,
+            "load_seconds": run["load_seconds"],
+            "peak_rss_mb": run["peak_rss_mb"],
+            "agreement_with_fp32": agreement(run["answers"], reference) if reference is not None else None,
+            "label_accuracy": agreement([run["answers"][i] for i in labelled], [labels[i] for i in labelled]) if labelled else None
+        }
+        results[mode] = result
+    return results
+
+def recommend(results, tolerance):
+    # Fastest mode whose answers agree with fp32 on at least (1 - tolerance) of the questions.
+    eligible = [
+        mode for mode, result in results.items()
+        if result["agreement_with_fp32"] is None or result["agreement_with_fp32"] >= 1 - tolerance
+    ]
+    return min(eligible, key=lambda mode: results[mode]["latency_mean_ms"]) if eligible else None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scanx.evaluate_precision", description="Compare BLIP inference precisions on a labelled question set.")
+    parser.add_argument("labels", help="JSONL file of {image, question, answer} items")
+    parser.add_argument("--model", help="BLIP VQA model name or local checkpoint path (defaults to the bundled checkpoint, then the Hub model)")
+    parser.add_argument("--token", default=os.environ.get("HF_TOKEN"), help="Hugging Face token (defaults to $HF_TOKEN)")
+    parser.add_argument("--modes", nargs="+", default=available_precisions(), help="Precisions to evaluate")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed questions run before measuring each mode")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Allowed fraction of answers that may differ from fp32")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    modes = args.modes if "fp32" in args.modes else ["fp32"] + args.modes
+    items = read_labels(args.labels)
+    results = evaluate(items, modes, model_name=args.model, token=args.token, warmup=args.warmup)
+
+    print(f"{'mode':<6} {'mean ms':>9} {'p95 ms':>9} {'peak RSS MB':>12} {'agree fp32':>11} {'label acc':>10}")
+    for mode, result in results.items():
+        label_accuracy = "-" if result["label_accuracy"] is None else f"{result['label_accuracy']:.3f}"
+        print(
+            f"{mode:<6} {result['latency_mean_ms']:>9.1f} {result['latency_p95_ms']:>9.1f} "
+            f"{result['peak_rss_mb']:>12.0f} {result['agreement_with_fp32']:>11.3f} {label_accuracy:>10}"
+        )
+
+    recommended = recommend(results, args.tolerance)
+    print(f"Recommended precision (tolerance {args.tolerance:.0%}): {recommended}")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"results": results, "recommended": recommended, "tolerance": args.tolerance}, output_file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,116 @@
+from .findings import DEFAULT_FOLLOW_UP, extract_findings
+
+
+HF_EXPLANATION_MODEL = "google/flan-t5-xl"
+API_URL = f"https://api-inference.huggingface.co/models/{HF_EXPLANATION_MODEL}"
+
+def build_explanation_prompt(vqa_result, image_type, patient_info):
+    patient_context = ""
+    if patient_info:
+        patient_context = f"""
+        Patient Information:
+        - Age: {patient_info.get('age', 'Not provided')}
+        - Gender: {patient_info.get('gender', 'Not provided')}
+        - Clinical History: {patient_info.get('clinical_history', 'Not provided')}
+        - Chief Complaint: {patient_info.get('chief_complaint', 'Not provided')}
+        - Current Medications: {patient_info.get('medications', 'Not provided')}
+        """
+    
+    return f"""
+    Based on AI analysis of a {image_type} medical image, the following observations were made:
+    
+    {vqa_result}
+    
+    {patient_context}
+    
+    As a medical expert, provide a detailed explanation of these findings, potential diagnoses, 
+    recommended follow-up tests, and educational information about the identified conditions.
+    """
+
+def parse_hf_response(result):
+    if isinstance(result, list) and len(result) > 0:
+        return result[0]["generated_text"]
+    return str(result)
+
+def get_rule_based_analysis(vqa_results, patient_info, findings=None):
+    # `findings` is extract_findings(vqa_results); callers analysing many studies can extract them
+    # in one batch (extract_findings_batch) and pass each study's result in.
+    if findings is None:
+        findings = extract_findings(vqa_results)
+    
+    diagnosis = findings["diagnosis"]
+    detected = [f"{finding['concept']} ({finding['region']})" if finding["region"] else finding["concept"] for finding in findings["findings"]]
+    if not detected:
+        detected = ["No abnormality identified"] if findings["normal"] else findings["observations"]
+    
+    patient_age = patient_info.get('age', 'Not provided')
+    patient_gender = patient_info.get('gender', 'Not provided')
+    clinical_history = patient_info.get('clinical_history', 'Not provided')
+    
+    age_related_factors = ""
+    if patient_age != 'Not provided':
+        try:
+            age = int(patient_age)
+            if age > 65:
+                age_related_factors = "Given the patient's advanced age, conditions such as degenerative changes and age-related cardiovascular diseases should be considered."
+            elif age < 18:
+                age_related_factors = "Given the patient's young age, congenital or developmental conditions should be considered."
+        except:
+            pass
+    
+    condition_notes = [findings["description"] or "Correlate with the clinical presentation"]
+    if findings["regions"]:
+        condition_notes.append(f"Regions involved: {', '.join(findings['regions'])}")
+    condition_lines = "\n".join(f"       - {note}" for note in condition_notes)
+    differential_lines = "\n".join(f"       - {item}" for item in findings["differentials"]) or "       - None suggested by the detected findings"
+    follow_up_lines = "\n".join(f"    {i}. {item}" for i, item in enumerate(findings["follow_up"] or DEFAULT_FOLLOW_UP, 1))
+    absent_line = f"\n    - Reported absent: {', '.join(findings['absent'])}" if findings["absent"] else ""
+    
+    analysis = f"""
+    ## Medical Image Analysis
+    
+    ### Patient Information
+    - **Patient ID:** {patient_info.get('id', 'Not provided')}
+    - **Age:** {patient_age}
+    - **Gender:** {patient_gender}
+    - **Clinical History:** {clinical_history}
+    - **Chief Complaint:** {patient_info.get('chief_complaint', 'Not provided')}
+    - **Current Medications:** {patient_info.get('medications', 'Not provided')}
+    
+    ### AI-Detected Findings:
+    - Primary observation: {", ".join(detected) if detected else "No specific findings detected"}
+    - Suggested diagnosis: {diagnosis}{absent_line}
+    
+    ### Potential Clinical Significance:
+    
+    {age_related_factors}
+    
+    Based on the AI analysis, the following conditions might be considered:
+    
+    1. **{diagnosis.title() if diagnosis != "Unknown" else "No Specific Condition Identified"}**
+{condition_lines}
+       
+    2. **Differential Diagnoses to Consider:**
+{differential_lines}
+    
+    ### Recommended Follow-up:
+    
+{follow_up_lines}
+    
+    ### Important Limitations:
+    
+    This analysis is generated by an AI system with limited information. A proper diagnosis requires:
+    - Complete patient history
+    - Physical examination
+    - Multiple diagnostic tests
+    - Clinical expertise
+
+    """
+    
+    return analysis
+
+def format_vqa_results(vqa_results):
+    return "\n".join([f"Question: {q}\nAnswer: {a}" for q, a in vqa_results.items()])
+
+def is_usable_explanation(explanation):
+    return "Error" not in explanation and len(explanation.strip()) >= 50
@@ -0,0 +1,81 @@
+# Convert a BLIP VQA checkpoint to the TorchScript graph backend, then check it against the eager
+# PyTorch path and time both:
+#
+#     python -m scanx.export_graph --model blip_chest_vqa_finetuned --output blip_graph --image test.jpg
+#
+# Without --image the check runs on a generated image. Point the app at the result with
+# SCANX_GRAPH_DIR=blip_graph, or the CLI with --graph-backend blip_graph.
+import argparse
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from .graph_backend import export_graph_backend, load_graph_backend
+from .model_loading import load_blip_model
+from .vqa import STANDARD_QUESTIONS, answer_question, encode_image
+
+
+def synthetic_image(size=512, seed=0):
+    # A smooth gradient with noise, deterministic for a given seed.
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 200, size, dtype=np.float32)[None, :]
+    pixels = np.clip(gradient + rng.normal(0, 25, (size, size)), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels, "L").convert("RGB")
+
+def time_questions(image, questions, processor, model, repeat):
+    # Returns (answers, median seconds per question including the image encode).
+    answers = [answer_question(encode_image(image, processor, model), q, processor, model) for q in questions]
+    timings = []
+    for _ in range(repeat):
+        for question in questions:
+            start = time.perf_counter()
+            answer_question(encode_image(image, processor, model), question, processor, model)
+            timings.append(time.perf_counter() - start)
+    return answers, statistics.median(timings)
+
+def check_parity(images, questions, eager, graph, repeat=3):
+    # eager and graph are (processor, model) pairs. Returns (mismatches, eager seconds, graph seconds).
+    mismatches = []
+    eager_times = []
+    graph_times = []
+    for image in images:
+        eager_answers, eager_seconds = time_questions(image, questions, *eager, repeat)
+        graph_answers, graph_seconds = time_questions(image, questions, *graph, repeat)
+        eager_times.append(eager_seconds)
+        graph_times.append(graph_seconds)
+        mismatches.extend(
+            (question, expected, actual)
+            for question, expected, actual in zip(questions, eager_answers, graph_answers)
+            if expected != actual
+        )
+    return mismatches, statistics.median(eager_times), statistics.median(graph_times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scanx.export_graph", description="Export a BLIP VQA checkpoint to the TorchScript graph backend.")
+    parser.add_argument("--model", help="BLIP VQA model name or local checkpoint path (defaults to the bundled checkpoint, then the Hub model)")
+    parser.add_argument("--token", default=os.environ.get("HF_TOKEN"), help="Hugging Face token (defaults to $HF_TOKEN)")
+    parser.add_argument("--output", required=True, help="Directory to write the exported graphs to")
+    parser.add_argument("--image", action="append", default=[], help="Image used for the parity check and benchmark (repeatable; defaults to a generated image)")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed passes over the questions per image")
+    args = parser.parse_args(argv)
+
+    processor, model = load_blip_model(args.token, model_name=args.model)
+    start = time.perf_counter()
+    export_graph_backend(processor, model, args.output)
+    print(f"Exported {model.load_timings['source']} to {args.output} in {time.perf_counter() - start:.1f}s")
+
+    images = [Image.open(path).convert("RGB") for path in args.image] or [synthetic_image()]
+    mismatches, eager_seconds, graph_seconds = check_parity(images, STANDARD_QUESTIONS, (processor, model), load_graph_backend(args.output), args.repeat)
+
+    print(f"Per-question latency on CPU: eager {eager_seconds * 1000:.1f} ms, graph {graph_seconds * 1000:.1f} ms ({eager_seconds / graph_seconds:.2f}x)")
+    for question, expected, actual in mismatches:
+        print(f"MISMATCH {question!r}: eager {expected!r}, graph {actual!r}")
+    print("Parity: OK" if not mismatches else f"Parity: {len(mismatches)} mismatched answers")
+    return 0 if not mismatches else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,42 @@
+# Find studies in the local study store and export their reports as a ZIP, without re-running inference:
+#
+#     python -m scanx.export_studies --patient-id MRN123 --modality X-ray --region Chest --list
+#     python -m scanx.export_studies --patient-id MRN123 --output mrn123.zip
+#
+# Reports not yet rendered are rendered as the archive is written, which streams one report at a time.
+import argparse
+import json
+import os
+import sys
+
+from .store import DEFAULT_STORE_PATH, StudyStore
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scanx.export_studies", description="Query the ScanX study store and export reports.")
+    parser.add_argument("--store", default=os.environ.get("SCANX_STORE_PATH", DEFAULT_STORE_PATH), help="Study store (defaults to $SCANX_STORE_PATH)")
+    parser.add_argument("--patient-id", help="Only studies for this patient ID / MRN")
+    parser.add_argument("--modality", help="Only studies of this modality, e.g. X-ray")
+    parser.add_argument("--region", help="Only studies of this anatomical region, e.g. Chest")
+    parser.add_argument("--from", dest="date_from", help="Earliest study date (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="date_to", help="Latest study date (YYYY-MM-DD)")
+    parser.add_argument("--limit", type=int, help="At most this many studies, newest first")
+    parser.add_argument("--list", action="store_true", help="Print the matching studies as JSON lines instead of exporting")
+    parser.add_argument("--output", help="ZIP file to write (defaults to stdout)")
+    parser.add_argument("--text", action="store_true", help="Export plain-text reports instead of Markdown")
+    args = parser.parse_args(argv)
+
+    store = StudyStore(args.store)
+    studies = store.find(args.patient_id, args.modality, args.region, args.date_from, args.date_to, args.limit)
+    if args.list:
+        for study in studies:
+            print(json.dumps(study))
+        return 0
+
+    store.export_zip(studies, args.output or sys.stdout.buffer, text=args.text)
+    print(f"Exported {len(studies)} reports to {args.output or 'stdout'}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,312 @@
+import json
+import os
+import re
+
+
+# Each concept lists the phrases that mention it (matched case-insensitively as whole words, with an
+# optional plural), the anatomical region, and what the rule-based analysis suggests when it is found.
+DEFAULT_TERMINOLOGY = {
+    "Pneumonia": {
+        "terms": ["pneumonia", "consolidation", "airspace opacity", "airspace disease", "infiltrate", "lobar pneumonia", "bronchopneumonia"],
+        "region": "Lungs",
+        "description": "Infection of the lung parenchyma; typically fever, productive cough and focal crackles.",
+        "differentials": ["Atelectasis", "Pulmonary edema", "Aspiration", "Lung cancer"],
+        "follow_up": ["Complete blood count and inflammatory markers", "Follow-up chest radiograph in 6-8 weeks to confirm resolution"]
+    },
+    "Pleural effusion": {
+        "terms": ["pleural effusion", "effusion", "pleural fluid", "blunting of the costophrenic angle", "blunted costophrenic angle"],
+        "region": "Pleura",
+        "description": "Fluid in the pleural space; may cause dyspnea and pleuritic chest pain.",
+        "differentials": ["Congestive heart failure", "Parapneumonic effusion", "Malignant effusion", "Hypoalbuminemia"],
+        "follow_up": ["Thoracic ultrasound to assess volume", "Diagnostic thoracentesis if the cause is unclear"]
+    },
+    "Pneumothorax": {
+        "terms": ["pneumothorax", "collapsed lung", "tension pneumothorax"],
+        "region": "Pleura",
+        "description": "Air in the pleural space; can present with sudden chest pain and breathlessness.",
+        "differentials": ["Bulla", "Skin fold artifact"],
+        "follow_up": ["Urgent clinical review", "CT chest if the radiograph is equivocal"]
+    },
+    "Cardiomegaly": {
+        "terms": ["cardiomegaly", "enlarged heart", "enlarged cardiac silhouette", "cardiac enlargement", "heart enlargement"],
+        "region": "Heart",
+        "description": "Enlarged cardiac silhouette; commonly associated with chest pain, shortness of breath and fatigue.",
+        "differentials": ["Dilated cardiomyopathy", "Pericardial effusion", "Valvular heart disease", "Congestive heart failure"],
+        "follow_up": ["Echocardiogram for cardiac structure and function", "ECG/EKG", "BNP (B-type natriuretic peptide)", "Cardiology referral"]
+    },
+    "Pulmonary edema": {
+        "terms": ["pulmonary edema", "pulmonary oedema", "edema", "oedema", "vascular congestion", "pulmonary congestion", "kerley b lines"],
+        "region": "Lungs",
+        "description": "Fluid in the lung interstitium and airspaces, most often cardiogenic.",
+        "differentials": ["Congestive heart failure", "Acute respiratory distress syndrome", "Fluid overload", "Renal failure"],
+        "follow_up": ["Echocardiogram", "BNP (B-type natriuretic peptide)", "Renal function and electrolytes"]
+    },
+    "Atelectasis": {
+        "terms": ["atelectasis", "lung collapse", "lobar collapse", "volume loss"],
+        "region": "Lungs",
+        "description": "Partial collapse of lung tissue, often after surgery or from airway obstruction.",
+        "differentials": ["Pneumonia", "Mucus plugging", "Endobronchial obstruction"],
+        "follow_up": ["Follow-up chest radiograph", "Bronchoscopy if persistent"]
+    },
+    "Pulmonary nodule": {
+        "terms": ["nodule", "pulmonary nodule", "lung nodule", "granuloma", "coin lesion"],
+        "region": "Lungs",
+        "description": "Focal rounded opacity; most are benign but some need surveillance.",
+        "differentials": ["Granuloma", "Primary lung cancer", "Metastasis", "Hamartoma"],
+        "follow_up": ["CT chest", "Comparison with prior imaging (Fleischner Society guidance)"]
+    },
+    "Lung mass": {
+        "terms": ["mass", "lung mass", "tumor", "tumour", "neoplasm", "carcinoma", "malignancy", "lung cancer"],
+        "region": "Lungs",
+        "description": "Opacity larger than 3 cm; malignancy needs to be excluded.",
+        "differentials": ["Primary lung cancer", "Lymphoma", "Lung abscess", "Metastasis"],
+        "follow_up": ["Contrast-enhanced CT chest", "Respiratory referral for tissue diagnosis"]
+    },
+    "Emphysema": {
+        "terms": ["emphysema", "hyperinflation", "hyperinflated lungs", "copd", "bulla", "bullae"],
+        "region": "Lungs",
+        "description": "Destruction of alveolar walls with air trapping; usually smoking related.",
+        "differentials": ["Asthma", "Alpha-1 antitrypsin deficiency"],
+        "follow_up": ["Pulmonary function tests", "Smoking cessation support"]
+    },
+    "Tuberculosis": {
+        "terms": ["tuberculosis", "tb", "cavitation", "cavity", "cavitary lesion", "miliary pattern"],
+        "region": "Lungs",
+        "description": "Mycobacterial infection; upper-lobe cavitation is typical of reactivation disease.",
+        "differentials": ["Fungal infection", "Lung abscess", "Cavitating carcinoma"],
+        "follow_up": ["Sputum AFB smear and culture", "Interferon-gamma release assay", "Infection control precautions"]
+    },
+    "Interstitial lung disease": {
+        "terms": ["interstitial lung disease", "fibrosis", "pulmonary fibrosis", "interstitial opacities", "reticular opacities", "honeycombing"],
+        "region": "Lungs",
+        "description": "Diffuse scarring or inflammation of the lung interstitium.",
+        "differentials": ["Idiopathic pulmonary fibrosis", "Hypersensitivity pneumonitis", "Sarcoidosis", "Connective tissue disease"],
+        "follow_up": ["High-resolution CT chest", "Pulmonary function tests"]
+    },
+    "Mediastinal widening": {
+        "terms": ["mediastinal widening", "widened mediastinum", "lymphadenopathy", "hilar enlargement", "hilar lymphadenopathy"],
+        "region": "Mediastinum",
+        "description": "Widened mediastinal or hilar contour from nodes, vessels or masses.",
+        "differentials": ["Lymphoma", "Sarcoidosis", "Aortic aneurysm", "Tuberculosis"],
+        "follow_up": ["Contrast-enhanced CT chest"]
+    },
+    "Fracture": {
+        "terms": ["fracture", "rib fracture", "fractured", "broken rib", "broken bone"],
+        "region": "Bones",
+        "description": "Break in bone continuity; acute fractures are usually painful and tender.",
+        "differentials": ["Healed fracture", "Pathological fracture from bone metastasis"],
+        "follow_up": ["Dedicated radiographs of the area", "Orthopaedic review"]
+    },
+    "Support device": {
+        "terms": ["pacemaker", "endotracheal tube", "central line", "central venous catheter", "nasogastric tube", "chest tube", "catheter"],
+        "region": "Devices",
+        "description": "Medical device in place.",
+        "differentials": [],
+        "follow_up": ["Confirm device position"]
+    },
+    "Normal": {
+        "terms": ["normal", "no acute findings", "no acute abnormality", "no abnormality", "no abnormalities", "unremarkable", "clear lungs", "no pathology"],
+        "region": None,
+        "normal": True,
+        "description": "No abnormality identified.",
+        "differentials": [],
+        "follow_up": []
+    }
+}
+
+# What a question asks about, from words in the question itself.
+QUESTION_INTENTS = {
+    "diagnosis": ["diagnosis", "diagnose", "diagnoses", "impression", "condition"],
+    "finding": ["abnormality", "abnormalities", "finding", "findings", "pathology", "concerning", "lesion", "seen", "visible"]
+}
+
+# A cue before a term, in the same clause, marks the term as absent: "no effusion", "without pneumothorax".
+# Commas end the clause too, so "no effusion, pneumonia in the right lower lobe" keeps the pneumonia.
+NEGATION_CUES = ["no", "not", "without", "negative for", "free of", "absence of", "absent", "rule out", "ruled out", "resolved"]
+CLAUSE_BREAK = re.compile(r"[.,;:\n]|\b(?:but|however)\b")
+
+DEFAULT_FOLLOW_UP = ["Clinical correlation and review of the images by a radiologist", "Comparison with prior imaging if available"]
+
+
+def trie_pattern(terms):
+    # One regex for many literal terms: alternatives that share a prefix are merged into a trie, so
+    # matching at a position walks the prefix once instead of trying every term in turn. Greedy
+    # optional branches make the longest term win.
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return _node_pattern(trie)
+
+def _node_pattern(node):
+    branches = [re.escape(char) + _node_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if "" in node:
+        return (pattern if len(pattern) == 1 else f"(?:{pattern})") + "?"
+    return pattern
+
+def load_terminology(path):
+    # A JSON object in the DEFAULT_TERMINOLOGY format.
+    with open(path) as terminology_file:
+        return json.load(terminology_file)
+
+def compile_phrases(phrases, plurals=False):
+    suffix = r"(?:s|es)?" if plurals else ""
+    return re.compile(r"\b(?:" + trie_pattern(sorted({phrase.lower() for phrase in phrases})) + ")" + suffix + r"\b")
+
+
+class FindingsEngine:
+    # Compiles a terminology into one matcher and maps VQA results to structured findings. A batch of
+    # studies is scanned in a single pass over all their answers joined together.
+
+    def __init__(self, terminology=DEFAULT_TERMINOLOGY):
+        self.terminology = terminology
+        self.concepts = {}
+        for label, concept in terminology.items():
+            for term in concept["terms"]:
+                self.concepts.setdefault(term.lower(), label)
+        self.matcher = compile_phrases(self.concepts, plurals=True)
+        self.negation = compile_phrases(NEGATION_CUES)
+        self.intent_matchers = {intent: compile_phrases(words) for intent, words in QUESTION_INTENTS.items()}
+        self._question_intents = {}
+
+    def concept_for(self, text):
+        # Maps matched text (possibly plural) back to its concept label.
+        label = self.concepts.get(text)
+        if label is None and text.endswith("es"):
+            label = self.concepts.get(text[:-2])
+        if label is None and text.endswith("s"):
+            label = self.concepts.get(text[:-1])
+        return label
+
+    def question_intents(self, question):
+        # The standard questions repeat across studies, so their intents are only worked out once.
+        intents = self._question_intents.get(question)
+        if intents is None:
+            lowered = question.lower()
+            intents = frozenset(intent for intent, matcher in self.intent_matchers.items() if matcher.search(lowered))
+            if len(self._question_intents) < 4096:
+                self._question_intents[question] = intents
+        return intents
+
+    def is_negated(self, text, start, segment_start):
+        window_start = segment_start
+        for clause_break in CLAUSE_BREAK.finditer(text, segment_start, start):
+            window_start = clause_break.end()
+        return self.negation.search(text, window_start, start) is not None
+
+    def extract_batch(self, vqa_results_list):
+        # Returns one findings dict per study (see extract()). Every answer in the batch is joined into
+        # one text and scanned once; matches arrive in order, so each study is summarized as soon as
+        # the scan has passed its answers.
+        parts = [str(answer).lower() for vqa_results in vqa_results_list for answer in vqa_results.values()]
+        text = "\n".join(parts)
+        matches = self.matcher.finditer(text)
+        match = next(matches, None)
+
+        results = []
+        segment = 0
+        segment_start = 0
+        for vqa_results in vqa_results_list:
+            answers = []
+            for question in vqa_results:
+                answer = parts[segment]
+                segment_end = segment_start + len(answer)
+                mentions = []
+                while match is not None and match.start() < segment_end:
+                    term = match.group()
+                    mentions.append((self.concept_for(term), term, self.is_negated(text, match.start(), segment_start)))
+                    match = next(matches, None)
+                answers.append((question, answer, mentions))
+                segment += 1
+                segment_start = segment_end + 1
+            results.append(self._summarize(answers))
+        return results
+
+    def extract(self, vqa_results):
+        # Returns {"findings", "absent", "observations", "diagnosis", "diagnosis_concept", "description",
+        # "regions", "differentials", "follow_up", "abnormal", "normal"} for one study's question->answer dict.
+        # "observations" are the raw answers to finding questions, for when nothing in them matched.
+        return self.extract_batch([vqa_results])[0]
+
+    def _summarize(self, answers):
+        findings = []
+        absent = []
+        observations = []
+        diagnosis = None
+        diagnosis_concept = None
+        abnormal = None
+        normal = False
+
+        for question, answer, mentions in answers:
+            intents = self.question_intents(question)
+            first_word = answer.split(None, 1)[0].strip(".,!") if answer.strip() else ""
+            if first_word in ("yes", "no") and "finding" in intents:
+                abnormal = bool(abnormal) or first_word == "yes"
+            if "diagnosis" in intents and diagnosis is None:
+                diagnosis = answer
+            if "finding" in intents and first_word not in ("yes", "no"):
+                observations.append(answer)
+
+            for label, text, negated in mentions:
+                concept = self.terminology[label]
+                if concept.get("normal"):
+                    normal = normal or not negated
+                    continue
+                if negated:
+                    if label not in absent:
+                        absent.append(label)
+                    continue
+                if "diagnosis" in intents and diagnosis_concept is None:
+                    diagnosis_concept = label
+                if all(finding["concept"] != label for finding in findings):
+                    findings.append({"concept": label, "region": concept.get("region"), "question": question, "text": text})
+
+        if findings:
+            abnormal = True
+            normal = False
+        absent = [label for label in absent if all(finding["concept"] != label for finding in findings)]
+        if diagnosis_concept is None and findings:
+            diagnosis_concept = findings[0]["concept"]
+
+        differentials = []
+        follow_up = []
+        for label in ([diagnosis_concept] if diagnosis_concept else []) + [finding["concept"] for finding in findings]:
+            concept = self.terminology[label]
+            differentials += [item for item in concept.get("differentials", []) if item not in differentials and item != label]
+            follow_up += [item for item in concept.get("follow_up", []) if item not in follow_up]
+
+        return {
+            "findings": findings,
+            "absent": absent,
+            "observations": observations,
+            "diagnosis": diagnosis_concept or diagnosis or "Unknown",
+            "diagnosis_concept": diagnosis_concept,
+            "description": self.terminology[diagnosis_concept].get("description") if diagnosis_concept else None,
+            "regions": sorted({finding["region"] for finding in findings if finding["region"]}),
+            "differentials": differentials,
+            "follow_up": follow_up,
+            "abnormal": abnormal,
+            "normal": normal and not findings
+        }
+
+
+_default_engine = None
+
+def default_engine():
+    # Compiled on first use from $SCANX_TERMINOLOGY, or the built-in terminology.
+    global _default_engine
+    if _default_engine is None:
+        path = os.environ.get("SCANX_TERMINOLOGY")
+        _default_engine = FindingsEngine(load_terminology(path) if path else DEFAULT_TERMINOLOGY)
+    return _default_engine
+
+def extract_findings(vqa_results):
+    return default_engine().extract(vqa_results)
+
+def extract_findings_batch(vqa_results_list):
+    return default_engine().extract_batch(vqa_results_list)
@@ -0,0 +1,181 @@
+import json
+import os
+
+import torch
+from torch import nn
+from transformers import BlipConfig, BlipProcessor, GenerationConfig
+
+
+VISION_FILE = "vision_encoder.pt"
+TEXT_ENCODER_FILE = "text_encoder.pt"
+DECODER_STEP_FILE = "decoder_step.pt"
+METADATA_FILE = "scanx_graph.json"
+
+
+class VisionEncoder(nn.Module):
+    def __init__(self, vision_model):
+        super().__init__()
+        self.vision_model = vision_model
+
+    def forward(self, pixel_values):
+        return self.vision_model(pixel_values=pixel_values)[0]
+
+
+class TextEncoder(nn.Module):
+    def __init__(self, text_encoder):
+        super().__init__()
+        self.text_encoder = text_encoder
+
+    def forward(self, input_ids, attention_mask, image_embeds):
+        image_attention_mask = torch.ones(image_embeds.shape[:-1], dtype=torch.long)
+        return self.text_encoder(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            encoder_hidden_states=image_embeds,
+            encoder_attention_mask=image_attention_mask,
+            return_dict=False
+        )[0]
+
+
+class DecoderStep(nn.Module):
+    # One greedy decode step. The self-attention key/value cache of every layer travels as a single
+    # [layers, 2, batch, heads, length, head_dim] tensor so it can cross the graph boundary.
+
+    def __init__(self, text_decoder):
+        super().__init__()
+        self.text_decoder = text_decoder
+
+    def forward(self, input_ids, attention_mask, question_embeds, question_attention_mask, past):
+        past_key_values = tuple((past[i, 0], past[i, 1]) for i in range(past.size(0)))
+        outputs = self.text_decoder(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            encoder_hidden_states=question_embeds,
+            encoder_attention_mask=question_attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True,
+            return_dict=True
+        )
+        new_past = torch.stack([torch.stack(layer[:2]) for layer in outputs.past_key_values])
+        return outputs.logits[:, -1, :], new_past
+
+
+def max_new_tokens_for(generation_config):
+    # Mirrors transformers: the untouched default max_length means 20 *new* tokens, any other
+    # max_length counts the BOS token the decoder starts from.
+    if generation_config.max_new_tokens is not None:
+        return generation_config.max_new_tokens
+    if generation_config.max_length == GenerationConfig().max_length:
+        return generation_config.max_length
+    return generation_config.max_length - 1
+
+def export_graph_backend(processor, model, output_dir):
+    # Traces the vision encoder, question encoder and a single cached decoder step to TorchScript.
+    # Export from an fp32 model; the example shapes only need to be representative, batch size,
+    # question length and cache length stay dynamic.
+    os.makedirs(output_dir, exist_ok=True)
+    model.eval()
+
+    text_config = model.config.text_config
+    image_size = model.config.vision_config.image_size
+    num_layers = text_config.num_hidden_layers
+    num_heads = text_config.num_attention_heads
+    head_dim = text_config.hidden_size // num_heads
+
+    pixel_values = torch.zeros(2, 3, image_size, image_size)
+    input_ids = torch.full((2, 7), text_config.pad_token_id + 1, dtype=torch.long)
+    attention_mask = torch.ones(2, 7, dtype=torch.long)
+
+    with torch.no_grad():
+        vision = torch.jit.trace(VisionEncoder(model.vision_model).eval(), (pixel_values,), check_trace=False)
+        image_embeds = vision(pixel_values)
+
+        text_encoder = torch.jit.trace(TextEncoder(model.text_encoder).eval(), (input_ids, attention_mask, image_embeds), check_trace=False)
+        question_embeds = text_encoder(input_ids, attention_mask, image_embeds)
+
+        # Traced with a non-empty cache so the graph keeps the causal-mask prefix; an empty cache
+        # on the first step just concatenates a zero-width prefix.
+        past = torch.zeros(num_layers, 2, 2, num_heads, 2, head_dim)
+        decoder_step = torch.jit.trace(
+            DecoderStep(model.text_decoder).eval(),
+            (torch.ones(2, 1, dtype=torch.long), torch.ones(2, 3, dtype=torch.long), question_embeds, attention_mask, past),
+            check_trace=False
+        )
+
+    torch.jit.save(vision, os.path.join(output_dir, VISION_FILE))
+    torch.jit.save(text_encoder, os.path.join(output_dir, TEXT_ENCODER_FILE))
+    torch.jit.save(decoder_step, os.path.join(output_dir, DECODER_STEP_FILE))
+
+    model.config.save_pretrained(output_dir)
+    model.generation_config.save_pretrained(output_dir)
+    processor.save_pretrained(output_dir)
+
+    metadata = {
+        "source": model.config._name_or_path,
+        "num_layers": num_layers,
+        "num_heads": num_heads,
+        "head_dim": head_dim,
+        "bos_token_id": text_config.bos_token_id,
+        "eos_token_id": text_config.sep_token_id,
+        "pad_token_id": text_config.pad_token_id,
+        "max_new_tokens": max_new_tokens_for(model.text_decoder.generation_config)
+    }
+    with open(os.path.join(output_dir, METADATA_FILE), "w") as metadata_file:
+        json.dump(metadata, metadata_file, indent=2)
+
+
+class GraphBackendModel:
+    # Drop-in replacement for BlipForQuestionAnswering in encode_pixel_values/generate_answers, so
+    # perform_vqa and the batched paths work unchanged. Greedy decoding runs in a short Python loop
+    # around the traced step, reusing the key/value cache instead of re-running the whole prefix.
+
+    inference_precision = "torchscript"
+    dtype = torch.float32
+
+    def __init__(self, graph_dir):
+        with open(os.path.join(graph_dir, METADATA_FILE)) as metadata_file:
+            self.metadata = json.load(metadata_file)
+        self.config = BlipConfig.from_pretrained(graph_dir)
+        self.generation_config = GenerationConfig.from_pretrained(graph_dir)
+
+        self.vision = self._load(os.path.join(graph_dir, VISION_FILE))
+        self.text_encoder = self._load(os.path.join(graph_dir, TEXT_ENCODER_FILE))
+        self.decoder_step = self._load(os.path.join(graph_dir, DECODER_STEP_FILE))
+
+    @staticmethod
+    def _load(path):
+        module = torch.jit.load(path, map_location="cpu")
+        module.eval()
+        return torch.jit.freeze(module)
+
+    def encode_pixel_values(self, pixel_values):
+        with torch.no_grad():
+            return self.vision(pixel_values.to(self.dtype))
+
+    def generate_answers(self, image_embeds, input_ids, attention_mask):
+        metadata = self.metadata
+        batch_size = image_embeds.size(0)
+
+        with torch.no_grad():
+            question_embeds = self.text_encoder(input_ids, attention_mask, image_embeds)
+
+            sequences = torch.full((batch_size, 1), metadata["bos_token_id"], dtype=torch.long)
+            past = torch.zeros(metadata["num_layers"], 2, batch_size, metadata["num_heads"], 0, metadata["head_dim"], dtype=question_embeds.dtype)
+            finished = torch.zeros(batch_size, dtype=torch.bool)
+
+            for _ in range(metadata["max_new_tokens"]):
+                decoder_attention_mask = torch.ones(batch_size, past.size(4) + 1, dtype=torch.long)
+                logits, past = self.decoder_step(sequences[:, -1:], decoder_attention_mask, question_embeds, attention_mask, past)
+
+                next_tokens = logits.argmax(dim=-1)
+                next_tokens = torch.where(finished, torch.full_like(next_tokens, metadata["pad_token_id"]), next_tokens)
+                sequences = torch.cat([sequences, next_tokens[:, None]], dim=1)
+
+                finished |= next_tokens == metadata["eos_token_id"]
+                if finished.all():
+                    break
+        return sequences
+
+
+def load_graph_backend(graph_dir):
+    return BlipProcessor.from_pretrained(graph_dir), GraphBackendModel(graph_dir)
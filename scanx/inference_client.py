@@ -0,0 +1,126 @@
+import base64
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+from .telemetry import span
+
+
+DEFAULT_PORT = 8765
+
+
+class InferenceError(Exception):
+    pass
+
+
+class InferenceBusy(InferenceError):
+    pass
+
+
+class InferenceDeadlineExceeded(InferenceError):
+    pass
+
+
+class ImageRequired(InferenceError):
+    pass
+
+
+class InferenceClient:
+    # Thin client for the service. Images are resized client-side to the model's input size with the
+    # processor's own resampling (so answers match local inference) and sent once; later questions on
+    # the same image send only its hash. A busy service is retried with backoff within the deadline.
+
+    def __init__(self, url, connect_timeout=3.05, max_retries=3, backoff=0.2, max_concurrency=4, sent_cache_size=64):
+        self.url = url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sent_cache_size = sent_cache_size
+        self._info = None
+        self._sent = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=max_concurrency))
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="scanx-inference-client")
+
+    def info(self):
+        if self._info is None:
+            response = self.session.get(f"{self.url}/info", timeout=(self.connect_timeout, 30))
+            response.raise_for_status()
+            self._info = response.json()
+        return self._info
+
+    def metrics(self):
+        response = self.session.get(f"{self.url}/metrics", timeout=(self.connect_timeout, 30))
+        response.raise_for_status()
+        return response.json()
+
+    def encode_image(self, image):
+        info = self.info()
+        size = tuple(info["image_size"])
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if image.size != size:
+            image = image.resize(size, resample=Image.Resampling(info["resample"]))
+        return {"pixels": base64.b64encode(image.tobytes()).decode("ascii"), "size": list(size)}
+
+    def answer(self, image, image_hash, questions, deadline=30):
+        # Returns the answers in question order.
+        with span("inference_service"):
+            return self._answer(image, image_hash, questions, deadline)
+
+    def _answer(self, image, image_hash, questions, deadline):
+        expires_at = time.monotonic() + deadline
+        with self._lock:
+            send_pixels = image_hash not in self._sent
+        payload = {"image_hash": image_hash, "questions": list(questions)}
+        if send_pixels:
+            payload.update(self.encode_image(image))
+
+        attempt = 0
+        while True:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                raise InferenceDeadlineExceeded("Deadline exceeded before the service answered")
+            payload["deadline"] = remaining
+            try:
+                response = self.session.post(f"{self.url}/vqa", json=payload, timeout=(self.connect_timeout, remaining + 1))
+            except requests.RequestException as e:
+                raise InferenceError(f"Inference service unavailable: {e}")
+
+            if response.status_code == 200:
+                with self._lock:
+                    self._sent[image_hash] = True
+                    self._sent.move_to_end(image_hash)
+                    while len(self._sent) > self.sent_cache_size:
+                        self._sent.popitem(last=False)
+                return response.json()["answers"]
+            if response.status_code == 409 and "pixels" not in payload:
+                # The service evicted this image's embeddings; send the pixels this time.
+                payload.update(self.encode_image(image))
+                continue
+            if response.status_code == 503 and attempt < self.max_retries:
+                time.sleep(min(self.backoff * 2 ** attempt, max(expires_at - time.monotonic(), 0)))
+                attempt += 1
+                continue
+            if response.status_code == 503:
+                raise InferenceBusy("Inference service is busy")
+            if response.status_code == 504:
+                raise InferenceDeadlineExceeded("Inference service missed the deadline")
+            raise InferenceError(f"Inference service error {response.status_code}: {response.text[:200]}")
+
+    def submit(self, image, image_hash, questions, deadline=30):
+        # Returns a concurrent.futures.Future of the answers.
+        # Run in a copy of the caller's context so the span lands on the caller's study trace.
+        return self._executor.submit(contextvars.copy_context().run, self.answer, image, image_hash, questions, deadline)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,343 @@
+# Local inference service: one process owns the model and answers VQA requests from every app session,
+# grouping concurrent requests into micro-batches.
+#
+#     python -m scanx.inference_service --port 8765 --precision int8
+#     SCANX_INFERENCE_URL=http://127.0.0.1:8765 streamlit run medical_image_analyzer.py
+#
+# GET /info describes the model (including its cache key), GET /metrics reports queue depth and batching,
+# GET /metrics/prometheus exposes the stage timings and counters from scanx.telemetry,
+# and POST /vqa answers {"image_hash", "questions", "deadline", "pixels"?, "size"?}.
+import argparse
+import base64
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from PIL import Image
+
+from .cache import model_cache_key
+from .graph_backend import load_graph_backend
+from .inference_client import DEFAULT_PORT, ImageRequired, InferenceBusy, InferenceDeadlineExceeded, InferenceError
+from .model_loading import load_blip_model
+from .precision import PRECISIONS
+from .preprocess import FastBlipProcessor
+from .telemetry import telemetry
+from .vqa import answer_image_questions, encode_pixel_values
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceRequest:
+    def __init__(self, image_hash, questions, image, deadline):
+        self.image_hash = image_hash
+        self.questions = questions
+        self.image = image
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future = Future()
+
+
+class MicroBatcher:
+    # A bounded queue feeding one worker thread. The worker takes the oldest request, waits up to
+    # batch_window seconds for more (until max_batch_size questions are pending), drops requests whose
+    # deadline has passed, and answers the rest with one vision-encoder pass and shared decode batches.
+    # Image embeddings are kept in a small LRU so follow-up questions skip the encoder. submit() raises
+    # InferenceBusy when the queue is full instead of letting latency grow without bound.
+
+    def __init__(self, processor, model, max_batch_size=32, batch_window=0.01, max_queue=64, embeds_cache_size=8):
+        self.processor = processor
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_queue = max_queue
+        self.embeds_cache_size = embeds_cache_size
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._embeds = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {
+            "requests": 0,
+            "rejected": 0,
+            "expired": 0,
+            "failed": 0,
+            "batches": 0,
+            "batched_requests": 0,
+            "batched_questions": 0,
+            "max_queue_depth": 0,
+            "queue_seconds_total": 0.0,
+            "batch_seconds_total": 0.0
+        }
+        self._thread = threading.Thread(target=self._work, name="scanx-inference", daemon=True)
+        self._thread.start()
+
+    def submit(self, image_hash, questions, image=None, deadline=30):
+        # Returns a Future of {"answers": [...], "batch_requests": n, "queue_seconds": s}.
+        request = InferenceRequest(image_hash, list(questions), image, time.monotonic() + deadline)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._lock:
+                self._metrics["rejected"] += 1
+            raise InferenceBusy(f"Inference queue is full ({self.max_queue} requests)")
+
+        with self._lock:
+            self._metrics["requests"] += 1
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._queue.qsize())
+        return request.future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        pending = len(batch[0].questions)
+        closes_at = time.monotonic() + self.batch_window
+        while pending < self.max_batch_size:
+            remaining = closes_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            pending += len(request.questions)
+        return batch
+
+    def _work(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._run(batch)
+            except Exception as e:
+                logger.exception("Inference batch failed")
+                with self._lock:
+                    self._metrics["failed"] += len(batch)
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(InferenceError(str(e)))
+
+    def _image_embeds(self, batch):
+        # Encodes every image in the batch that is not already cached, in a single vision-encoder call.
+        with self._lock:
+            embeds = {request.image_hash: self._embeds.get(request.image_hash) for request in batch}
+            for image_hash, value in embeds.items():
+                if value is not None:
+                    self._embeds.move_to_end(image_hash)
+
+        images = {}
+        for request in batch:
+            if embeds[request.image_hash] is None and request.image is not None:
+                images.setdefault(request.image_hash, request.image)
+        if images:
+            hashes = list(images)
+            if hasattr(self.processor, "pixel_values"):
+                pixel_values = self.processor.pixel_values([images[h] for h in hashes], hashes)
+            else:
+                pixel_values = self.processor(images=[images[h] for h in hashes], return_tensors="pt").pixel_values
+            encoded = encode_pixel_values(pixel_values, self.model)
+            with self._lock:
+                for i, image_hash in enumerate(hashes):
+                    embeds[image_hash] = encoded[i:i + 1].clone()
+                    self._embeds[image_hash] = embeds[image_hash]
+                    self._embeds.move_to_end(image_hash)
+                while len(self._embeds) > self.embeds_cache_size:
+                    self._embeds.popitem(last=False)
+        return embeds
+
+    def _run(self, batch):
+        now = time.monotonic()
+        live = []
+        for request in batch:
+            # Cancelled futures belong to callers that already gave up waiting.
+            if not request.future.set_running_or_notify_cancel() or request.deadline <= now:
+                if not request.future.cancelled():
+                    request.future.set_exception(InferenceDeadlineExceeded("Deadline passed while queued"))
+                with self._lock:
+                    self._metrics["expired"] += 1
+            else:
+                live.append(request)
+        if not live:
+            return
+
+        start = time.monotonic()
+        embeds = self._image_embeds(live)
+        answerable = []
+        for request in live:
+            if embeds[request.image_hash] is None:
+                request.future.set_exception(ImageRequired(f"Image {request.image_hash} is not cached; send its pixels"))
+            else:
+                answerable.append(request)
+
+        if answerable:
+            results = answer_image_questions(
+                torch.cat([embeds[request.image_hash] for request in answerable]),
+                [request.questions for request in answerable],
+                self.processor,
+                self.model,
+                max_batch_size=self.max_batch_size
+            )
+            for request, answers in zip(answerable, results):
+                request.future.set_result({
+                    "answers": [answers[question] for question in request.questions],
+                    "batch_requests": len(answerable),
+                    "queue_seconds": start - request.enqueued_at
+                })
+
+        with self._lock:
+            self._metrics["batches"] += 1
+            self._metrics["batched_requests"] += len(answerable)
+            self._metrics["batched_questions"] += sum(len(request.questions) for request in answerable)
+            self._metrics["queue_seconds_total"] += sum(start - request.enqueued_at for request in live)
+            self._metrics["batch_seconds_total"] += time.monotonic() - start
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics["embeds_cached"] = len(self._embeds)
+        batches = metrics["batches"] or 1
+        metrics["queue_depth"] = self._queue.qsize()
+        metrics["max_queue"] = self.max_queue
+        metrics["mean_batch_requests"] = metrics["batched_requests"] / batches
+        metrics["mean_batch_questions"] = metrics["batched_questions"] / batches
+        metrics["mean_batch_seconds"] = metrics["batch_seconds_total"] / batches
+        metrics["mean_queue_seconds"] = metrics["queue_seconds_total"] / max(metrics["batched_requests"], 1)
+        return metrics
+
+
+def model_info(processor, model):
+    image_processor = processor.image_processor
+    return {
+        "model_key": model_cache_key(model),
+        "source": getattr(model.config, "_name_or_path", None),
+        "inference_precision": getattr(model, "inference_precision", "fp32"),
+        "image_size": [image_processor.size["width"], image_processor.size["height"]],
+        "resample": int(image_processor.resample),
+        "load_timings": getattr(model, "load_timings", None)
+    }
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/info":
+            self.send_json(200, self.server.info)
+        elif self.path == "/metrics":
+            self.send_json(200, self.server.batcher.metrics())
+        elif self.path == "/metrics/prometheus":
+            body = telemetry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/vqa":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            image = None
+            if payload.get("pixels"):
+                image = Image.frombytes("RGB", tuple(payload["size"]), base64.b64decode(payload["pixels"]))
+            deadline = float(payload.get("deadline", 30))
+            future = self.server.batcher.submit(payload["image_hash"], payload["questions"], image=image, deadline=deadline)
+        except InferenceBusy as e:
+            self.send_json(503, {"error": str(e)}, headers={"Retry-After": "1"})
+            return
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {"error": f"Bad request: {e}"})
+            return
+
+        try:
+            self.send_json(200, future.result(timeout=deadline))
+        except (InferenceDeadlineExceeded, FutureTimeoutError):
+            future.cancel()
+            self.send_json(504, {"error": "Deadline exceeded"})
+        except ImageRequired as e:
+            self.send_json(409, {"error": str(e)})
+        except InferenceError as e:
+            self.send_json(500, {"error": str(e)})
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_inference_server(processor, model, host="127.0.0.1", port=DEFAULT_PORT, **batcher_options):
+    server = ThreadingHTTPServer((host, port), InferenceHandler)
+    server.daemon_threads = True
+    server.batcher = MicroBatcher(processor, model, **batcher_options)
+    server.info = model_info(processor, model)
+    return server
+
+def start_inference_service(processor, model, host="127.0.0.1", port=0, **batcher_options):
+    # Serves on a background thread (port 0 picks a free port). Returns (server, url); call
+    # server.shutdown() when done.
+    server = create_inference_server(processor, model, host=host, port=port, **batcher_options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scanx.inference_service", description="Serve ScanX VQA inference to app sessions with micro-batching.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--model", help="BLIP VQA model name or local checkpoint path (defaults to the bundled checkpoint, then the Hub model)")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32", help="Inference precision")
+    parser.add_argument("--graph-backend", metavar="DIR", help="Use a TorchScript export from python -m scanx.export_graph instead of --model")
+    parser.add_argument("--token", default=os.environ.get("HF_TOKEN"), help="Hugging Face token (defaults to $HF_TOKEN)")
+    parser.add_argument("--threads", type=int, help="Torch intra-op threads for inference")
+    parser.add_argument("--batch-window-ms", type=float, default=10, help="How long the first request in a batch waits for others")
+    parser.add_argument("--max-batch-size", type=int, default=32, help="Maximum questions decoded together")
+    parser.add_argument("--max-queue", type=int, default=64, help="Queued requests before new ones are rejected with 503")
+    parser.add_argument("--embeds-cache", type=int, default=8, help="Image embeddings kept for follow-up questions")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.graph_backend:
+        processor, model = load_graph_backend(args.graph_backend)
+    else:
+        processor, model = load_blip_model(args.token, model_name=args.model, precision=args.precision, warmup=True)
+
+    server = create_inference_server(
+        FastBlipProcessor(processor),
+        model,
+        host=args.host,
+        port=args.port,
+        max_batch_size=args.max_batch_size,
+        batch_window=args.batch_window_ms / 1000,
+        max_queue=args.max_queue,
+        embeds_cache_size=args.embeds_cache
+    )
+    logging.info("Serving %s on http://%s:%d", server.info["source"], args.host, server.server_address[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,283 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .explain import (
+    API_URL,
+    HF_EXPLANATION_MODEL,
+    build_explanation_prompt,
+    format_vqa_results,
+    get_rule_based_analysis,
+    is_usable_explanation,
+    parse_hf_response,
+)
+from .telemetry import bind_trace, increment, record_span, span
+
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class ExplanationError(Exception):
+    pass
+
+
+class ExplanationDeadlineExceeded(ExplanationError):
+    pass
+
+
+class ExplanationStream:
+    # Iterates over explanation text chunks as they arrive. `text` always holds what should be shown:
+    # the partial explanation while streaming, or the rule-based analysis if the stream fails or ends
+    # up unusable (in which case that text is yielded as a final chunk). `chunks` can be any iterable
+    # of strings, e.g. an HTTP stream or a local model's token streamer.
+
+    def __init__(self, chunks, fallback, on_complete=None):
+        self.chunks = chunks
+        self.fallback = fallback
+        self.on_complete = on_complete
+        self.text = ""
+        self.source = None
+        self.time_to_first_token = None
+        self.total_time = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        failure = None
+        try:
+            for chunk in self.chunks:
+                if not chunk:
+                    continue
+                if self.time_to_first_token is None:
+                    self.time_to_first_token = time.perf_counter() - start
+                    record_span("llm_ttft", self.time_to_first_token)
+                self.text += chunk
+                yield chunk
+        except ExplanationDeadlineExceeded:
+            failure = "deadline"
+        except (ExplanationError, requests.RequestException, ValueError):
+            increment("api_errors", status="stream")
+            failure = "error"
+
+        if failure or not is_usable_explanation(self.text):
+            increment("rule_based_fallbacks", reason=failure or "unusable")
+            self.text = self.fallback()
+            self.source = "rule_based_deadline" if failure == "deadline" else "rule_based"
+            yield self.text
+        else:
+            self.source = "llm"
+            if self.on_complete is not None:
+                self.on_complete(self.text)
+        self.total_time = time.perf_counter() - start
+        record_span("llm_stream", self.total_time)
+
+
+def iter_sse_tokens(response):
+    # Text Generation Inference style server-sent events: `data: {"token": {"text": ...}, ...}`.
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        event = json.loads(data)
+        if "error" in event:
+            raise ExplanationError(f"Error from Hugging Face API: {event['error']}")
+        token = event.get("token") or {}
+        if not token.get("special"):
+            yield token.get("text", "")
+
+
+class ExplanationClient:
+    # Runs its own event loop on a background thread so synchronous callers (Streamlit, the bulk
+    # pipeline) can start a request with submit() and collect it later. HTTP goes through one pooled
+    # requests.Session; the blocking calls run on a pool of max_concurrency threads, so a request
+    # abandoned at its deadline keeps its slot until the HTTP call actually returns. `deadline` is the
+    # default total time per explanation; submit() and stream() can override it per call.
+
+    def __init__(
+        self,
+        token,
+        api_url=API_URL,
+        model_id=HF_EXPLANATION_MODEL,
+        connect_timeout=3.05,
+        read_timeout=30,
+        deadline=45,
+        max_retries=2,
+        backoff=0.5,
+        max_concurrency=4
+    ):
+        self.token = token
+        self.api_url = api_url
+        self.model_id = model_id
+        self.timeout = (connect_timeout, read_timeout)
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_concurrency))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=max_concurrency))
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="scanx-explanation-http")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="scanx-explanations", daemon=True)
+        self._thread.start()
+
+    def attempt_timeout(self, deadline_at):
+        # (connect, read) timeouts for one HTTP attempt, capped at the time left before the deadline.
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise ExplanationDeadlineExceeded("Explanation deadline passed")
+        return (min(self.timeout[0], remaining), min(self.timeout[1], remaining))
+
+    def _post(self, payload, deadline_at):
+        # Timeouts are worked out when a pool thread picks the request up, after any wait for a slot.
+        return self.session.post(self.api_url, json=payload, timeout=self.attempt_timeout(deadline_at))
+
+    async def generate(self, prompt, deadline_at=None):
+        # Bounded retry with exponential backoff on connection errors and retryable status codes; no
+        # attempt or backoff runs past deadline_at (a time.monotonic() value).
+        if deadline_at is None:
+            deadline_at = time.monotonic() + self.deadline
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(min(self.backoff * 2 ** (attempt - 1), max(deadline_at - time.monotonic(), 0)))
+            try:
+                with span("llm_api"):
+                    response = await self._loop.run_in_executor(self._executor, self._post, {"inputs": prompt}, deadline_at)
+            except requests.RequestException as e:
+                increment("api_errors", status="exception")
+                last_error = ExplanationError(f"Error generating explanation: {e}")
+                continue
+
+            if response.status_code == 200:
+                try:
+                    return parse_hf_response(response.json())
+                except (ValueError, KeyError, TypeError, IndexError) as e:
+                    increment("api_errors", status="malformed")
+                    raise ExplanationError(f"Malformed response from Hugging Face API: {e!r}")
+            increment("api_errors", status=response.status_code)
+            last_error = ExplanationError(f"Error from Hugging Face API: {response.status_code}")
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                break
+        raise last_error
+
+    async def explain(self, vqa_results, image_type, patient_info, cache=None, deadline=None):
+        # Returns (explanation, source). The rule-based analysis is used when the API errors out,
+        # returns something unusable, or misses the deadline.
+        prompt = build_explanation_prompt(format_vqa_results(vqa_results), image_type, patient_info)
+        if cache is not None:
+            cached = cache.get_explanation(prompt, self.model_id)
+            if cached is not None:
+                return cached, "llm"
+
+        deadline = self.deadline if deadline is None else deadline
+        try:
+            explanation = await asyncio.wait_for(self.generate(prompt, time.monotonic() + deadline), deadline)
+        except (asyncio.TimeoutError, ExplanationDeadlineExceeded):
+            increment("rule_based_fallbacks", reason="deadline")
+            return get_rule_based_analysis(vqa_results, patient_info), "rule_based_deadline"
+        except ExplanationError:
+            increment("rule_based_fallbacks", reason="error")
+            return get_rule_based_analysis(vqa_results, patient_info), "rule_based"
+
+        if not is_usable_explanation(explanation):
+            increment("rule_based_fallbacks", reason="unusable")
+            return get_rule_based_analysis(vqa_results, patient_info), "rule_based"
+
+        if cache is not None:
+            cache.put_explanation(prompt, self.model_id, explanation)
+        return explanation, "llm"
+
+    def _read_stream(self, prompt, deadline_at, chunks, cancelled):
+        # Runs on the request pool and hands ("chunk", text), ("error", exception) and ("done", None)
+        # to iter_stream through `chunks`, stopping early once iter_stream has given up.
+        try:
+            response = self.session.post(
+                self.api_url,
+                json={"inputs": prompt, "stream": True},
+                timeout=self.attempt_timeout(deadline_at),
+                stream=True
+            )
+            with response:
+                if response.status_code != 200:
+                    raise ExplanationError(f"Error from Hugging Face API: {response.status_code}")
+
+                content_type = response.headers.get("Content-Type", "")
+                if content_type.startswith("text/event-stream"):
+                    parts = iter_sse_tokens(response)
+                elif content_type.startswith("application/json"):
+                    # Backend does not support streaming; the whole answer arrives as one chunk.
+                    parts = [parse_hf_response(response.json())]
+                else:
+                    parts = response.iter_content(chunk_size=None, decode_unicode=True)
+                for part in parts:
+                    if cancelled.is_set():
+                        return
+                    chunks.put(("chunk", part))
+            chunks.put(("done", None))
+        except (ExplanationError, requests.RequestException) as e:
+            chunks.put(("error", e))
+        except Exception as e:
+            # A malformed body (e.g. a JSON answer without generated_text) falls back like any API error.
+            chunks.put(("error", ExplanationError(f"Malformed response from Hugging Face API: {e!r}")))
+
+    def iter_stream(self, prompt, deadline=None):
+        # The deadline covers the whole stream, measured from the request. Chunks are read on the request
+        # pool and waited for here with the time left, so neither a stalled nor a slow-drip backend can
+        # hold the caller past it.
+        deadline_at = time.monotonic() + (self.deadline if deadline is None else deadline)
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        self._executor.submit(self._read_stream, prompt, deadline_at, chunks, cancelled)
+        try:
+            while True:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise ExplanationDeadlineExceeded("Explanation deadline passed while streaming")
+                try:
+                    kind, value = chunks.get(timeout=remaining)
+                except queue.Empty:
+                    raise ExplanationDeadlineExceeded("Explanation deadline passed while streaming")
+                if kind == "chunk":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            cancelled.set()
+
+    def stream(self, vqa_results, image_type, patient_info, cache=None, deadline=None):
+        prompt = build_explanation_prompt(format_vqa_results(vqa_results), image_type, patient_info)
+        fallback = lambda: get_rule_based_analysis(vqa_results, patient_info)
+
+        if cache is not None:
+            cached = cache.get_explanation(prompt, self.model_id)
+            if cached is not None:
+                return ExplanationStream([cached], fallback)
+            on_complete = lambda text: cache.put_explanation(prompt, self.model_id, text)
+        else:
+            on_complete = None
+        return ExplanationStream(self.iter_stream(prompt, deadline), fallback, on_complete=on_complete)
+
+    def submit(self, vqa_results, image_type, patient_info, cache=None, deadline=None):
+        # Starts the request immediately and returns a concurrent.futures.Future of (explanation, source).
+        # The coroutine runs on the loop thread, so it is bound to the caller's study trace.
+        coroutine = bind_trace(self.explain(vqa_results, image_type, patient_info, cache=cache, deadline=deadline))
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._executor.shutdown(wait=False)
+        self.session.close()
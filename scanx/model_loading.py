@@ -0,0 +1,89 @@
+import os
+import time
+from pathlib import Path
+
+from PIL import Image
+from transformers import BlipForQuestionAnswering, BlipProcessor
+from transformers.utils import is_accelerate_available
+
+from .precision import apply_precision
+from .telemetry import record_span
+from .vqa import DEFAULT_MODEL, perform_vqa
+
+
+BUNDLED_MODEL_DIR = Path(__file__).resolve().parent.parent / "blip_chest_vqa_finetuned"
+WEIGHT_FILES = ("model.safetensors", "model.safetensors.index.json", "pytorch_model.bin", "pytorch_model.bin.index.json")
+
+
+def has_weights(path):
+    path = Path(path)
+    return path.is_dir() and any((path / name).exists() for name in WEIGHT_FILES)
+
+def resolve_model_source(model_name=None):
+    # Returns (source, is_local). An explicit model name or directory always wins; otherwise
+    # $SCANX_MODEL_DIR, then the fine-tuned checkpoint bundled with the repo, then the Hub model.
+    if model_name:
+        return str(model_name), Path(model_name).is_dir()
+    for candidate in (os.environ.get("SCANX_MODEL_DIR"), BUNDLED_MODEL_DIR):
+        if candidate and has_weights(candidate):
+            return str(candidate), True
+    return DEFAULT_MODEL, False
+
+def load_weights(source, is_local, token):
+    # fp32 safetensors checkpoints stay memory-mapped: parameters are backed by the file's pages in the
+    # OS page cache, so every process on the host that loads the same checkpoint shares one physical copy.
+    # low_cpu_mem_usage skips the random init and the second copy of the weights, but needs accelerate.
+    kwargs = {"use_auth_token": token, "low_cpu_mem_usage": is_accelerate_available()}
+    try:
+        return BlipForQuestionAnswering.from_pretrained(source, local_files_only=True, **kwargs)
+    except OSError:
+        if is_local or os.environ.get("HF_HUB_OFFLINE") == "1":
+            raise
+    # Not in the local Hugging Face cache yet; this is the only path that touches the network.
+    return BlipForQuestionAnswering.from_pretrained(source, **kwargs)
+
+def load_processor(source, is_local, token):
+    try:
+        return BlipProcessor.from_pretrained(source, use_auth_token=token, local_files_only=True)
+    except OSError:
+        if is_local or os.environ.get("HF_HUB_OFFLINE") == "1":
+            raise
+    return BlipProcessor.from_pretrained(source, use_auth_token=token)
+
+def warmup_model(processor, model):
+    # One throwaway question so the first real upload does not pay for lazy kernel initialisation.
+    perform_vqa(Image.new("RGB", (384, 384)), "What is shown in this image?", processor, model)
+
+def load_blip_model(token, model_name=None, precision="fp32", warmup=False):
+    # Returns (processor, model); model.load_timings records where the time went.
+    timings = {}
+    start = time.perf_counter()
+
+    source, is_local = resolve_model_source(model_name)
+    timings["source"] = source
+
+    step = time.perf_counter()
+    processor = load_processor(source, is_local, token)
+    timings["processor_seconds"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    model = load_weights(source, is_local, token)
+    if not is_local:
+        timings["weights"] = "Hugging Face cache"
+    else:
+        timings["weights"] = "safetensors (mmap)" if (Path(source) / "model.safetensors").exists() else "pytorch_model.bin"
+    model.eval()
+    timings["weights_seconds"] = time.perf_counter() - step
+
+    # bf16 and int8 conversions produce private copies, so only fp32 keeps the shared pages.
+    apply_precision(model, precision)
+
+    if warmup:
+        step = time.perf_counter()
+        warmup_model(processor, model)
+        timings["warmup_seconds"] = time.perf_counter() - step
+
+    timings["total_seconds"] = time.perf_counter() - start
+    record_span("model_load", timings["total_seconds"])
+    model.load_timings = timings
+    return processor, model
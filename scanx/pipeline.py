@@ -0,0 +1,322 @@
+import io
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from transformers import BlipImageProcessor
+
+from .cache import hash_image_bytes, model_cache_key
+from .dicom import open_medical_image
+from .explain import get_rule_based_analysis
+from .findings import extract_findings_batch
+from .llm_client import ExplanationClient
+from .preprocess import ImagePreprocessor
+from .reports import build_report, report_filename
+from .telemetry import set_current_trace, start_study
+from .vqa import DEFAULT_MODEL, STANDARD_QUESTIONS, answer_image_questions, encode_pixel_values
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".dcm")
+
+_image_processor = None
+
+
+def discover_studies(source, image_type="X-ray", anatomical_region="Chest", modality_details=""):
+    # A directory is scanned for images; any other path is read as a JSONL manifest with one study per line.
+    source = Path(source)
+    defaults = {
+        "patient_info": {},
+        "image_type": image_type,
+        "anatomical_region": anatomical_region,
+        "modality_details": modality_details
+    }
+
+    if source.is_dir():
+        for path in sorted(source.rglob("*")):
+            if path.suffix.lower() in IMAGE_EXTENSIONS:
+                study_id = path.relative_to(source).with_suffix("").as_posix()
+                yield {**defaults, "study_id": study_id, "image": str(path)}
+        return
+
+    seen = set()
+    with open(source) as manifest:
+        for line_number, line in enumerate(manifest, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "image" not in entry:
+                raise ValueError(f"{source}:{line_number}: manifest entry has no 'image' field")
+
+            image_path = Path(entry["image"])
+            if not image_path.is_absolute():
+                image_path = source.parent / image_path
+
+            study = {**defaults, **entry, "image": str(image_path)}
+            if "study_id" not in study:
+                # The path relative to the manifest, as in directory mode, so a/x.jpg and b/x.jpg stay apart.
+                try:
+                    study["study_id"] = image_path.relative_to(source.parent).with_suffix("").as_posix()
+                except ValueError:
+                    study["study_id"] = image_path.with_suffix("").as_posix()
+            if study["study_id"] in seen:
+                raise ValueError(f"{source}:{line_number}: duplicate study_id {study['study_id']!r}")
+            seen.add(study["study_id"])
+            yield study
+
+def load_image(path):
+    # DICOM files come back windowed and already downsampled towards the processor's input size.
+    return open_medical_image(path)
+
+def read_image_bytes(path):
+    with open(path, "rb") as image_file:
+        return image_file.read()
+
+def init_preprocess_worker(model_name, token=None):
+    global _image_processor
+    _image_processor = ImagePreprocessor(BlipImageProcessor.from_pretrained(model_name, use_auth_token=token), cache_size=0)
+
+def preprocess_image(path):
+    # Returns (content hash, pixel_values); the bytes are read once for both.
+    data = read_image_bytes(path)
+    image = load_image(io.BytesIO(data))
+    # The preprocessor reuses its output buffer, so the row is copied out before the next image.
+    return hash_image_bytes(data), _image_processor.preprocess([image])[0].numpy().copy()
+
+def preprocess_studies(studies, model_name=DEFAULT_MODEL, token=None, workers=0, prefetch=32):
+    # Yields (study, (image_hash, pixel_values), error) in input order. Decoding and resizing run in a process pool
+    # with at most `prefetch` images in flight, so memory stays flat however long the input is.
+    if workers <= 0:
+        init_preprocess_worker(model_name, token)
+        for study in studies:
+            try:
+                yield study, preprocess_image(study["image"]), None
+            except Exception as e:
+                yield study, None, str(e)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_preprocess_worker, initargs=(model_name, token)) as executor:
+        pending = deque()
+        studies = iter(studies)
+        exhausted = False
+
+        while pending or not exhausted:
+            while not exhausted and len(pending) < prefetch:
+                study = next(studies, None)
+                if study is None:
+                    exhausted = True
+                else:
+                    pending.append((study, executor.submit(preprocess_image, study["image"])))
+
+            if pending:
+                study, future = pending.popleft()
+                try:
+                    yield study, future.result(), None
+                except Exception as e:
+                    yield study, None, str(e)
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def read_completed_studies(results_path):
+    # Only successful studies count as completed: error records are retried on resume, and a crash can
+    # leave a truncated last line, which is ignored so that study is simply redone.
+    completed = set()
+    if not os.path.exists(results_path):
+        return completed
+
+    with open(results_path) as results_file:
+        for line in results_file:
+            try:
+                record = json.loads(line)
+                if "error" not in record:
+                    completed.add(record["study_id"])
+            except (ValueError, KeyError, TypeError):
+                continue
+    return completed
+
+def ends_with_newline(path):
+    with open(path, "rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+def explain_study(study, answers, explanation_mode, client=None, cache=None, findings=None):
+    # Returns a future of (explanation, source). LLM requests start as soon as the study's answers
+    # exist and run in the background while the next batch goes through the model.
+    if explanation_mode == "llm":
+        return client.submit(answers, study["image_type"], study["patient_info"], cache=cache)
+    future = Future()
+    future.set_result((get_rule_based_analysis(answers, study["patient_info"], findings=findings), "rule_based"))
+    return future
+
+def run_pipeline(
+    source,
+    output_dir,
+    processor,
+    model,
+    questions=STANDARD_QUESTIONS,
+    token=None,
+    explanation_mode="rule",
+    batch_size=8,
+    max_question_batch=32,
+    workers=0,
+    resume=True,
+    model_name=DEFAULT_MODEL,
+    study_defaults=None,
+    cache=None,
+    client=None,
+    max_in_flight=32,
+    log_every=100,
+    store=None
+):
+    output_dir = Path(output_dir)
+    reports_dir = output_dir / "reports"
+    reports_dir.mkdir(parents=True, exist_ok=True)
+    results_path = output_dir / "results.jsonl"
+
+    completed = read_completed_studies(results_path) if resume else set()
+    if completed:
+        logger.info("Resuming: %d studies already in %s", len(completed), results_path)
+
+    studies = (study for study in discover_studies(source, **(study_defaults or {})) if study["study_id"] not in completed)
+    stats = {"processed": 0, "failed": 0, "skipped": len(completed)}
+    model_key = model_cache_key(model) if cache is not None else None
+    owns_client = explanation_mode == "llm" and client is None
+    if owns_client:
+        client = ExplanationClient(token)
+    in_flight = deque()
+    start_time = time.perf_counter()
+
+    # The store is flushed however the run ends, so every study already in results.jsonl (and therefore
+    # skipped on resume) is also in the store.
+    try:
+        with open(results_path, "a" if resume else "w") as results_file:
+            if resume and not ends_with_newline(results_path):
+                # Terminate a line left half-written by a crash before appending new results.
+                results_file.write("\n")
+
+            def write_result(record):
+                results_file.write(json.dumps(record) + "\n")
+                results_file.flush()
+
+            def finish_study(study, trace, answers, explanation_future):
+                set_current_trace(trace)
+                explanation, explanation_source = explanation_future.result()
+                report = build_report(
+                    study["patient_info"],
+                    answers,
+                    explanation,
+                    study["image_type"],
+                    study["anatomical_region"],
+                    study["modality_details"]
+                )
+                report_path = reports_dir / report_filename(study["study_id"])
+                report_path.write_text(report)
+
+                write_result({
+                    "study_id": study["study_id"],
+                    "image": study["image"],
+                    "answers": answers,
+                    "explanation": explanation,
+                    "explanation_source": explanation_source,
+                    "report": str(report_path),
+                    "trace_id": trace.trace_id
+                })
+                if store is not None:
+                    store.add({
+                        **study,
+                        "answers": answers,
+                        "explanation": explanation,
+                        "explanation_source": explanation_source,
+                        "trace_id": trace.trace_id
+                    })
+                set_current_trace(None)
+                stats["processed"] += 1
+
+                if stats["processed"] % log_every == 0:
+                    elapsed = time.perf_counter() - start_time
+                    logger.info("%d studies processed (%.2f images/sec)", stats["processed"], stats["processed"] / elapsed)
+
+            preprocessed = preprocess_studies(studies, model_name=model_name, token=token, workers=workers, prefetch=max(batch_size * 2, workers * 2))
+            for batch in batched(preprocessed, batch_size):
+                ready = []
+                for study, preprocessed_image, error in batch:
+                    if error is None:
+                        ready.append((study, preprocessed_image))
+                    else:
+                        write_result({"study_id": study["study_id"], "image": study["image"], "error": error})
+                        stats["failed"] += 1
+
+                if not ready:
+                    continue
+
+                answers_per_study = []
+                traces = []
+                pending = []
+                for study, (image_hash, pixel_values) in ready:
+                    traces.append(start_study(study["study_id"]))
+                    study_questions = study.get("questions", questions)
+                    if cache is not None:
+                        answers, missing = cache.get_answers(image_hash, study_questions, model_key)
+                    else:
+                        answers, missing = {}, study_questions
+                    answers_per_study.append(answers)
+                    if missing:
+                        pending.append((len(answers_per_study) - 1, image_hash, pixel_values, missing))
+
+                # The encoder and decoder run once for the whole batch, so their spans belong to no single study.
+                set_current_trace(None)
+
+                # Only images with at least one uncached question go through the vision encoder.
+                if pending:
+                    image_embeds = encode_pixel_values(torch.from_numpy(np.stack([p[2] for p in pending])), model)
+                    new_answers = answer_image_questions(
+                        image_embeds,
+                        [p[3] for p in pending],
+                        processor,
+                        model,
+                        max_batch_size=max_question_batch
+                    )
+                    for (index, image_hash, _, _), answers in zip(pending, new_answers):
+                        answers_per_study[index].update(answers)
+                        if cache is not None:
+                            cache.put_answers(image_hash, answers, model_key)
+
+                answers_per_study = [{q: answers[q] for q in study.get("questions", questions)} for (study, _), answers in zip(ready, answers_per_study)]
+                # The rule-based analysis extracts findings for the whole batch in one pass.
+                batch_findings = extract_findings_batch(answers_per_study) if explanation_mode != "llm" else [None] * len(ready)
+                for (study, _), trace, answers, findings in zip(ready, traces, answers_per_study, batch_findings):
+                    set_current_trace(trace)
+                    in_flight.append((study, trace, answers, explain_study(study, answers, explanation_mode, client=client, cache=cache, findings=findings)))
+                set_current_trace(None)
+
+                while in_flight and (in_flight[0][3].done() or len(in_flight) > max_in_flight):
+                    finish_study(*in_flight.popleft())
+
+            while in_flight:
+                finish_study(*in_flight.popleft())
+    finally:
+        if owns_client:
+            client.close()
+        if store is not None:
+            store.flush()
+
+    stats["elapsed"] = time.perf_counter() - start_time
+    stats["images_per_sec"] = stats["processed"] / stats["elapsed"] if stats["elapsed"] > 0 else 0.0
+    return stats
@@ -0,0 +1,33 @@
+import torch
+from torch import nn
+
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def cpu_supports_bf16():
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+def available_precisions():
+    return [precision for precision in PRECISIONS if precision != "bf16" or cpu_supports_bf16()]
+
+def apply_precision(model, precision):
+    # Converts a loaded fp32 model in place. int8 uses dynamic quantization of the nn.Linear layers
+    # in the vision encoder and the answer decoder, which dominate CPU time; weights are stored as int8
+    # and activations are quantized on the fly, so no calibration data is needed.
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}; expected one of {', '.join(PRECISIONS)}")
+
+    if precision == "bf16":
+        if not cpu_supports_bf16():
+            raise ValueError("This CPU has no native bf16 support; use fp32 or int8")
+        model.to(torch.bfloat16)
+    elif precision == "int8":
+        model.vision_model = torch.ao.quantization.quantize_dynamic(model.vision_model, {nn.Linear}, dtype=torch.qint8)
+        model.text_decoder = torch.ao.quantization.quantize_dynamic(model.text_decoder, {nn.Linear}, dtype=torch.qint8)
+
+    model.inference_precision = precision
+    return model
@@ -0,0 +1,209 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import BatchFeature
+
+
+PREVIEW_SIZE = 512
+
+def resize_for_model(image, size, resample):
+    # RGB at the model's input size (width, height), resized exactly as BlipProcessor would. The
+    # processor's own resize is then a no-op, so an app can keep a study at model resolution only.
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if image.size != tuple(size):
+        image = image.resize(tuple(size), resample=Image.Resampling(resample))
+    return image
+
+def preview_thumbnail(image, max_size=PREVIEW_SIZE):
+    # Small copy for display, so the browser is not sent the full-resolution image.
+    thumbnail = image.copy()
+    thumbnail.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    return thumbnail
+
+
+class ImagePreprocessor:
+    # Batched replacement for BlipImageProcessor. Each image gets the same PIL resize (so outputs match
+    # BlipProcessor), straight into a uint8 batch buffer; rescale and normalize then run as one fused
+    # multiply-add over the whole batch into a float buffer. Both buffers are per thread and reused, so
+    # the tensor returned by preprocess() is only valid until that thread's next call.
+    # Preprocessed images are also kept in a small LRU keyed by image hash.
+
+    def __init__(self, image_processor, cache_size=16):
+        self.height = image_processor.size["height"]
+        self.width = image_processor.size["width"]
+        self.resample = Image.Resampling(image_processor.resample)
+        self.do_resize = image_processor.do_resize
+
+        scale = image_processor.rescale_factor if image_processor.do_rescale else 1.0
+        mean = np.array(image_processor.image_mean if image_processor.do_normalize else [0.0, 0.0, 0.0], dtype=np.float64)
+        std = np.array(image_processor.image_std if image_processor.do_normalize else [1.0, 1.0, 1.0], dtype=np.float64)
+        # (x * scale - mean) / std == x * (scale / std) - mean / std
+        self.multiplier = torch.tensor(scale / std, dtype=torch.float32).view(1, 3, 1, 1)
+        self.offset = torch.tensor(mean / std, dtype=torch.float32).view(1, 3, 1, 1)
+
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _buffers(self, batch_size):
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None or buffers[0].size(0) < batch_size:
+            buffers = (
+                torch.empty(batch_size, self.height, self.width, 3, dtype=torch.uint8),
+                torch.empty(batch_size, 3, self.height, self.width, dtype=torch.float32)
+            )
+            self._local.buffers = buffers
+        return buffers
+
+    def _resize(self, image):
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(np.asarray(image))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if self.do_resize and image.size != (self.width, self.height):
+            image = image.resize((self.width, self.height), resample=self.resample)
+        return np.asarray(image)
+
+    def _cached(self, image_hash):
+        if image_hash is None or not self.cache_size:
+            return None
+        with self._lock:
+            pixel_values = self._cache.get(image_hash)
+            if pixel_values is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(image_hash)
+            self.hits += 1
+            return pixel_values
+
+    def _store(self, image_hash, pixel_values):
+        if image_hash is None or not self.cache_size:
+            return
+        with self._lock:
+            self._cache[image_hash] = pixel_values.clone()
+            self._cache.move_to_end(image_hash)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def preprocess(self, images, image_hashes=None):
+        # Returns [batch, 3, height, width] float32 pixel values for a list of images.
+        if isinstance(images, Image.Image):
+            images = [images]
+        image_hashes = image_hashes or [None] * len(images)
+        pixels, output = self._buffers(len(images))
+
+        cached = [self._cached(image_hash) for image_hash in image_hashes]
+        for i, pixel_values in enumerate(cached):
+            if pixel_values is None:
+                pixels[i].numpy()[...] = self._resize(images[i])
+
+        # One pass over the batch; rows served from the cache are overwritten afterwards.
+        batch = output[:len(images)]
+        torch.mul(pixels[:len(images)].permute(0, 3, 1, 2), self.multiplier, out=batch)
+        batch.sub_(self.offset)
+
+        for i, pixel_values in enumerate(cached):
+            if pixel_values is None:
+                self._store(image_hashes[i], batch[i])
+            else:
+                batch[i].copy_(pixel_values)
+        return batch
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._cache)}
+
+
+class QuestionTokenizer:
+    # Caches the token ids of each question and pads batches itself, so repeated questions (the
+    # standard set is asked of every study) skip the tokenizer entirely.
+
+    def __init__(self, tokenizer, cache_size=1024):
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def token_ids(self, question):
+        with self._lock:
+            ids = self._cache.get(question)
+            if ids is not None:
+                self._cache.move_to_end(question)
+                self.hits += 1
+                return ids
+            self.misses += 1
+
+        ids = self.tokenizer(question).input_ids
+        with self._lock:
+            self._cache[question] = ids
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return ids
+
+    def encode(self, questions):
+        # Returns (input_ids, attention_mask) padded the way the tokenizer pads with padding=True.
+        if isinstance(questions, str):
+            questions = [questions]
+        ids = [self.token_ids(question) for question in questions]
+        length = max(len(row) for row in ids)
+
+        input_ids = torch.full((len(ids), length), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(ids), length), dtype=torch.long)
+        for i, row in enumerate(ids):
+            span = slice(length - len(row), length) if self.tokenizer.padding_side == "left" else slice(0, len(row))
+            input_ids[i, span] = torch.tensor(row, dtype=torch.long)
+            attention_mask[i, span] = 1
+        return input_ids, attention_mask
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._cache)}
+
+
+class FastBlipProcessor:
+    # Drop-in for BlipProcessor in the scanx.vqa functions: images go through ImagePreprocessor and
+    # questions through QuestionTokenizer. Decoding is delegated to the wrapped processor.
+
+    def __init__(self, processor, image_cache_size=16, token_cache_size=1024):
+        self.processor = processor
+        self.image_processor = processor.image_processor
+        self.tokenizer = processor.tokenizer
+        self.images = ImagePreprocessor(processor.image_processor, cache_size=image_cache_size)
+        self.questions = QuestionTokenizer(processor.tokenizer, cache_size=token_cache_size)
+
+    def __call__(self, images=None, text=None, return_tensors="pt", padding=False, image_hashes=None, **kwargs):
+        if return_tensors != "pt" or kwargs:
+            return self.processor(images=images, text=text, return_tensors=return_tensors, padding=padding, **kwargs)
+
+        data = {}
+        if images is not None:
+            data["pixel_values"] = self.images.preprocess(images, image_hashes)
+        if text is not None:
+            data["input_ids"], data["attention_mask"] = self.questions.encode(text)
+        return BatchFeature(data=data)
+
+    def pixel_values(self, images, image_hashes=None):
+        return self.images.preprocess(images, image_hashes)
+
+    def decode(self, *args, **kwargs):
+        return self.processor.decode(*args, **kwargs)
+
+    def batch_decode(self, *args, **kwargs):
+        return self.processor.batch_decode(*args, **kwargs)
+
+    def save_pretrained(self, *args, **kwargs):
+        return self.processor.save_pretrained(*args, **kwargs)
+
+    def stats(self):
+        return {"images": self.images.stats(), "questions": self.questions.stats()}
@@ -0,0 +1,79 @@
+import os
+from datetime import datetime
+
+from .telemetry import span
+
+
+def build_patient_section(patient_info, image_type, anatomical_region, modality_details):
+    if not patient_info:
+        return "# Medical Image Analysis Report\n\n*No patient information provided*"
+
+    return f"""# Medical Image Analysis Report
+
+## Patient Information
+
+- **Patient Name:** {patient_info.get('name', 'Not provided')}
+- **Patient ID:** {patient_info.get('id', 'Not provided')}
+- **Date of Birth:** {patient_info.get('dob', 'Not provided')}
+- **Age:** {patient_info.get('age', 'Not provided')}
+- **Gender:** {patient_info.get('gender', 'Not provided')}
+- **Weight:** {patient_info.get('weight', 'Not provided')} kg
+- **Height:** {patient_info.get('height', 'Not provided')} cm
+- **Referring Physician:** {patient_info.get('referring_physician', 'Not provided')}
+
+### Clinical Information
+
+- **Chief Complaint:** {patient_info.get('chief_complaint', 'Not provided')}
+- **Clinical History:** {patient_info.get('clinical_history', 'Not provided')}
+- **Current Medications:** {patient_info.get('medications', 'Not provided')}
+- **Allergies:** {patient_info.get('allergies', 'Not provided')}
+
+## Study Details
+
+- **Study Date:** {patient_info.get('study_date', 'Not provided')}
+- **Modality:** {image_type}
+- **Anatomical Region:** {anatomical_region}
+- **Modality Details:** {modality_details}"""
+
+def format_answer(answer, scores=None):
+    # Closed-set answers carry their calibrated score; the runners-up are listed after it.
+    if not scores or scores.get(answer) is None:
+        return answer
+    others = ", ".join(f"{candidate} {score:.0%}" for candidate, score in list(scores.items())[1:3])
+    return f"{answer} (confidence {scores[answer]:.0%}" + (f"; {others})" if others else ")")
+
+def build_report(patient_info, vqa_results, explanation, image_type, anatomical_region, modality_details, generated_on=None, answer_scores=None):
+    with span("report"):
+        return render_report(patient_info, vqa_results, explanation, image_type, anatomical_region, modality_details, generated_on, answer_scores)
+
+def render_report(patient_info, vqa_results, explanation, image_type, anatomical_region, modality_details, generated_on=None, answer_scores=None):
+    if generated_on is None:
+        generated_on = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    answer_scores = answer_scores or {}
+    patient_info_section = build_patient_section(patient_info, image_type, anatomical_region, modality_details)
+    vqa_section = "\n".join([f"**Q: {q}**\nA: {format_answer(a, answer_scores.get(q))}\n" for q, a in vqa_results.items()])
+
+    return f"""{patient_info_section}
+
+## AI Analysis Results
+
+### Visual Question Answering Results
+
+{vqa_section}
+
+### AI Medical Explanation
+
+{explanation}
+
+## Report Information
+
+- **Generated on:** {generated_on}
+- **Analysis Method:** AI-assisted image analysis (BLIP + LLM)
+"""
+
+def report_to_text(report_content):
+    return report_content.replace("###", "**").replace("##", "**")
+
+def report_filename(study_id):
+    return study_id.replace("/", "__").replace(os.sep, "__") + ".md"
@@ -0,0 +1,129 @@
+import json
+import os
+
+import torch
+
+from .cache import normalize_question
+from .telemetry import span
+from .vqa import encode_questions
+
+
+DIAGNOSIS_LABELS = [
+    "normal",
+    "pneumonia",
+    "cardiomegaly",
+    "pleural effusion",
+    "atelectasis",
+    "pneumothorax",
+    "pulmonary edema",
+    "consolidation",
+    "lung nodule",
+    "lung mass",
+    "emphysema",
+    "tuberculosis",
+    "fracture"
+]
+
+DEFAULT_CALIBRATION_PATH = os.path.join(os.path.expanduser("~"), ".cache", "scanx", "answer_calibration.json")
+
+# Standard questions whose answers come from a known set. Questions not listed here are answered by
+# free-form generation as before.
+CLOSED_SET_ANSWERS = {
+    "Is there any pathology visible?": ["yes", "no"],
+    "Are there any concerning features in this image?": ["yes", "no"],
+    "What might be the diagnosis based on this image?": DIAGNOSIS_LABELS,
+    "What is the main finding in this image?": DIAGNOSIS_LABELS
+}
+
+def load_answer_vocabulary(path):
+    # A JSON object mapping each question to its list of candidate answers.
+    with open(path) as vocabulary_file:
+        return json.load(vocabulary_file)
+
+def load_calibration(path=DEFAULT_CALIBRATION_PATH):
+    # The calibration written by `python -m scanx.calibrate_answers`; uncalibrated scores (temperature 1 over
+    # summed log-likelihoods) when there is none. "fitted" says which of the two this is.
+    calibration = {"temperature": 1.0, "length_normalize": False, "fitted": False}
+    if path and os.path.exists(path):
+        with open(path) as calibration_file:
+            calibration.update(json.load(calibration_file), fitted=True)
+    return calibration
+
+def candidates_for(question, vocabulary=CLOSED_SET_ANSWERS):
+    # Questions match the way the answer cache matches them, ignoring case and spacing.
+    normalized = {normalize_question(q): candidates for q, candidates in vocabulary.items()}
+    return normalized.get(normalize_question(question))
+
+def candidate_log_likelihoods(image_embeds, questions, candidates_per_question, processor, model, length_normalize=False):
+    # Log-likelihood of every candidate under the answer decoder, teacher-forced in a single forward
+    # pass over all (question, candidate) pairs. Returns one 1-D tensor per question. A summed
+    # log-likelihood favours candidates with fewer tokens; length_normalize averages it per token instead.
+    if not hasattr(model, "text_decoder"):
+        raise ValueError("Closed-set scoring needs the PyTorch BLIP model, not a compiled graph backend")
+    if image_embeds.size(0) == 1:
+        image_embeds = image_embeds.expand(len(questions), -1, -1)
+
+    inputs = processor(text=questions, padding=True, return_tensors="pt")
+    question_embeds = encode_questions(image_embeds, inputs.input_ids, inputs.attention_mask, model)
+
+    rows = [i for i, candidates in enumerate(candidates_per_question) for _ in candidates]
+    answers = processor.tokenizer(
+        [candidate for candidates in candidates_per_question for candidate in candidates],
+        padding=True,
+        return_tensors="pt"
+    )
+    # [CLS] answer [SEP] becomes [BOS] answer [SEP]: exactly what generate() would have to produce,
+    # including the [SEP] that ends the answer.
+    answer_ids = answers.input_ids.clone()
+    answer_ids[:, 0] = model.config.text_config.bos_token_id
+
+    with torch.no_grad():
+        logits = model.text_decoder(
+            input_ids=answer_ids,
+            attention_mask=answers.attention_mask,
+            encoder_hidden_states=question_embeds[rows],
+            encoder_attention_mask=inputs.attention_mask[rows],
+            return_dict=True
+        ).logits
+        log_probs = torch.log_softmax(logits[:, :-1].float(), dim=-1)
+        token_log_probs = log_probs.gather(-1, answer_ids[:, 1:, None]).squeeze(-1) * answers.attention_mask[:, 1:]
+        totals = token_log_probs.sum(dim=1)
+        if length_normalize:
+            totals = totals / answers.attention_mask[:, 1:].sum(dim=1)
+    return list(totals.split([len(candidates) for candidates in candidates_per_question]))
+
+def calibrate(log_likelihoods, temperature=1.0):
+    # Normalizes over the closed set; a temperature above 1 softens overconfident scores (see fit_temperature).
+    return torch.softmax(log_likelihoods / temperature, dim=0)
+
+def answer_nll(log_likelihoods, labels, temperature=1.0):
+    # Mean negative log-likelihood of the correct candidates: `log_likelihoods` holds one tensor per
+    # question from candidate_log_likelihoods and `labels` the index of the correct candidate in each.
+    return -sum(torch.log_softmax(scores / temperature, dim=0)[label].item() for scores, label in zip(log_likelihoods, labels)) / len(labels)
+
+def fit_temperature(log_likelihoods, labels, temperatures=None):
+    # Temperature scaling on a labelled set: the temperature with the lowest answer_nll. The default grid
+    # includes 1, so a fitted temperature never does worse than none on the labelled set.
+    temperatures = temperatures or [1.0] + [0.25 * 1.25 ** i for i in range(25)]
+    return min(temperatures, key=lambda temperature: answer_nll(log_likelihoods, labels, temperature))
+
+def score_answers(image_embeds, questions, processor, model, vocabulary=CLOSED_SET_ANSWERS, temperature=1.0, length_normalize=False):
+    # Returns (answers, scores): the top candidate for each question and a candidate->probability dict
+    # ordered from most to least likely. Every question needs candidates in the vocabulary. The scores
+    # are only calibrated with the temperature and length_normalize from load_calibration().
+    if not questions:
+        return [], []
+    candidates_per_question = [candidates_for(question, vocabulary) for question in questions]
+    unscored = [question for question, candidates in zip(questions, candidates_per_question) if not candidates]
+    if unscored:
+        raise ValueError(f"No candidate answers configured for: {unscored}")
+
+    with span("score"):
+        log_likelihoods = candidate_log_likelihoods(image_embeds, questions, candidates_per_question, processor, model, length_normalize)
+
+    scores = []
+    for candidates, question_log_likelihoods in zip(candidates_per_question, log_likelihoods):
+        probabilities = calibrate(question_log_likelihoods, temperature)
+        order = probabilities.argsort(descending=True).tolist()
+        scores.append({candidates[i]: probabilities[i].item() for i in order})
+    return [next(iter(question_scores)) for question_scores in scores], scores
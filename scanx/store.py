@@ -0,0 +1,252 @@
+import json
+import os
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+from .database import SQLiteDatabase
+from .reports import build_report, report_filename, report_to_text
+from .telemetry import span
+
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "scanx", "studies.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    study_id TEXT PRIMARY KEY,
+    patient_id TEXT,
+    patient_name TEXT,
+    study_date TEXT,
+    modality TEXT COLLATE NOCASE,
+    region TEXT COLLATE NOCASE,
+    modality_details TEXT,
+    image_hash TEXT,
+    patient_info TEXT NOT NULL,
+    answers TEXT NOT NULL,
+    answer_scores TEXT,
+    explanation TEXT NOT NULL,
+    explanation_source TEXT,
+    trace_id TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS studies_patient ON studies (patient_id, modality, region, study_date);
+CREATE INDEX IF NOT EXISTS studies_date ON studies (study_date);
+CREATE INDEX IF NOT EXISTS studies_modality_region ON studies (modality, region, study_date);
+CREATE TABLE IF NOT EXISTS reports (
+    study_id TEXT PRIMARY KEY,
+    report TEXT NOT NULL
+);
+"""
+
+COLUMNS = [
+    "study_id", "patient_id", "patient_name", "study_date", "modality", "region", "modality_details", "image_hash",
+    "patient_info", "answers", "answer_scores", "explanation", "explanation_source", "trace_id", "created_at"
+]
+SUMMARY_COLUMNS = ["study_id", "patient_id", "patient_name", "study_date", "modality", "region", "modality_details", "created_at"]
+JSON_COLUMNS = ("patient_info", "answers", "answer_scores")
+
+
+def study_row(record, now=None):
+    # A pipeline-style record: study_id, patient_info, image_type, anatomical_region, modality_details,
+    # answers and explanation, with optional answer_scores, explanation_source, image_hash and trace_id.
+    patient_info = record.get("patient_info") or {}
+    study_date = patient_info.get("study_date")
+    return (
+        record["study_id"],
+        str(patient_info["id"]) if patient_info.get("id") else None,
+        patient_info.get("name") or None,
+        str(study_date)[:10] if study_date else None,
+        record.get("image_type"),
+        record.get("anatomical_region"),
+        record.get("modality_details"),
+        record.get("image_hash"),
+        json.dumps(patient_info, default=str),
+        json.dumps(record["answers"]),
+        json.dumps(record["answer_scores"]) if record.get("answer_scores") else None,
+        record["explanation"],
+        record.get("explanation_source"),
+        record.get("trace_id"),
+        now or time.time()
+    )
+
+def render_study_report(study):
+    # Dated when the study was saved, so rendering it again later gives the same report.
+    return build_report(
+        study["patient_info"],
+        study["answers"],
+        study["explanation"],
+        study["modality"],
+        study["region"],
+        study["modality_details"],
+        generated_on=datetime.fromtimestamp(study["created_at"]).strftime("%Y-%m-%d %H:%M:%S"),
+        answer_scores=study["answer_scores"]
+    )
+
+def archive_name(study, text=False):
+    name = report_filename(study["study_id"])
+    if text:
+        name = name[:-len(".md")] + ".txt"
+    return f"{study['patient_id'] or 'unknown'}/{study['study_date'] or 'undated'}_{name}"
+
+
+class ChunkWriter:
+    # Write-only file object drained after each archive member, so zipfile streams the archive
+    # (it writes data descriptors when it cannot seek) without ever holding all of it.
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class StudyStore(SQLiteDatabase):
+    # Indexed on patient ID, study date, modality and region. add() buffers studies and writes them
+    # batch_size at a time in one transaction; flush() (or leaving a `with` block) writes the rest.
+    # Reports are rendered the first time they are asked for and kept until the study is saved again.
+
+    def __init__(self, path=DEFAULT_STORE_PATH, batch_size=100):
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        super().__init__(path, SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def add(self, record):
+        with self._lock:
+            self._pending.append(study_row(record))
+            due = len(self._pending) >= self.batch_size
+        if due:
+            self.flush()
+
+    def flush(self):
+        # Rows leave the buffer only once they are committed, so a failed write (e.g. the database stayed
+        # locked past the busy timeout) can be retried by the next flush. Flushes run one at a time;
+        # add() can keep appending meanwhile.
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._pending)
+            self._write(rows)
+            with self._lock:
+                del self._pending[:len(rows)]
+
+    def save(self, record):
+        self.save_many([record])
+
+    def save_many(self, records):
+        now = time.time()
+        self._write([study_row(record, now) for record in records])
+
+    def _write(self, rows):
+        if not rows:
+            return
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO studies ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+            connection.executemany("DELETE FROM reports WHERE study_id = ?", [(row[0],) for row in rows])
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def find(self, patient_id=None, modality=None, region=None, date_from=None, date_to=None, limit=None):
+        # Study summaries, newest first. Modality and region match case-insensitively; dates are
+        # inclusive YYYY-MM-DD strings (or dates).
+        clauses = []
+        params = []
+        for column, value in (("patient_id", patient_id), ("modality", modality), ("region", region)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(str(value))
+        if date_from:
+            clauses.append("study_date >= ?")
+            params.append(str(date_from)[:10])
+        if date_to:
+            clauses.append("study_date <= ?")
+            params.append(str(date_to)[:10])
+
+        query = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM studies"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY study_date DESC, created_at DESC"
+        if limit:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        return [dict(zip(SUMMARY_COLUMNS, row)) for row in self._connection().execute(query, params)]
+
+    def get(self, study_id):
+        row = self._connection().execute(f"SELECT {', '.join(COLUMNS)} FROM studies WHERE study_id = ?", (study_id,)).fetchone()
+        if row is None:
+            return None
+        study = dict(zip(COLUMNS, row))
+        for column in JSON_COLUMNS:
+            study[column] = json.loads(study[column]) if study[column] else {}
+        return study
+
+    def report(self, study_id, text=False):
+        # Markdown report, or plain text with text=True; None for an unknown study.
+        connection = self._connection()
+        row = connection.execute("SELECT report FROM reports WHERE study_id = ?", (study_id,)).fetchone()
+        if row is not None:
+            report = row[0]
+        else:
+            study = self.get(study_id)
+            if study is None:
+                return None
+            report = render_study_report(study)
+            # Kept only if the study was not saved again while it was being rendered.
+            connection.execute(
+                "INSERT OR REPLACE INTO reports (study_id, report) SELECT ?, ? WHERE EXISTS (SELECT 1 FROM studies WHERE study_id = ? AND created_at = ?)",
+                (study_id, report, study_id, study["created_at"])
+            )
+        return report_to_text(report) if text else report
+
+    def iter_zip(self, studies, text=False):
+        # Yields a ZIP of the given studies' reports (summaries from find()) a member at a time, for
+        # streaming to a file or an HTTP response.
+        writer = ChunkWriter()
+        with span("export"):
+            with zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED) as archive:
+                for study in studies:
+                    report = self.report(study["study_id"], text=text)
+                    if report is not None:
+                        archive.writestr(archive_name(study, text), report)
+                    chunk = writer.drain()
+                    if chunk:
+                        yield chunk
+            yield writer.drain()
+
+    def export_zip(self, studies, output, text=False):
+        # `output` is a path or a writable binary file object.
+        if isinstance(output, (str, os.PathLike)):
+            with open(output, "wb") as output_file:
+                return self.export_zip(studies, output_file, text)
+        for chunk in self.iter_zip(studies, text):
+            output.write(chunk)
+
+    def stats(self):
+        connection = self._connection()
+        studies, patients = connection.execute("SELECT COUNT(*), COUNT(DISTINCT patient_id) FROM studies").fetchone()
+        reports = connection.execute("SELECT COUNT(*) FROM reports").fetchone()[0]
+        return {"studies": studies, "patients": patients, "reports": reports, "pending": len(self._pending)}
+
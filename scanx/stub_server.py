@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+DEFAULT_STUB_TEXT = (
+    "The findings are consistent with the observations reported by the visual question answering model. "
+    "Clinical correlation and follow-up imaging are recommended."
+)
+
+
+class StubExplanationHandler(BaseHTTPRequestHandler):
+    # Behaviour is read from the server: delay (seconds before answering), fail_first (number of
+    # requests answered with fail_status before succeeding), text (the generated_text returned) and
+    # token_delay (pause between server-sent events when the request asks for a stream). The server
+    # also counts requests and the most it has had in progress at once (max_active).
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        with server.lock:
+            server.requests += 1
+            attempt = server.requests
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self.respond(payload, attempt)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self, payload, attempt):
+        server = self.server
+        if server.delay:
+            time.sleep(server.delay)
+
+        if attempt <= server.fail_first:
+            self.send_json(server.fail_status, {"error": "stub failure"})
+        elif payload.get("stream"):
+            self.send_event_stream(server.text, server.token_delay)
+        else:
+            self.send_json(200, [{"generated_text": server.text}])
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_event_stream(self, text, token_delay):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        for i, word in enumerate(text.split(" ")):
+            token = {"token": {"text": word if i == 0 else " " + word, "special": False}, "generated_text": None}
+            try:
+                self.wfile.write(f"data: {json.dumps(token)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up on the stream.
+                return
+            if token_delay:
+                time.sleep(token_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(delay=0.0, fail_first=0, fail_status=503, text=DEFAULT_STUB_TEXT, token_delay=0.0, handler=StubExplanationHandler):
+    # Starts a local stand-in for the Hugging Face inference API on a free port.
+    # Returns (server, url); call server.shutdown() when done.
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.fail_first = fail_first
+    server.fail_status = fail_status
+    server.text = text
+    server.token_delay = token_delay
+    server.requests = 0
+    server.active = 0
+    server.max_active = 0
+    server.lock = threading.Lock()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
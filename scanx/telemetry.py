@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds (seconds) of the Prometheus histogram buckets for stage durations.
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_trace = ContextVar("scanx_trace", default=None)
+
+
+class StudyTrace:
+    # Stage timings and counters for one study, identified by a short correlation ID that also tags
+    # every JSON log line written while the trace is current.
+
+    def __init__(self, study_id=None):
+        self.trace_id = uuid.uuid4().hex[:12]
+        self.study_id = study_id
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "study_id": self.study_id,
+            "started_at": self.started_at,
+            "stages_ms": {stage: seconds * 1000 for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters)
+        }
+
+
+class Telemetry:
+    # Process-wide aggregates: a duration histogram per stage, labelled counters and the most recent
+    # study traces. Recording a span is a couple of dict updates under a lock, so it stays on in
+    # production; the JSON log is only written when a path is configured.
+
+    def __init__(self, recent_size=50, json_log_path=None):
+        self.recent = deque(maxlen=recent_size)
+        self.json_log_path = json_log_path
+        self._log_file = None
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def start_study(self, study_id=None):
+        trace = StudyTrace(study_id)
+        with self._lock:
+            self.recent.append(trace)
+        return trace
+
+    def record_span(self, stage, seconds, trace=None):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = {"count": 0, "sum": 0.0, "buckets": [0] * (len(BUCKETS) + 1)}
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["buckets"][bisect_left(BUCKETS, seconds)] += 1
+            if trace is not None:
+                trace.stages[stage] = trace.stages.get(stage, 0.0) + seconds
+        self.log({"event": "span", "stage": stage, "duration_ms": seconds * 1000}, trace)
+
+    def increment(self, name, amount=1, trace=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if trace is not None:
+                trace.counters[name] = trace.counters.get(name, 0) + amount
+        self.log({"event": "counter", "name": name, "amount": amount, **labels}, trace)
+
+    def log(self, event, trace=None):
+        if not self.json_log_path:
+            return
+        event = {"time": time.time(), "trace_id": trace.trace_id if trace else None, **event}
+        line = json.dumps(event, default=str) + "\n"
+        with self._lock:
+            if self._log_file is None:
+                # Line buffered, so each event reaches the file whole even if the process dies.
+                self._log_file = open(self.json_log_path, "a", buffering=1)
+            self._log_file.write(line)
+
+    def counters(self):
+        with self._lock:
+            return {(name, labels): value for (name, labels), value in self._counters.items()}
+
+    def recent_studies(self, trace_ids=None):
+        with self._lock:
+            traces = list(self.recent)
+        if trace_ids is not None:
+            traces = [trace for trace in traces if trace.trace_id in trace_ids]
+        return [trace.to_dict() for trace in traces]
+
+    def prometheus_text(self):
+        # Prometheus text exposition format (version 0.0.4).
+        with self._lock:
+            stages = {stage: dict(histogram, buckets=list(histogram["buckets"])) for stage, histogram in self._stages.items()}
+            counters = dict(self._counters)
+
+        lines = [
+            "# HELP scanx_stage_duration_seconds Time spent in each analysis stage.",
+            "# TYPE scanx_stage_duration_seconds histogram"
+        ]
+        for stage, histogram in sorted(stages.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (float("inf"),), histogram["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'scanx_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'scanx_stage_duration_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+            lines.append(f'scanx_stage_duration_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE scanx_{name}_total counter")
+            for (counter_name, labels), value in sorted(counters.items()):
+                if counter_name == name:
+                    label_text = ",".join(f'{key}="{value_}"' for key, value_ in labels)
+                    lines.append(f"scanx_{name}_total{{{label_text}}} {value}" if label_text else f"scanx_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self.recent.clear()
+
+
+telemetry = Telemetry(json_log_path=os.environ.get("SCANX_TRACE_LOG"))
+
+
+def current_trace():
+    return _current_trace.get()
+
+def set_current_trace(trace):
+    # For callers without a natural scope, like a Streamlit rerun picking its session's study back up.
+    _current_trace.set(trace)
+
+def start_study(study_id=None):
+    # Starts a study trace and makes it current for this thread/task.
+    trace = telemetry.start_study(study_id)
+    _current_trace.set(trace)
+    return trace
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        telemetry.record_span(stage, time.perf_counter() - start, _current_trace.get())
+
+def record_span(stage, seconds):
+    telemetry.record_span(stage, seconds, _current_trace.get())
+
+def increment(name, amount=1, **labels):
+    telemetry.increment(name, amount, trace=_current_trace.get(), **labels)
+
+def bind_trace(coroutine):
+    # Coroutines scheduled onto another thread's event loop run in that loop's context; this carries
+    # the caller's current trace along.
+    trace = _current_trace.get()
+
+    async def bound():
+        _current_trace.set(trace)
+        return await coroutine
+    return bound()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = telemetry.prometheus_text().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/studies":
+            body = json.dumps(telemetry.recent_studies()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host="127.0.0.1", port=0):
+    # Serves GET /metrics (Prometheus text) and GET /studies (recent traces as JSON) on a background
+    # thread. Returns (server, url); call server.shutdown() when done.
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
@@ -0,0 +1,118 @@
+import torch
+
+from .telemetry import span
+
+
+DEFAULT_MODEL = "Salesforce/blip-vqa-base"
+
+STANDARD_QUESTIONS = [
+    "What abnormalities can be seen in this image?",
+    "Is there any pathology visible?",
+    "What might be the diagnosis based on this image?",
+    "Are there any concerning features in this image?",
+    "What is the main finding in this image?"
+]
+
+def encode_pixel_values(pixel_values, model):
+    # Alternative backends (see graph_backend.GraphBackendModel) provide their own encode/generate.
+    with span("vision_encoder"):
+        if hasattr(model, "encode_pixel_values"):
+            return model.encode_pixel_values(pixel_values)
+        with torch.no_grad():
+            image_embeds = model.vision_model(pixel_values=pixel_values.to(model.dtype))[0]
+    return image_embeds
+
+def encode_image(image, processor, model, image_hash=None):
+    # Runs the ViT vision encoder once so the embeddings can be reused for every question on the study.
+    # With a preprocess.FastBlipProcessor, image_hash lets a re-encode reuse the preprocessed tensor.
+    with span("preprocess"):
+        if image_hash is not None and hasattr(processor, "pixel_values"):
+            pixel_values = processor.pixel_values([image], [image_hash])
+        else:
+            pixel_values = processor(images=image, return_tensors="pt").pixel_values
+    return encode_pixel_values(pixel_values, model)
+
+def encode_questions(image_embeds, input_ids, attention_mask, model):
+    # The question encoder cross-attends to the image; its output is what the answer decoder attends to.
+    image_attention_mask = torch.ones(image_embeds.size()[:-1], dtype=torch.long)
+    with torch.no_grad():
+        return model.text_encoder(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            encoder_hidden_states=image_embeds,
+            encoder_attention_mask=image_attention_mask,
+            return_dict=False
+        )[0]
+
+def generate_answers(image_embeds, input_ids, attention_mask, model):
+    # image_embeds holds one row per question; padded question tokens are masked out of the
+    # decoder's cross-attention so a padded batch decodes exactly like one question at a time.
+    with span("decode"):
+        if hasattr(model, "generate_answers"):
+            return model.generate_answers(image_embeds, input_ids, attention_mask)
+    
+        question_embeds = encode_questions(image_embeds, input_ids, attention_mask, model)
+    
+        with torch.no_grad():
+            bos_ids = torch.full((question_embeds.size(0), 1), fill_value=model.config.text_config.bos_token_id)
+        
+            out = model.text_decoder.generate(
+                input_ids=bos_ids,
+                eos_token_id=model.config.text_config.sep_token_id,
+                pad_token_id=model.config.text_config.pad_token_id,
+                encoder_hidden_states=question_embeds,
+                encoder_attention_mask=attention_mask
+            )
+        return out
+
+def answer_question(image_embeds, question, processor, model):
+    inputs = processor(text=question, return_tensors="pt")
+    out = generate_answers(image_embeds, inputs.input_ids, inputs.attention_mask, model)
+    answer = processor.decode(out[0], skip_special_tokens=True)
+    return answer
+
+def answer_questions_batched(image_embeds, questions, processor, model, max_batch_size=8):
+    # image_embeds may hold one image (shared by every question) or one row per question.
+    if image_embeds.size(0) == 1:
+        image_embeds = image_embeds.expand(len(questions), -1, -1)
+    
+    # Sorting by length keeps padding inside each batch to a minimum.
+    order = sorted(range(len(questions)), key=lambda i: len(processor.tokenizer.tokenize(questions[i])))
+    answers = [None] * len(questions)
+    
+    for start in range(0, len(order), max_batch_size):
+        batch = order[start:start + max_batch_size]
+        inputs = processor(text=[questions[i] for i in batch], padding=True, return_tensors="pt")
+        out = generate_answers(image_embeds[batch], inputs.input_ids, inputs.attention_mask, model)
+        for i, answer in zip(batch, processor.batch_decode(out, skip_special_tokens=True)):
+            answers[i] = answer
+    return answers
+
+def perform_vqa(image, question, processor, model):
+    image_embeds = encode_image(image, processor, model)
+    return answer_question(image_embeds, question, processor, model)
+
+def answer_image_questions(image_embeds, questions_per_image, processor, model, max_batch_size=8):
+    # Flattens every (image, question) pair into shared decode batches and regroups the answers
+    # into one question->answer dict per image.
+    pairs = [(i, question) for i, questions in enumerate(questions_per_image) for question in questions]
+    results = [{} for _ in questions_per_image]
+    if not pairs:
+        return results
+    
+    answers = answer_questions_batched(
+        image_embeds[[i for i, _ in pairs]],
+        [question for _, question in pairs],
+        processor,
+        model,
+        max_batch_size=max_batch_size
+    )
+    
+    for (i, question), answer in zip(pairs, answers):
+        results[i][question] = answer
+    return results
+
+def perform_vqa_batch(images, questions, processor, model, max_batch_size=8):
+    # Answers every question for every image and returns one question->answer dict per image.
+    image_embeds = encode_image(images, processor, model)
+    return answer_image_questions(image_embeds, [questions] * len(images), processor, model, max_batch_size=max_batch_size)
@@ -0,0 +1,19 @@
+import pytest
+import torch
+from transformers import BlipConfig, BlipForQuestionAnswering, BlipImageProcessor, BlipProcessor, BertTokenizerFast
+
+from scanx.model_loading import BUNDLED_MODEL_DIR
+
+
+@pytest.fixture(scope="module")
+def tiny_blip():
+    # A small BLIP with random weights and the bundled tokenizer and image settings: it runs the same
+    # code paths as the full model, offline and at a fraction of the cost.
+    torch.manual_seed(0)
+    config = BlipConfig(
+        vision_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4, image_size=384, patch_size=32, initializer_range=0.5),
+        text_config=dict(vocab_size=30524, hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4, encoder_hidden_size=32, initializer_range=0.5)
+    )
+    model = BlipForQuestionAnswering(config).eval()
+    processor = BlipProcessor(BlipImageProcessor.from_pretrained(BUNDLED_MODEL_DIR), BertTokenizerFast.from_pretrained(BUNDLED_MODEL_DIR))
+    return processor, model
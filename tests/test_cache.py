@@ -0,0 +1,68 @@
+import os
+import time
+
+from scanx.cache import AnalysisCache, model_cache_key, weights_fingerprint
+
+
+def test_decoder_generation_config_changes_key(tiny_blip, tmp_path):
+    _, model = tiny_blip
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"))
+    old_key = model_cache_key(model)
+    cache.put_answers("image", {"Is there an effusion?": "no"}, old_key)
+
+    generation_config = model.text_decoder.generation_config
+    num_beams = generation_config.num_beams
+    generation_config.num_beams = num_beams + 2
+    try:
+        new_key = model_cache_key(model)
+    finally:
+        generation_config.num_beams = num_beams
+
+    assert new_key != old_key
+    assert cache.get_answers("image", ["Is there an effusion?"], new_key) == ({}, ["Is there an effusion?"])
+    assert model_cache_key(model) == old_key
+
+
+def test_generate_kwargs_change_key(tiny_blip):
+    _, model = tiny_blip
+
+    assert model_cache_key(model, answer_mode="closed_set") != model_cache_key(model)
+
+
+def test_weights_fingerprint_sees_rewritten_weights(tmp_path):
+    weights_path = tmp_path / "model.safetensors"
+    weights_path.write_bytes(b"\0" * 1024)
+    stat = os.stat(weights_path)
+    before = weights_fingerprint(str(tmp_path))
+
+    # Same size and modification time, different contents.
+    weights_path.write_bytes(b"\1" * 1024)
+    os.utime(weights_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert weights_fingerprint(str(tmp_path)) != before
+    assert weights_fingerprint(str(tmp_path / "missing")) is None
+
+
+def test_evicts_least_recently_used_past_max_bytes(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"), max_bytes=250, evict_every=1000)
+    for index in range(3):
+        cache.put_answers(f"image-{index}", {"q": "x" * 100}, "model")
+        time.sleep(0.01)
+    cache.get_answer("image-0", "q", "model")
+
+    cache.evict()
+
+    assert cache.get_answer("image-0", "q", "model") is not None
+    assert cache.get_answer("image-1", "q", "model") is None
+    assert cache.get_answer("image-2", "q", "model") is not None
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = AnalysisCache(str(tmp_path / "cache.sqlite"), max_age_seconds=0.05)
+    cache.put_answers("image", {"q": "a"}, "model")
+    assert cache.get_answer("image", "q", "model") == "a"
+
+    time.sleep(0.1)
+
+    assert cache.get_answer("image", "q", "model") is None
+    assert cache.stats()["answers_entries"] == 0
@@ -0,0 +1,78 @@
+import pytest
+
+from scanx.findings import FindingsEngine, extract_findings, extract_findings_batch
+
+FINDING_QUESTION = "What abnormalities can be seen in this image?"
+DIAGNOSIS_QUESTION = "What might be the diagnosis based on this image?"
+
+
+def concepts(findings):
+    return [finding["concept"] for finding in findings["findings"]]
+
+
+@pytest.mark.parametrize("answer", [
+    "no pleural effusion",
+    "without pleural effusion",
+    "negative for pleural effusion",
+    "lungs are free of pleural effusion",
+])
+def test_negated(answer):
+    findings = extract_findings({FINDING_QUESTION: answer})
+
+    assert concepts(findings) == []
+    assert findings["absent"] == ["Pleural effusion"]
+
+
+@pytest.mark.parametrize("answer", ["pleural effusion", "large pleural effusions", "there is a pleural effusion on the left"])
+def test_affirmed(answer):
+    findings = extract_findings({FINDING_QUESTION: answer})
+
+    assert concepts(findings) == ["Pleural effusion"]
+    assert findings["absent"] == []
+    assert findings["abnormal"] is True
+
+
+@pytest.mark.parametrize("answer", [
+    "no effusion, pneumonia in the right lower lobe",
+    "no effusion; pneumonia in the right lower lobe",
+    "no effusion but pneumonia in the right lower lobe",
+    "no effusion however pneumonia in the right lower lobe",
+    "no effusion. pneumonia in the right lower lobe",
+])
+def test_clause_break_ends_negation(answer):
+    findings = extract_findings({FINDING_QUESTION: answer})
+
+    assert concepts(findings) == ["Pneumonia"]
+    assert findings["absent"] == ["Pleural effusion"]
+
+
+def test_negation_covers_terms_joined_by_or():
+    findings = extract_findings({FINDING_QUESTION: "no pneumothorax or pleural effusion"})
+
+    assert concepts(findings) == []
+    assert sorted(findings["absent"]) == ["Pleural effusion", "Pneumothorax"]
+
+
+def test_negation_does_not_cross_answers():
+    findings = extract_findings({FINDING_QUESTION: "no pneumothorax", DIAGNOSIS_QUESTION: "pneumonia"})
+
+    assert concepts(findings) == ["Pneumonia"]
+    assert findings["diagnosis_concept"] == "Pneumonia"
+
+
+def test_affirmed_elsewhere_is_not_absent():
+    findings = extract_findings({FINDING_QUESTION: "no pneumonia", DIAGNOSIS_QUESTION: "pneumonia"})
+
+    assert concepts(findings) == ["Pneumonia"]
+    assert findings["absent"] == []
+
+
+def test_batch_matches_single_study():
+    studies = [
+        {FINDING_QUESTION: "no effusion, pneumonia in the right lower lobe"},
+        {FINDING_QUESTION: "normal chest", DIAGNOSIS_QUESTION: "no acute disease"},
+        {FINDING_QUESTION: "cardiomegaly but no edema"},
+    ]
+    engine = FindingsEngine()
+
+    assert extract_findings_batch(studies) == [engine.extract(study) for study in studies]
@@ -0,0 +1,37 @@
+import pytest
+import torch
+
+from scanx.export_graph import check_parity, synthetic_image
+from scanx.graph_backend import export_graph_backend, load_graph_backend
+from scanx.vqa import STANDARD_QUESTIONS, encode_pixel_values
+
+
+@pytest.fixture(scope="module")
+def eager(tiny_blip):
+    # The graphs are traced from the same modules as the full model, at a fraction of the export time.
+    return tiny_blip
+
+
+@pytest.fixture(scope="module")
+def graph(eager, tmp_path_factory):
+    graph_dir = tmp_path_factory.mktemp("graph")
+    export_graph_backend(*eager, str(graph_dir))
+    return load_graph_backend(str(graph_dir))
+
+
+def test_vision_embeddings_match(eager, graph):
+    processor, model = eager
+    pixel_values = processor(images=[synthetic_image(seed=0), synthetic_image(seed=1)], return_tensors="pt").pixel_values
+
+    expected = encode_pixel_values(pixel_values, model)
+    actual = graph[1].encode_pixel_values(pixel_values)
+
+    torch.testing.assert_close(actual, expected, atol=1e-4, rtol=1e-4)
+
+
+def test_answers_match(eager, graph):
+    images = [synthetic_image(seed=0), synthetic_image(size=256, seed=1)]
+
+    mismatches, _, _ = check_parity(images, STANDARD_QUESTIONS, eager, graph, repeat=1)
+
+    assert mismatches == []
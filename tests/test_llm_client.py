@@ -0,0 +1,232 @@
+import time
+from concurrent.futures import wait
+
+import pytest
+
+from scanx.explain import get_rule_based_analysis
+from scanx.llm_client import ExplanationClient, ExplanationDeadlineExceeded
+from scanx.telemetry import telemetry
+from scanx.stub_server import DEFAULT_STUB_TEXT, StubExplanationHandler, start_stub_server
+
+
+VQA_RESULTS = {
+    "Is there any pathology visible?": "yes",
+    "What is the main finding in this image?": "pleural effusion"
+}
+PATIENT = {"id": "TEST-001", "age": 60}
+MALFORMED_BODIES = [b"<html>upstream error</html>", b'[{"summary_text": "no generated_text"}]', b"[1]"]
+
+
+class MalformedHandler(StubExplanationHandler):
+    # Answers every request 200 with the server's raw `body`, labelled as JSON.
+
+    def respond(self, payload, attempt):
+        body = self.server.body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(**kwargs):
+        server, url = start_stub_server(**kwargs)
+        servers.append(server)
+        return server, url
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def client_factory():
+    clients = []
+
+    def create(url, **kwargs):
+        kwargs.setdefault("backoff", 0.01)
+        client = ExplanationClient(None, api_url=url, **kwargs)
+        clients.append(client)
+        return client
+    yield create
+    for client in clients:
+        client.close()
+
+
+def test_success(stub, client_factory):
+    server, url = stub()
+    client = client_factory(url)
+
+    explanation, source = client.submit(VQA_RESULTS, "X-ray", PATIENT).result(timeout=10)
+
+    assert (explanation, source) == (DEFAULT_STUB_TEXT, "llm")
+    assert server.requests == 1
+
+
+def test_retries_retryable_status(stub, client_factory):
+    server, url = stub(fail_first=2, fail_status=503)
+    client = client_factory(url, max_retries=2)
+
+    explanation, source = client.submit(VQA_RESULTS, "X-ray", PATIENT).result(timeout=10)
+
+    assert (explanation, source) == (DEFAULT_STUB_TEXT, "llm")
+    assert server.requests == 3
+
+
+def test_gives_up_after_max_retries(stub, client_factory):
+    server, url = stub(fail_first=10, fail_status=503)
+    client = client_factory(url, max_retries=2)
+
+    explanation, source = client.submit(VQA_RESULTS, "X-ray", PATIENT).result(timeout=10)
+
+    assert source == "rule_based"
+    assert explanation == get_rule_based_analysis(VQA_RESULTS, PATIENT)
+    assert server.requests == 3
+
+
+def test_does_not_retry_client_errors(stub, client_factory):
+    server, url = stub(fail_first=10, fail_status=400)
+    client = client_factory(url, max_retries=2)
+
+    _, source = client.submit(VQA_RESULTS, "X-ray", PATIENT).result(timeout=10)
+
+    assert source == "rule_based"
+    assert server.requests == 1
+
+
+@pytest.mark.parametrize("body", MALFORMED_BODIES)
+def test_malformed_response_falls_back(stub, client_factory, body):
+    server, url = stub(handler=MalformedHandler)
+    server.body = body
+    client = client_factory(url)
+
+    explanation, source = client.submit(VQA_RESULTS, "X-ray", PATIENT).result(timeout=10)
+
+    assert source == "rule_based"
+    assert explanation == get_rule_based_analysis(VQA_RESULTS, PATIENT)
+
+
+def test_timeout_falls_back_at_deadline(stub, client_factory):
+    _, url = stub(delay=3.0)
+    client = client_factory(url, read_timeout=30, deadline=0.5)
+
+    start = time.perf_counter()
+    explanation, source = client.submit(VQA_RESULTS, "X-ray", PATIENT).result(timeout=10)
+    elapsed = time.perf_counter() - start
+
+    assert source == "rule_based_deadline"
+    assert explanation == get_rule_based_analysis(VQA_RESULTS, PATIENT)
+    assert elapsed < 1.5
+
+
+def test_per_call_deadline_overrides_default(stub, client_factory):
+    _, url = stub(delay=1.0)
+    client = client_factory(url, deadline=0.2)
+
+    _, source = client.submit(VQA_RESULTS, "X-ray", PATIENT, deadline=5).result(timeout=10)
+
+    assert source == "llm"
+
+
+def test_attempt_timeout_is_capped_at_deadline(client_factory):
+    client = client_factory("http://127.0.0.1:9/", connect_timeout=3.05, read_timeout=30)
+
+    connect, read = client.attempt_timeout(time.monotonic() + 0.5)
+
+    assert connect <= 0.5 and read <= 0.5
+    with pytest.raises(ExplanationDeadlineExceeded):
+        client.attempt_timeout(time.monotonic() - 1)
+
+
+def test_concurrency_limit(stub, client_factory):
+    server, url = stub(delay=0.3)
+    client = client_factory(url, max_concurrency=2)
+
+    futures = [client.submit(VQA_RESULTS, "X-ray", PATIENT) for _ in range(6)]
+    results = [future.result(timeout=10) for future in futures]
+
+    assert all(source == "llm" for _, source in results)
+    assert server.requests == 6
+    assert server.max_active == 2
+
+
+def test_timed_out_requests_still_count_against_concurrency(stub, client_factory):
+    # Requests abandoned at their deadline keep their slot until the HTTP call returns, so a slow
+    # backend never sees more than max_concurrency requests at once.
+    server, url = stub(delay=0.5)
+    client = client_factory(url, max_concurrency=2, deadline=0.1, max_retries=0)
+
+    futures = [client.submit(VQA_RESULTS, "X-ray", PATIENT) for _ in range(6)]
+    wait(futures, timeout=10)
+    assert all(future.result()[1] == "rule_based_deadline" for future in futures)
+
+    time.sleep(1.0)
+    assert server.max_active <= 2
+
+
+def test_stream_success(stub, client_factory):
+    _, url = stub(token_delay=0.01)
+    client = client_factory(url)
+    telemetry.reset()
+
+    stream = client.stream(VQA_RESULTS, "X-ray", PATIENT)
+    chunks = list(stream)
+
+    assert stream.source == "llm"
+    assert "".join(chunks) == stream.text == DEFAULT_STUB_TEXT
+    assert stream.time_to_first_token is not None
+    assert 'scanx_stage_duration_seconds_count{stage="llm_ttft"} 1' in telemetry.prometheus_text()
+
+
+def test_slow_drip_stream_falls_back_at_deadline(stub, client_factory):
+    # Every chunk arrives well within a per-read timeout, but the whole stream would take ~5s.
+    _, url = stub(token_delay=0.2)
+    client = client_factory(url, read_timeout=30)
+
+    start = time.perf_counter()
+    stream = client.stream(VQA_RESULTS, "X-ray", PATIENT, deadline=1.0)
+    list(stream)
+    elapsed = time.perf_counter() - start
+
+    assert stream.source == "rule_based_deadline"
+    assert stream.text == get_rule_based_analysis(VQA_RESULTS, PATIENT)
+    assert elapsed < 1.5
+
+
+def test_stalled_stream_falls_back_at_deadline(stub, client_factory):
+    _, url = stub(delay=3.0)
+    client = client_factory(url, read_timeout=30)
+
+    start = time.perf_counter()
+    stream = client.stream(VQA_RESULTS, "X-ray", PATIENT, deadline=0.5)
+    list(stream)
+
+    assert stream.source == "rule_based_deadline"
+    assert time.perf_counter() - start < 1.0
+
+
+def test_stream_error_falls_back(stub, client_factory):
+    _, url = stub(fail_first=10, fail_status=500)
+    client = client_factory(url)
+
+    stream = client.stream(VQA_RESULTS, "X-ray", PATIENT)
+    list(stream)
+
+    assert stream.source == "rule_based"
+
+
+@pytest.mark.parametrize("body", MALFORMED_BODIES)
+def test_malformed_non_streaming_answer_falls_back(stub, client_factory, body):
+    # A backend without streaming answers a stream request with one JSON body.
+    server, url = stub(handler=MalformedHandler)
+    server.body = body
+    client = client_factory(url)
+
+    stream = client.stream(VQA_RESULTS, "X-ray", PATIENT)
+    list(stream)
+
+    assert stream.source == "rule_based"
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from scanx.pipeline import discover_studies
+
+
+def write_manifest(path, entries):
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in entries))
+    return path
+
+
+def test_manifest_study_ids_keep_directories_apart(tmp_path):
+    manifest = write_manifest(tmp_path / "studies.jsonl", [{"image": "a/x.jpg"}, {"image": "b/x.jpg"}, {"image": "c.png", "study_id": "S3"}])
+
+    studies = list(discover_studies(manifest))
+
+    assert [study["study_id"] for study in studies] == ["a/x", "b/x", "S3"]
+    assert studies[0]["image"] == str(tmp_path / "a" / "x.jpg")
+
+
+def test_manifest_rejects_duplicate_study_ids(tmp_path):
+    manifest = write_manifest(tmp_path / "studies.jsonl", [{"image": "a/x.jpg"}, {"image": "y.jpg", "study_id": "a/x"}])
+
+    with pytest.raises(ValueError, match=r"studies.jsonl:2: duplicate study_id 'a/x'"):
+        list(discover_studies(manifest))
+
+
+def test_manifest_requires_image(tmp_path):
+    manifest = write_manifest(tmp_path / "studies.jsonl", [{"study_id": "S1"}])
+
+    with pytest.raises(ValueError, match="studies.jsonl:1"):
+        list(discover_studies(manifest))
@@ -0,0 +1,76 @@
+import threading
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from transformers import BlipImageProcessor, BlipProcessor, BertTokenizerFast
+
+from scanx.model_loading import BUNDLED_MODEL_DIR
+from scanx.preprocess import FastBlipProcessor, ImagePreprocessor
+
+ATOL = 1e-6
+
+
+def random_image(mode, size=(300, 200), seed=0):
+    pixels = np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 4), dtype=np.uint8)
+    return Image.fromarray(pixels, "RGBA").convert(mode)
+
+
+@pytest.fixture(scope="module")
+def image_processor():
+    return BlipImageProcessor.from_pretrained(BUNDLED_MODEL_DIR)
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L", "RGBA"])
+def test_matches_blip_image_processor(image_processor, mode):
+    images = [random_image(mode, seed=0), random_image(mode, size=(384, 384), seed=1), random_image(mode, size=(1024, 512), seed=2)]
+
+    expected = image_processor(images=images, return_tensors="pt").pixel_values
+    actual = ImagePreprocessor(image_processor, cache_size=0).preprocess(images)
+
+    torch.testing.assert_close(actual, expected, atol=ATOL, rtol=0)
+
+
+def test_fast_processor_matches_blip_processor(image_processor):
+    processor = BlipProcessor(image_processor, BertTokenizerFast.from_pretrained(BUNDLED_MODEL_DIR))
+    fast = FastBlipProcessor(processor)
+    images = [random_image("RGB", seed=3), random_image("L", seed=4)]
+    questions = ["Is there any pathology visible?", "Is the heart enlarged?"]
+
+    expected = processor(images=images, text=questions, padding=True, return_tensors="pt")
+    actual = fast(images=images, text=questions, padding=True, return_tensors="pt")
+
+    torch.testing.assert_close(actual.pixel_values, expected.pixel_values, atol=ATOL, rtol=0)
+    assert torch.equal(actual.input_ids, expected.input_ids)
+    assert torch.equal(actual.attention_mask, expected.attention_mask)
+
+
+def test_cached_images_match_fresh_preprocessing(image_processor):
+    preprocessor = ImagePreprocessor(image_processor, cache_size=4)
+    images = [random_image("RGB", seed=5), random_image("RGB", seed=6)]
+
+    fresh = preprocessor.preprocess(images, ["a", "b"]).clone()
+    cached = preprocessor.preprocess(images[::-1], ["b", "a"])
+
+    assert preprocessor.stats()["hits"] == 2
+    torch.testing.assert_close(cached, fresh.flip(0), atol=0, rtol=0)
+
+
+def test_output_buffer_is_reused_per_thread(image_processor):
+    # Documented behaviour: the returned tensor is only valid until the same thread's next call.
+    preprocessor = ImagePreprocessor(image_processor, cache_size=0)
+    first = preprocessor.preprocess([random_image("RGB", seed=7)])
+    first_values = first.clone()
+    second = preprocessor.preprocess([random_image("RGB", seed=8)])
+
+    assert first.data_ptr() == second.data_ptr()
+    assert torch.equal(first, second)
+    assert not torch.equal(first_values, second)
+
+    other_thread = []
+    thread = threading.Thread(target=lambda: other_thread.append(preprocessor.preprocess([random_image("RGB", seed=9)])))
+    thread.start()
+    thread.join()
+    assert other_thread[0].data_ptr() != second.data_ptr()
+    assert torch.equal(second, first)
@@ -0,0 +1,72 @@
+import json
+
+import torch
+
+from scanx.calibrate_answers import fit_calibration
+from scanx.export_graph import synthetic_image
+from scanx.scoring import CLOSED_SET_ANSWERS, answer_nll, candidate_log_likelihoods, fit_temperature, load_calibration, score_answers
+from scanx.vqa import encode_image
+
+PATHOLOGY = "Is there any pathology visible?"
+DIAGNOSIS = "What might be the diagnosis based on this image?"
+
+
+def test_fit_temperature_softens_overconfident_scores():
+    # Right 60% of the time, but always with a 10-nat margin.
+    log_likelihoods = [torch.tensor([0.0, -10.0]) if i % 5 < 3 else torch.tensor([-10.0, 0.0]) for i in range(50)]
+    labels = [0] * 50
+
+    temperature = fit_temperature(log_likelihoods, labels)
+
+    assert temperature > 5
+    assert answer_nll(log_likelihoods, labels, temperature) < answer_nll(log_likelihoods, labels)
+
+
+def test_load_calibration(tmp_path):
+    assert load_calibration(str(tmp_path / "missing.json")) == {"temperature": 1.0, "length_normalize": False, "fitted": False}
+
+    path = tmp_path / "calibration.json"
+    path.write_text(json.dumps({"temperature": 2.5, "length_normalize": True, "nll": 0.4}))
+    calibration = load_calibration(str(path))
+
+    assert (calibration["temperature"], calibration["length_normalize"], calibration["fitted"]) == (2.5, True, True)
+
+
+def test_length_normalize_averages_per_token(tiny_blip):
+    processor, model = tiny_blip
+    image_embeds = encode_image(synthetic_image(seed=0), processor, model)
+    candidates = CLOSED_SET_ANSWERS[DIAGNOSIS]
+
+    summed, = candidate_log_likelihoods(image_embeds, [DIAGNOSIS], [candidates], processor, model)
+    averaged, = candidate_log_likelihoods(image_embeds, [DIAGNOSIS], [candidates], processor, model, length_normalize=True)
+
+    # Answer tokens plus the [SEP] that ends the answer.
+    lengths = torch.tensor([len(processor.tokenizer.tokenize(candidate)) + 1 for candidate in candidates], dtype=torch.float32)
+    torch.testing.assert_close(averaged, summed / lengths)
+
+
+def test_fit_calibration_on_labelled_images(tiny_blip, tmp_path):
+    processor, model = tiny_blip
+    items = []
+    for seed in range(4):
+        image_path = tmp_path / f"image-{seed}.png"
+        synthetic_image(size=128, seed=seed).save(image_path)
+        items.append({"image": str(image_path), "question": PATHOLOGY, "answer": "yes" if seed % 2 else "No"})
+        items.append({"image": str(image_path), "question": DIAGNOSIS, "answer": "pleural effusion"})
+    # Neither a closed-set question nor a known candidate: both skipped.
+    items.append({"image": items[0]["image"], "question": "Where is the opacity?", "answer": "left"})
+    items.append({"image": items[0]["image"], "question": PATHOLOGY, "answer": "maybe"})
+
+    calibration = fit_calibration(items, processor, model)
+
+    assert calibration["items"] == 8
+    assert calibration["nll"] <= calibration["uncalibrated_nll"] + 1e-9
+    _, scores = score_answers(
+        encode_image(synthetic_image(seed=0), processor, model),
+        [PATHOLOGY, DIAGNOSIS],
+        processor,
+        model,
+        temperature=calibration["temperature"],
+        length_normalize=calibration["length_normalize"]
+    )
+    assert all(abs(sum(question_scores.values()) - 1) < 1e-5 for question_scores in scores)
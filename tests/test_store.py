@@ -0,0 +1,61 @@
+import sqlite3
+import zipfile
+
+import pytest
+
+from scanx.store import StudyStore
+
+
+def study(study_id, patient_id="P1", study_date="2024-01-02", modality="X-ray"):
+    return {
+        "study_id": study_id,
+        "patient_info": {"id": patient_id, "name": "Test Patient", "study_date": study_date},
+        "image_type": modality,
+        "anatomical_region": "Chest",
+        "modality_details": "PA",
+        "answers": {"Is there any pathology visible?": "no"},
+        "explanation": "No acute cardiopulmonary abnormality."
+    }
+
+
+def test_failed_flush_keeps_pending_studies(tmp_path, monkeypatch):
+    store = StudyStore(str(tmp_path / "studies.sqlite"), batch_size=100)
+    store.add(study("S1"))
+    store.add(study("S2"))
+
+    write = store._write
+    def locked(rows):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(store, "_write", locked)
+    with pytest.raises(sqlite3.OperationalError):
+        store.flush()
+    assert store.stats()["pending"] == 2
+
+    monkeypatch.setattr(store, "_write", write)
+    store.add(study("S3"))
+    store.flush()
+
+    assert store.stats() == {"studies": 3, "patients": 1, "reports": 0, "pending": 0}
+
+
+def test_add_writes_in_batches(tmp_path):
+    store = StudyStore(str(tmp_path / "studies.sqlite"), batch_size=2)
+    with store:
+        for index in range(3):
+            store.add(study(f"S{index}"))
+        assert store.stats()["studies"] == 2
+
+    assert store.stats()["studies"] == 3
+
+
+def test_find_and_export(tmp_path):
+    store = StudyStore(str(tmp_path / "studies.sqlite"))
+    store.save_many([study("S1"), study("S2", study_date="2024-03-04"), study("S3", patient_id="P2", modality="CT scan")])
+
+    found = store.find(patient_id="P1", modality="x-ray", date_from="2024-02-01")
+    assert [row["study_id"] for row in found] == ["S2"]
+
+    output = tmp_path / "reports.zip"
+    store.export_zip(store.find(patient_id="P1"), str(output))
+    assert sorted(zipfile.ZipFile(output).namelist()) == ["P1/2024-01-02_S1.md", "P1/2024-03-04_S2.md"]
+    assert store.stats()["reports"] == 2
@@ -0,0 +1,46 @@
+import pytest
+import torch
+
+from scanx.export_graph import synthetic_image
+from scanx.vqa import STANDARD_QUESTIONS, answer_image_questions, answer_questions_batched, encode_image
+
+QUESTIONS = STANDARD_QUESTIONS + ["Is the heart enlarged?", "Where is the opacity located in the left lower lobe of the lung?"]
+
+
+def per_question_answers(image, questions, processor, model):
+    # The original path: the full model runs once per question, vision encoder included.
+    answers = []
+    for question in questions:
+        inputs = processor(images=image, text=question, return_tensors="pt")
+        with torch.no_grad():
+            out = model.generate(**inputs)
+        answers.append(processor.decode(out[0], skip_special_tokens=True))
+    return answers
+
+
+@pytest.fixture(scope="module")
+def images():
+    return [synthetic_image(seed=0), synthetic_image(size=256, seed=1), synthetic_image(size=384, seed=2)]
+
+
+@pytest.fixture(scope="module")
+def expected(tiny_blip, images):
+    return [per_question_answers(image, QUESTIONS, *tiny_blip) for image in images]
+
+
+@pytest.mark.parametrize("max_batch_size", [3, 8])
+def test_batched_decode_matches_per_question_generate(tiny_blip, images, expected, max_batch_size):
+    processor, model = tiny_blip
+
+    for image, image_answers in zip(images, expected):
+        image_embeds = encode_image(image, processor, model)
+        assert answer_questions_batched(image_embeds, QUESTIONS, processor, model, max_batch_size=max_batch_size) == image_answers
+
+
+def test_multi_image_batches_match_per_question_generate(tiny_blip, images, expected):
+    processor, model = tiny_blip
+    image_embeds = encode_image(images, processor, model)
+
+    results = answer_image_questions(image_embeds, [QUESTIONS] * len(images), processor, model, max_batch_size=8)
+
+    assert results == [dict(zip(QUESTIONS, image_answers)) for image_answers in expected]